@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Block apply benchmark - connecting a large block to the UTXO set
+"""
+
+import gc
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.models import Block, OutPoint, Transaction, TxInput, TxOutput, UTXO
+from xorcoin.core.serialization import TX_VERSION_BINARY
+from xorcoin.core.undo import BlockUndo
+from xorcoin.core.utxo_threadsafe import ThreadSafeUTXOSet
+
+
+def apply_per_coin(utxo_set: ThreadSafeUTXOSet, block: Block) -> BlockUndo:
+    """The previous _process_block loop, kept here as the baseline"""
+    undo = BlockUndo()
+    for tx in block.transactions:
+        spent = []
+        for inp in tx.inputs:
+            utxo_id = inp.get_utxo_id()
+            utxo = utxo_set.get_utxo(utxo_id)
+            if utxo is not None:
+                spent.append(utxo)
+                utxo_set.remove_utxo(utxo_id)
+        txid = tx.get_txid()
+        for idx, out in enumerate(tx.outputs):
+            utxo = UTXO(OutPoint(txid, idx), out.amount, out.script_pubkey)
+            overwritten = utxo_set.get_utxo(utxo.outpoint)
+            if overwritten is not None:
+                spent.append(overwritten)
+            utxo_set.add_utxo(utxo)
+        undo.spent.append(spent)
+    return undo
+
+
+def apply_batched(utxo_set: ThreadSafeUTXOSet, block: Block) -> BlockUndo:
+    return utxo_set.apply_block(block)
+
+
+def make_block(coins: list, tx_count: int, chain_every: int) -> Block:
+    """
+    One coinbase plus tx_count 1-in/2-out transactions
+
+    Every chain_every-th of them (none if 0) spends an output created
+    earlier in the same block instead of a coin from the set.
+    """
+    txs = [Transaction(version=TX_VERSION_BINARY, chain_id=1, inputs=[],
+                       outputs=[TxOutput(amount=50, script_pubkey="miner")])]
+    fresh = []
+    for i in range(tx_count):
+        if chain_every and fresh and i % chain_every == 0:
+            prev_out, amount = fresh.pop()
+        else:
+            prev_out, amount = coins[i], 1000
+        tx = Transaction(
+            version=TX_VERSION_BINARY, chain_id=1,
+            inputs=[TxInput(prev_out)],
+            outputs=[TxOutput(amount=amount // 2, script_pubkey=f"addr{i % 500}"),
+                     TxOutput(amount=amount // 2 - 1, script_pubkey=f"addr{(i + 7) % 500}")],
+            timestamp=i,
+        )
+        txs.append(tx)
+        fresh.append((OutPoint(tx.get_txid(), 0), amount // 2))
+    return Block(height=1, prev_block_hash="0" * 64, transactions=txs)
+
+
+def run(apply, tx_count: int, chain_every: int, rounds: int = 5) -> float:
+    best = float('inf')
+    for _ in range(rounds):
+        utxo_set = ThreadSafeUTXOSet()
+        coins = []
+        for i in range(tx_count):
+            utxo = UTXO(OutPoint(os.urandom(32), 0), 1000, f"addr{i % 500}")
+            utxo_set.add_utxo(utxo)
+            coins.append(utxo.outpoint)
+        utxo_set.publish()
+        block = make_block(coins, tx_count, chain_every)
+        # Don't bill the setup's garbage to the timed apply
+        gc.collect()
+
+        start = time.perf_counter()
+        apply(utxo_set, block)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    tx_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print(f"=== Block Apply ({tx_count:,} transactions) ===\n")
+    print(f"{'Block':<24} {'per-coin':>10} {'batched':>10} {'speedup':>9}")
+    for name, chain_every in [("independent txs", 0), ("25% chained spends", 4)]:
+        baseline = run(apply_per_coin, tx_count, chain_every)
+        batched = run(apply_batched, tx_count, chain_every)
+        print(f"{name:<24} {baseline * 1000:>8.1f}ms {batched * 1000:>8.1f}ms "
+              f"{baseline / batched:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
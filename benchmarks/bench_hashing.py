@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Hashing throughput benchmark - legacy JSON vs binary consensus encoding
+"""
+
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.models import Transaction, OutPoint, TxInput, TxOutput, Block
+from xorcoin.core.serialization import TX_VERSION_BINARY, BLOCK_VERSION_BINARY
+
+
+def make_transaction(version: int, n_inputs: int = 2, n_outputs: int = 2) -> Transaction:
+    """Build a representative signed-size transaction"""
+    return Transaction(
+        version=version,
+        chain_id=1,
+        inputs=[
+            TxInput(
+                prev_out=OutPoint(i.to_bytes(32, 'big'), i),
+                signature=b'\x30' * 71,
+                pubkey=b'\x04' * 174
+            ) for i in range(n_inputs)
+        ],
+        outputs=[
+            TxOutput(amount=1000 + i, script_pubkey=f"{i:040x}")
+            for i in range(n_outputs)
+        ]
+    )
+
+
+def make_block(version: int) -> Block:
+    return Block(
+        version=version,
+        height=1234,
+        prev_block_hash="ab" * 32,
+        merkle_root="cd" * 32,
+        difficulty=4
+    )
+
+
+def uncached_txid(tx: Transaction) -> str:
+    """txid computation with the memoized value dropped first"""
+    tx._contents_changed()
+    return tx.get_hash()
+
+
+def uncached_header_hash(block: Block) -> str:
+    """Header hash computation with the memoized value dropped first"""
+    block.nonce = block.nonce
+    return block.get_header_hash()
+
+
+def measure(label: str, fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    rate = iterations / elapsed
+    print(f"  {label:<28} {rate:>12,.0f} ops/s")
+    return rate
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    print(f"=== Hashing benchmark ({iterations:,} iterations) ===\n")
+
+    legacy_tx = make_transaction(version=2)
+    binary_tx = make_transaction(version=TX_VERSION_BINARY)
+    legacy_block = make_block(version=1)
+    binary_block = make_block(version=BLOCK_VERSION_BINARY)
+
+    print("txid (get_hash):")
+    before = measure("legacy JSON (v2)", lambda: uncached_txid(legacy_tx), iterations)
+    after = measure("binary (v3)", lambda: uncached_txid(binary_tx), iterations)
+    print(f"  speedup: {after / before:.1f}x\n")
+
+    print("sighash preimage (serialize_for_signing):")
+    before = measure("legacy JSON (v2)", lambda: legacy_tx.serialize_for_signing(0), iterations)
+    after = measure("binary (v3)", lambda: binary_tx.serialize_for_signing(0), iterations)
+    print(f"  speedup: {after / before:.1f}x\n")
+
+    print("header hash (get_header_hash):")
+    before = measure("legacy JSON (v1)", lambda: uncached_header_hash(legacy_block), iterations)
+    after = measure("binary (v2)", lambda: uncached_header_hash(binary_block), iterations)
+    print(f"  speedup: {after / before:.1f}x\n")
+
+    print("encoded size of sample transaction:")
+    print(f"  repr (str(tx)):   {len(str(binary_tx).encode()):>6} bytes")
+    print(f"  binary serialize: {len(binary_tx.serialize()):>6} bytes")
+
+
+if __name__ == "__main__":
+    main()
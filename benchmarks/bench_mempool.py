@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Mempool benchmark - filling a full mempool, evicting, mining and block templates
+"""
+
+import sys
+import os
+import heapq
+import random
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.mempool import Mempool
+from xorcoin.core.models import OutPoint, Transaction, TxInput, TxOutput
+from xorcoin.core.serialization import TX_VERSION_BINARY
+
+
+class HeapMempool:
+    """The previous heap-based mempool, kept here as the baseline"""
+
+    def __init__(self, max_size: int):
+        self.transactions = {}
+        self.tx_by_fee = []  # Min heap of (-fee_per_byte, tx_hash)
+        self.current_size = 0
+        self.max_size = max_size
+
+    def add_transaction(self, tx: Transaction, fee: int) -> bool:
+        tx_hash = tx.get_hash()
+        tx_size = tx.serialized_size
+        fee_rate = fee / tx_size
+        if self.current_size + tx_size > self.max_size:
+            if not self._make_room(tx_size, fee_rate):
+                return False
+        self.transactions[tx_hash] = tx
+        heapq.heappush(self.tx_by_fee, (-fee_rate, tx_hash))
+        self.current_size += tx_size
+        return True
+
+    def _make_room(self, needed_size: int, new_fee_rate: float) -> bool:
+        evicted_size = 0
+        to_evict = []
+        temp_heap = []
+        while self.tx_by_fee and evicted_size < needed_size:
+            neg_fee_rate, tx_hash = heapq.heappop(self.tx_by_fee)
+            if -neg_fee_rate < new_fee_rate:
+                to_evict.append(tx_hash)
+                if tx_hash in self.transactions:
+                    evicted_size += self.transactions[tx_hash].serialized_size
+            else:
+                temp_heap.append((neg_fee_rate, tx_hash))
+        for item in temp_heap:
+            heapq.heappush(self.tx_by_fee, item)
+        if evicted_size >= needed_size:
+            for tx_hash in to_evict:
+                self.transactions.pop(tx_hash, None)
+            return True
+        return False
+
+    def remove_transaction(self, tx_hash: str) -> None:
+        # As mine_block did: the heap entry is left behind
+        self.transactions.pop(tx_hash, None)
+
+
+def make_transactions(count: int):
+    rng = random.Random(1)
+    txs = []
+    for i in range(count):
+        tx = Transaction(
+            version=TX_VERSION_BINARY, chain_id=1,
+            inputs=[TxInput(OutPoint(rng.randbytes(32), 0))],
+            outputs=[TxOutput(amount=1000, script_pubkey=f"addr{i % 500}")],
+            timestamp=i,
+        )
+        tx.get_hash()
+        txs.append((tx, rng.randint(10, 10_000)))
+    return txs
+
+
+def run(mempool_cls, txs, max_size: int):
+    mempool = mempool_cls(max_size=max_size)
+    start = time.perf_counter()
+    accepted = sum(mempool.add_transaction(tx, fee) for tx, fee in txs)
+    fill = time.perf_counter() - start
+
+    # Remove half the pool, as mining blocks would
+    hashes = list(mempool.transactions)
+    start = time.perf_counter()
+    for tx_hash in hashes[:len(hashes) // 2]:
+        mempool.remove_transaction(tx_hash)
+    remove = time.perf_counter() - start
+
+    actual = sum(tx.serialized_size for tx in mempool.transactions.values())
+    return fill, remove, accepted, mempool.current_size, actual
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    txs = make_transactions(count)
+    # Room for a quarter of them, so most arrivals evict something
+    max_size = sum(tx.serialized_size for tx, _ in txs) // 4
+
+    print(f"=== Mempool ({count:,} transactions, {max_size:,} byte limit) ===\n")
+    print(f"{'Mempool':<10} {'fill':>10} {'remove':>10} {'accepted':>9} {'current_size':>13} {'actual':>10}")
+    for name, mempool_cls in [("heap", HeapMempool), ("indexed", Mempool)]:
+        fill, remove, accepted, current, actual = run(mempool_cls, txs, max_size)
+        print(f"{name:<10} {fill * 1000:>8.1f}ms {remove * 1000:>8.1f}ms {accepted:>9,} "
+              f"{current:>13,} {actual:>10,}")
+
+    # Block template from the whole set, then again with nothing changed
+    mempool = Mempool()
+    for tx, fee in txs:
+        mempool.add_transaction(tx, fee)
+    start = time.perf_counter()
+    template = mempool.get_block_template()
+    assemble = time.perf_counter() - start
+    start = time.perf_counter()
+    mempool.get_block_template()
+    cached = time.perf_counter() - start
+    print(f"\nBlock template: {len(template.transactions):,} of {len(mempool):,} transactions, "
+          f"{template.size:,} bytes, {template.fees:,} fees")
+    print(f"  assembled in {assemble * 1000:.1f}ms, reused in {cached * 1000:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Single-core mining hashrate benchmark
+"""
+
+import sys
+import os
+import time
+import secrets
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.models import Block
+from xorcoin.core.mining import HeaderTemplate, ParallelMiner, scan_nonces
+
+
+def make_block(version: int = 2) -> Block:
+    return Block(
+        version=version,
+        height=1234,
+        prev_block_hash="ab" * 32,
+        merkle_root="cd" * 32,
+        difficulty=64  # Unreachable, so every nonce is attempted
+    )
+
+
+def naive_rate(block: Block, attempts: int) -> float:
+    """Previous loop: random nonce, full header re-serialization per attempt"""
+    target = "0" * block.difficulty
+    start = time.perf_counter()
+    for _ in range(attempts):
+        block.nonce = secrets.randbits(32)
+        block.get_header_hash().startswith(target)
+    return attempts / (time.perf_counter() - start)
+
+
+def midstate_rate(block: Block, attempts: int) -> float:
+    template = HeaderTemplate.from_block(block)
+    start = time.perf_counter()
+    scan_nonces(template, b'\x00' * 32, 0, attempts)
+    return attempts / (time.perf_counter() - start)
+
+
+def parallel_rates(block: Block, attempts: int, workers: int):
+    template = HeaderTemplate.from_block(block)
+    with ParallelMiner(workers) as miner:
+        result = miner.search(template, b'\x00' * 32, attempts * workers)
+    return result.hashrate, result.worker_hashrates
+
+
+def main():
+    attempts = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    print(f"=== Mining benchmark ({attempts:,} nonces) ===\n")
+    for version, label in ((1, "legacy JSON header"), (2, "binary header")):
+        before = naive_rate(make_block(version), attempts)
+        after = midstate_rate(make_block(version), attempts)
+        print(f"{label}:")
+        print(f"  per-nonce re-hash:  {before:>12,.0f} H/s")
+        print(f"  midstate engine:    {after:>12,.0f} H/s")
+        print(f"  speedup: {after / before:.1f}x\n")
+
+    total, per_worker = parallel_rates(make_block(), attempts, workers)
+    print(f"ParallelMiner, binary header, {workers} workers:")
+    print(f"  aggregate:          {total:>12,.0f} H/s")
+    for worker_id, rate in enumerate(per_worker):
+        print(f"  worker {worker_id:<3}         {rate:>12,.0f} H/s")
+
+
+if __name__ == "__main__":
+    main()
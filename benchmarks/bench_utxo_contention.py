@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+UTXO set contention benchmark - many readers and writers on one set
+"""
+
+import sys
+import os
+import random
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.models import OutPoint, UTXO
+from xorcoin.core.utxo_threadsafe import ThreadSafeUTXOSet
+
+
+class GlobalRWLock:
+    """The previous single RWLock, kept here as the baseline (reader-preferring)"""
+
+    def __init__(self):
+        self._read_ready = threading.Condition(threading.RLock())
+        self._readers = 0
+
+    def read(self):
+        return self._ReadLock(self)
+
+    def write(self):
+        return self._WriteLock(self)
+
+    class _ReadLock:
+        def __init__(self, rwlock):
+            self.rwlock = rwlock
+
+        def __enter__(self):
+            with self.rwlock._read_ready:
+                self.rwlock._readers += 1
+
+        def __exit__(self, *args):
+            with self.rwlock._read_ready:
+                self.rwlock._readers -= 1
+                if self.rwlock._readers == 0:
+                    self.rwlock._read_ready.notify_all()
+
+    class _WriteLock:
+        def __init__(self, rwlock):
+            self.rwlock = rwlock
+
+        def __enter__(self):
+            self.rwlock._read_ready.acquire()
+            while self.rwlock._readers > 0:
+                self.rwlock._read_ready.wait()
+
+        def __exit__(self, *args):
+            self.rwlock._read_ready.release()
+
+
+def global_lock_set() -> ThreadSafeUTXOSet:
+    """One shard behind one shared lock, as before striping"""
+    utxo_set = ThreadSafeUTXOSet(stripes=1)
+    lock = GlobalRWLock()
+    utxo_set.shard_locks = [lock]
+    utxo_set.index_locks = [GlobalRWLock()]
+    return utxo_set
+
+
+def populate(utxo_set: ThreadSafeUTXOSet, coins: int, addresses: list) -> list:
+    outpoints = []
+    for i in range(coins):
+        outpoint = OutPoint(os.urandom(32), i % 2)
+        utxo_set.add_utxo(UTXO(outpoint, 1000, addresses[i % len(addresses)]))
+        outpoints.append(outpoint)
+    return outpoints
+
+
+def run(utxo_set: ThreadSafeUTXOSet, seconds: float, readers: int, writers: int,
+        coins: int = 50_000) -> dict:
+    addresses = [os.urandom(20).hex() for _ in range(1000)]
+    outpoints = populate(utxo_set, coins, addresses)
+    stop = threading.Event()
+    read_ops = [0] * readers
+    write_latencies = [[] for _ in range(writers)]
+
+    def reader(n):
+        rng = random.Random(n)
+        ops = 0
+        while not stop.is_set():
+            utxo_set.get_utxo(outpoints[rng.randrange(coins)])
+            utxo_set.get_balance(addresses[rng.randrange(len(addresses))])
+            ops += 2
+        read_ops[n] = ops
+
+    def writer(n):
+        rng = random.Random(1000 + n)
+        # Each writer owns a disjoint slice of the coins it spends
+        mine = outpoints[n::writers]
+        while not stop.is_set() and len(mine) >= 2:
+            spent = [mine.pop(rng.randrange(len(mine))) for _ in range(2)]
+            created = [
+                UTXO(OutPoint(os.urandom(32), 0), 999, addresses[rng.randrange(len(addresses))])
+                for _ in range(2)
+            ]
+            start = time.perf_counter()
+            utxo_set.batch_update(created, spent)
+            write_latencies[n].append(time.perf_counter() - start)
+            mine.extend(utxo.outpoint for utxo in created)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(lat for per_writer in write_latencies for lat in per_writer)
+    return {
+        'reads': sum(read_ops) / seconds,
+        'writes': len(latencies) / seconds,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('inf'),
+        'max_ms': latencies[-1] * 1000 if latencies else float('inf'),
+    }
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    print(f"=== UTXO Set Contention ({readers} readers, {writers} writers, {seconds:.0f}s) ===\n")
+    print(f"{'Variant':<22} {'reads/s':>12} {'writes/s':>10} {'write p99':>11} {'write max':>11}")
+
+    variants = [
+        ("global RWLock", global_lock_set),
+        ("striped x16", lambda: ThreadSafeUTXOSet(stripes=16)),
+        ("striped x64", lambda: ThreadSafeUTXOSet(stripes=64)),
+    ]
+    for name, make_set in variants:
+        result = run(make_set(), seconds, readers, writers)
+        print(f"{name:<22} {result['reads']:>12,.0f} {result['writes']:>10,.0f} "
+              f"{result['p99_ms']:>9.2f}ms {result['max_ms']:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+UTXO set memory benchmark - per-entry footprint of the coin index
+"""
+
+import sys
+import os
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xorcoin.core.coin_map import CoinMap
+from xorcoin.core.models import OutPoint, UTXO
+from xorcoin.core.utxo_threadsafe import ThreadSafeUTXOSet
+
+
+@dataclass
+class DataclassUTXO:
+    """The previous @dataclass UTXO, kept here as the baseline"""
+    tx_hash: str
+    output_index: int
+    amount: int
+    script_pubkey: str
+
+    def get_id(self) -> str:
+        return f"{self.tx_hash}:{self.output_index}"
+
+
+def fill(make_utxo, count: int, outputs_per_tx: int = 2, utxos=None):
+    """Build a coin index shaped like the one ThreadSafeUTXOSet keeps"""
+    utxos = {} if utxos is None else utxos
+    for i in range(count // outputs_per_tx):
+        txid = os.urandom(32)
+        tx_hash = txid.hex()
+        for idx in range(outputs_per_tx):
+            utxo = make_utxo(txid, tx_hash, idx, 100_000 + i, os.urandom(20).hex())
+            utxos[utxo.get_id()] = utxo
+    return utxos
+
+
+def fill_set(count: int, outputs_per_tx: int = 2, coins_per_address: int = 100) -> ThreadSafeUTXOSet:
+    """The whole in-memory set: coin shards plus the address index"""
+    addresses = [os.urandom(20).hex() for _ in range(max(1, count // coins_per_address))]
+    utxo_set = ThreadSafeUTXOSet()
+    for i in range(count // outputs_per_tx):
+        txid = os.urandom(32)
+        utxo_set.batch_update([
+            UTXO(OutPoint(txid, idx), 100_000 + i, addresses[i % len(addresses)])
+            for idx in range(outputs_per_tx)
+        ], [])
+    # Publishing drops the overlay kept for the previous snapshot
+    utxo_set.publish()
+    return utxo_set
+
+
+def make_dataclass_utxo(txid, tx_hash, idx, amount, script_pubkey):
+    # Old layout: hex hash shared by a tx's outputs, f"{hash}:{idx}" key
+    return DataclassUTXO(tx_hash, idx, amount, script_pubkey)
+
+
+def make_utxo(txid, tx_hash, idx, amount, script_pubkey):
+    # Tuple layout: the OutPoint is both the key and part of the value
+    return UTXO(OutPoint(txid, idx), amount, script_pubkey)
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    data = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del data
+    return after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+    print(f"=== UTXO memory benchmark ({count:,} coins) ===\n")
+
+    before = measure(lambda: fill(make_dataclass_utxo, count))
+    tuples = measure(lambda: fill(make_utxo, count))
+    # CoinMap rebuilds the UTXO on read, so storing one only keeps bytes
+    packed = measure(lambda: fill(make_utxo, count, utxos=CoinMap()))
+    # Addresses are shared here, as they are in practice
+    whole = measure(lambda: fill_set(count))
+
+    print(f"  dataclass UTXO + str key:  {before / count:>8.1f} bytes/coin")
+    print(f"  UTXO + OutPoint key:       {tuples / count:>8.1f} bytes/coin")
+    print(f"  CoinMap (packed bytes):    {packed / count:>8.1f} bytes/coin")
+    print(f"  reduction: {100 * (1 - packed / before):.0f}%")
+    print(f"\n  ThreadSafeUTXOSet incl. address index: {whole / count:>8.1f} bytes/coin")
+
+
+if __name__ == "__main__":
+    main()
@@ -187,7 +187,9 @@ class PersonalPreMiner:
         
         # Override the genesis block to use my address
         genesis_tx = self.xorcoin.blockchain.chain[0].transactions[0]
-        genesis_tx.outputs[0].script_pubkey = self.my_wallet['address']
+        genesis_tx.outputs[0] = genesis_tx.outputs[0]._replace(
+            script_pubkey=self.my_wallet['address']
+        )
         
         # Re-process genesis block to update UTXO set
         self.xorcoin.utxo_set = self.xorcoin.utxo_set.__class__()  # Reset UTXO set
@@ -28,4 +28,7 @@ setup(
         "cryptography>=41.0.0",
         "ecdsa>=0.18.0",
     ],
+    extras_require={
+        "analytics": ["numpy>=1.22"],
+    },
 )
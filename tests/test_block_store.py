@@ -0,0 +1,211 @@
+"""
+Append-only block store and its crash recovery
+"""
+
+import os
+
+from xorcoin.core import Block, Blockchain, Transaction, TxOutput
+from xorcoin.storage import BlockStore
+
+
+def make_block(height: int, tag: str = "") -> Block:
+    tx = Transaction(outputs=[TxOutput(50, f"miner{tag}{height}")], timestamp=height)
+    block = Block(height=height, timestamp=1700000000 + height, transactions=[tx])
+    block.merkle_root = block.calculate_merkle_root()
+    return block
+
+
+def fill(store: BlockStore, count: int, tag: str = ""):
+    blocks = [make_block(len(store) + i, tag) for i in range(count)]
+    for block in blocks:
+        store.append(block)
+    return blocks
+
+
+def hashes(blocks):
+    return [block.get_header_hash() for block in blocks]
+
+
+def reopen(store: BlockStore, **kwargs) -> BlockStore:
+    store.close()
+    return BlockStore(store.data_dir, **kwargs)
+
+
+def test_blocks_survive_reopen(tmp_path):
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 5)
+    store = reopen(store)
+    try:
+        assert len(store) == 5
+        assert store.hashes == hashes(blocks)
+        for height, block in enumerate(blocks):
+            assert store[height] == block
+            assert store.get_block(block.get_header_hash()) == block
+            assert store.get_entry(block.get_header_hash()).height == height
+            assert Block.deserialize(store.read_raw(block.get_header_hash())) == block
+        assert hashes(store[1:3]) == hashes(blocks[1:3])
+        assert hashes(store) == hashes(blocks)
+        assert store.get_block("00" * 32) is None
+    finally:
+        store.close()
+
+
+def test_reads_beyond_the_decoded_cache(tmp_path):
+    store = BlockStore(str(tmp_path), cache_size=2)
+    try:
+        blocks = fill(store, 6)
+        assert hashes(store) == hashes(blocks)
+        assert [store[h] for h in range(6)] == blocks
+    finally:
+        store.close()
+
+
+def test_segment_rollover(tmp_path):
+    size = len(make_block(0).serialize()) + 8
+    store = BlockStore(str(tmp_path), max_file_size=3 * size)
+    blocks = fill(store, 10)
+    assert [store.get_entry(h).file_no for h in hashes(blocks)] == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3]
+    store = reopen(store, max_file_size=3 * size)
+    try:
+        assert hashes(store) == hashes(blocks)
+        more = fill(store, 3)
+        assert store.get_entry(more[0].get_header_hash()).file_no == 3
+        assert store.get_entry(more[-1].get_header_hash()).file_no == 4
+        assert hashes(store) == hashes(blocks + more)
+        assert sorted(f for f in os.listdir(tmp_path) if f.startswith("blk")) == [
+            f"blk{n:05d}.dat" for n in range(5)
+        ]
+    finally:
+        store.close()
+
+
+def test_torn_index_tail_is_dropped(tmp_path):
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 3)
+    store.close()
+    index_path = tmp_path / "index.dat"
+    intact = index_path.stat().st_size
+    with open(index_path, 'ab') as f:
+        f.write(b'\x00' * (BlockStore._INDEX_RECORD.size // 2))
+
+    store = BlockStore(str(tmp_path))
+    try:
+        assert hashes(store) == hashes(blocks)
+        assert index_path.stat().st_size == intact
+        more = fill(store, 2)
+        store = reopen(store)
+        assert hashes(store) == hashes(blocks + more)
+    finally:
+        store.close()
+
+
+def test_index_past_the_data_is_dropped(tmp_path):
+    # The index reached disk but the last block's data did not
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 4)
+    store.close()
+    data_path = tmp_path / "blk00000.dat"
+    with open(data_path, 'r+b') as f:
+        f.truncate(data_path.stat().st_size - 10)
+
+    store = BlockStore(str(tmp_path))
+    try:
+        assert hashes(store) == hashes(blocks[:3])
+        assert blocks[3].get_header_hash() not in store
+        more = fill(store, 2, tag="new")
+        store = reopen(store)
+        assert hashes(store) == hashes(blocks[:3] + more)
+        assert store[4] == more[1]
+    finally:
+        store.close()
+
+
+def test_torn_data_tail_is_skipped(tmp_path):
+    # Block data reached disk but its index record did not
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 2)
+    store.close()
+    with open(tmp_path / "blk00000.dat", 'ab') as f:
+        f.write(BlockStore.MAGIC + b'\xff\xff\x00\x00' + b'partial block')
+
+    store = BlockStore(str(tmp_path))
+    try:
+        assert hashes(store) == hashes(blocks)
+        more = fill(store, 2)
+        store = reopen(store)
+        assert hashes(store) == hashes(blocks + more)
+        assert store[3] == more[1]
+    finally:
+        store.close()
+
+
+def test_truncate_then_append(tmp_path):
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 5)
+    store.truncate(3)
+    assert len(store) == 3
+    # Disconnected blocks stay reachable by hash
+    assert store.get_block(blocks[4].get_header_hash()) == blocks[4]
+    store.truncate(7)
+    assert len(store) == 3
+
+    branch = fill(store, 3, tag="branch")
+    store = reopen(store)
+    try:
+        assert hashes(store) == hashes(blocks[:3] + branch)
+        assert store.get_block(blocks[3].get_header_hash()) == blocks[3]
+        store.truncate(1)
+        store = reopen(store)
+        assert hashes(store) == hashes(blocks[:1])
+    finally:
+        store.close()
+
+
+def test_blockchain_resumes_from_store(tmp_path):
+    chain = Blockchain(data_dir=str(tmp_path))
+    chain.add_genesis_block()
+    genesis_hash = chain.get_latest_block().get_header_hash()
+    chain.close()
+
+    chain = Blockchain(data_dir=str(tmp_path))
+    try:
+        assert len(chain.chain) == 1
+        assert chain.get_latest_block().get_header_hash() == genesis_hash
+    finally:
+        chain.close()
+
+
+def test_undo_records_survive_reopen(tmp_path):
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 3)
+    for n, block in enumerate(blocks):
+        store.write_undo(block.get_header_hash(), bytes([n]) * (n + 1))
+    store = reopen(store)
+    try:
+        for n, block in enumerate(blocks):
+            assert store.read_undo(block.get_header_hash()) == bytes([n]) * (n + 1)
+        assert store.read_undo("00" * 32) is None
+    finally:
+        store.close()
+
+
+def test_undo_past_the_data_is_dropped(tmp_path):
+    store = BlockStore(str(tmp_path))
+    blocks = fill(store, 2)
+    store.write_undo(blocks[0].get_header_hash(), b'first')
+    store.write_undo(blocks[1].get_header_hash(), b'second')
+    store.close()
+    rev_path = tmp_path / "rev00000.dat"
+    with open(rev_path, 'r+b') as f:
+        f.truncate(rev_path.stat().st_size - 3)
+
+    store = BlockStore(str(tmp_path))
+    try:
+        assert hashes(store) == hashes(blocks)
+        assert store.read_undo(blocks[0].get_header_hash()) == b'first'
+        assert store.read_undo(blocks[1].get_header_hash()) is None
+        store.write_undo(blocks[1].get_header_hash(), b'again')
+        store = reopen(store)
+        assert store.read_undo(blocks[1].get_header_hash()) == b'again'
+    finally:
+        store.close()
@@ -0,0 +1,61 @@
+"""
+Active chain bookkeeping in Blockchain
+"""
+
+import pytest
+
+from xorcoin.core import Block, Blockchain, Transaction, TxOutput
+
+
+def make_block(height: int, tag: str = "") -> Block:
+    tx = Transaction(outputs=[TxOutput(50, f"miner{tag}{height}")], timestamp=height)
+    return Block(height=height, transactions=[tx])
+
+
+@pytest.fixture(params=["memory", "store"])
+def blockchain(request, tmp_path):
+    chain = Blockchain(data_dir=str(tmp_path) if request.param == "store" else None)
+    yield chain
+    chain.close()
+
+
+def test_lookup_by_hash(blockchain):
+    blocks = [make_block(h) for h in range(4)]
+    for block in blocks:
+        blockchain.append_block(block)
+    for height, block in enumerate(blocks):
+        block_hash = block.get_header_hash()
+        assert blockchain.has_block(block_hash)
+        assert blockchain.get_block_height(block_hash) == height
+        assert blockchain.get_block_by_hash(block_hash) == block
+    assert not blockchain.has_block("00" * 32)
+    assert blockchain.get_block_by_hash("00" * 32) is None
+
+
+def test_rewind_unindexes_blocks(blockchain):
+    blocks = [make_block(h) for h in range(4)]
+    for block in blocks:
+        blockchain.append_block(block)
+    assert blockchain.rewind(2) == blocks[2:]
+    assert len(blockchain.chain) == 2
+    assert not blockchain.has_block(blocks[3].get_header_hash())
+
+    branch = make_block(2, tag="branch")
+    blockchain.append_block(branch)
+    assert blockchain.get_block_height(branch.get_header_hash()) == 2
+    assert blockchain.get_latest_block() == branch
+
+
+def test_index_rebuilt_on_open(tmp_path):
+    chain = Blockchain(data_dir=str(tmp_path))
+    blocks = [make_block(h) for h in range(3)]
+    for block in blocks:
+        chain.append_block(block)
+    chain.rewind(2)
+    chain.close()
+
+    chain = Blockchain(data_dir=str(tmp_path))
+    try:
+        assert chain.block_index == {b.get_header_hash(): h for h, b in enumerate(blocks[:2])}
+    finally:
+        chain.close()
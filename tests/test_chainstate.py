@@ -0,0 +1,432 @@
+"""
+Connecting and disconnecting blocks, the UTXO commitment and snapshots
+"""
+
+import os
+
+import pytest
+
+from xorcoin import XorcoinSystem
+from xorcoin.core import Block, BlockMiner, CoinsViewCache, OutPoint, ThreadSafeUTXOSet, Transaction, TxInput, TxOutput, UTXO
+from xorcoin.crypto import MuHash3072
+from xorcoin.core.serialization import DecodeError
+from xorcoin.core.undo import BlockUndo
+from xorcoin.storage import BlockStore, ChainstateDB, SnapshotError, export_chainstate, import_chainstate
+from xorcoin.storage.reindex import block_diff
+
+
+def coins(utxo_set):
+    return sorted(utxo for shard in utxo_set.shards for utxo in shard.values())
+
+
+def coinbase(height: int, amount: int, address: str = "miner") -> Transaction:
+    return Transaction(inputs=[], outputs=[TxOutput(amount, address)], timestamp=height)
+
+
+def spend(outpoint: OutPoint, amounts, address: str = "payee") -> Transaction:
+    return Transaction(
+        inputs=[TxInput(outpoint)],
+        outputs=[TxOutput(amount, f"{address}{i}") for i, amount in enumerate(amounts)]
+    )
+
+
+def build_chain():
+    """Genesis and a block that spends from it, with a chain inside the block"""
+    genesis_cb = coinbase(0, 1_000_000)
+    genesis = Block(height=0, transactions=[genesis_cb])
+
+    parent = spend(OutPoint(genesis_cb.get_txid(), 0), [600_000, 399_990])
+    child = spend(OutPoint(parent.get_txid(), 0), [599_990], address="child")
+    block = Block(height=1, transactions=[coinbase(1, 70), parent, child])
+    return genesis, block
+
+
+ADDRESSES = ["miner", "payee0", "payee1", "child0"]
+
+
+def state(utxo_set):
+    return (
+        coins(utxo_set),
+        utxo_set.commitment.digest(),
+        {address: utxo_set.get_balance(address) for address in ADDRESSES}
+    )
+
+
+@pytest.fixture(params=["memory", "chainstate"])
+def utxo_set(request, tmp_path):
+    if request.param == "memory":
+        yield ThreadSafeUTXOSet()
+    else:
+        utxo_set = ThreadSafeUTXOSet(ChainstateDB(str(tmp_path / "chainstate.sqlite")))
+        yield utxo_set
+        utxo_set.close()
+
+
+@pytest.fixture(params=["memory", "data_dir"])
+def system(request, tmp_path):
+    system = XorcoinSystem(data_dir=str(tmp_path) if request.param == "data_dir" else None)
+    yield system
+    system.close()
+
+
+def test_undo_round_trip():
+    undo = BlockUndo(spent=[
+        [],
+        [UTXO(OutPoint(bytes(range(32)), 1), 5, "a"), UTXO(OutPoint(bytes(32), 0), 7, "b")],
+    ])
+    data = undo.serialize()
+    assert BlockUndo.deserialize(data) == undo
+    with pytest.raises(DecodeError):
+        BlockUndo.deserialize(data + b'\x00')
+
+
+def test_apply_block_matches_one_change_at_a_time(utxo_set):
+    genesis, block = build_chain()
+    utxo_set.apply_block(genesis)
+    reference = ThreadSafeUTXOSet()
+    reference.apply_block(genesis)
+    for tx in block.transactions:
+        for inp in tx.inputs:
+            reference.remove_utxo(inp.get_utxo_id())
+        for idx, out in enumerate(tx.outputs):
+            reference.add_utxo(UTXO(OutPoint(tx.get_txid(), idx), out.amount, out.script_pubkey))
+
+    undo = utxo_set.apply_block(block)
+    assert state(utxo_set) == state(reference)
+    assert utxo_set.get_balance("child0") == 599_990
+    # The coin created and spent within the block never reached the set
+    assert OutPoint(block.transactions[1].get_txid(), 0) not in utxo_set
+
+    parent, child = block.transactions[1:]
+    assert undo.spent == [
+        [],
+        [UTXO(OutPoint(genesis.transactions[0].get_txid(), 0), 1_000_000, "miner")],
+        [UTXO(OutPoint(parent.get_txid(), 0), 600_000, "payee0")],
+    ]
+
+
+def test_invalid_block_leaves_set_untouched(utxo_set):
+    genesis, block = build_chain()
+    utxo_set.apply_block(genesis)
+    before = state(utxo_set)
+
+    coinbase_tx, parent, child = block.transactions
+    overspend = spend(OutPoint(parent.get_txid(), 0), [600_001], address="child")
+    assert utxo_set.apply_block(Block(height=1, transactions=[coinbase_tx, parent, overspend])) is None
+    missing = spend(OutPoint(bytes(32), 0), [1])
+    assert utxo_set.apply_block(Block(height=1, transactions=[coinbase_tx, missing])) is None
+    double_spend = Block(height=1, transactions=block.transactions + [child])
+    assert utxo_set.apply_block(double_spend) is None
+    # The coinbase may claim the reward of 50 plus 20 in fees, and nothing more
+    overpaid = Block(height=1, transactions=[coinbase(1, 71), parent, child])
+    assert utxo_set.apply_block(overpaid) is None
+    second_coinbase = Block(height=1, transactions=block.transactions + [coinbase(1, 1, "other")])
+    assert utxo_set.apply_block(second_coinbase) is None
+    # Negative outputs are rejected even when the totals add up
+    negative = spend(OutPoint(genesis.transactions[0].get_txid(), 0), [1_100_000, -100_010])
+    assert utxo_set.apply_block(Block(height=1, transactions=[coinbase(1, 60), negative])) is None
+    negative_coinbase = Transaction(outputs=[TxOutput(100, "miner"), TxOutput(-30, "miner")], timestamp=1)
+    assert utxo_set.apply_block(Block(height=1, transactions=[negative_coinbase, parent, child])) is None
+    assert state(utxo_set) == before
+
+
+def test_coins_view_layers(utxo_set):
+    genesis, block = build_chain()
+    utxo_set.apply_block(genesis)
+    before = state(utxo_set)
+    genesis_coin = OutPoint(genesis.transactions[0].get_txid(), 0)
+
+    scratch = CoinsViewCache(utxo_set)
+    nested = CoinsViewCache(scratch)
+    assert nested.connect_block(block) is not None
+    assert genesis_coin not in nested and genesis_coin in scratch
+    nested.discard()
+    assert genesis_coin in nested
+
+    fresh = UTXO(OutPoint(bytes(32), 0), 5, "miner")
+    assert scratch.add_utxo(fresh) is None
+    assert scratch.spend_utxo(fresh.outpoint) == fresh
+    assert scratch.spend_utxo(genesis_coin).amount == 1_000_000
+    assert scratch.get_utxos([genesis_coin, fresh.outpoint]) == {}
+    assert state(utxo_set) == before
+
+    # Only the spend reaches the parent; the fresh coin cancelled out
+    scratch.flush()
+    assert coins(utxo_set) == []
+    assert utxo_set.get_balance("miner") == 0
+
+
+def test_system_disconnect_block(system):
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    before = coins(system.utxo_set)
+    commitment = system.get_blockchain_info()["utxo_commitment"]
+    balances = system.get_balance(sender), system.get_balance(receiver)
+
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    block = system.mine_block("miner")
+    assert block is not None and len(block.transactions) == 2
+    assert system.get_balance(receiver) == 7
+
+    assert system.disconnect_block() is block
+    assert len(system.blockchain.chain) == 2
+    assert coins(system.utxo_set) == before
+    assert system.get_blockchain_info()["utxo_commitment"] == commitment
+    assert (system.get_balance(sender), system.get_balance(receiver)) == balances
+    assert block.transactions[1].get_hash() not in system.confirmed_txs
+
+    # Only the genesis block is left after one more
+    assert system.disconnect_block() is not None
+    assert system.disconnect_block() is None
+
+
+def mine_branch(system, length: int):
+    """Mine a branch of `length` blocks paying 7 to a receiver, then replace it with one block"""
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    branch = [system.mine_block("miner") for _ in range(length)]
+    expected = coins(system.utxo_set)
+
+    for _ in branch:
+        system.disconnect_block()
+    other = system.mine_block("other")
+    assert system.get_balance(receiver) == 0
+    return branch, other, receiver, expected
+
+
+def test_reorganize_to_competing_branch(system):
+    branch, other, receiver, expected = mine_branch(system, 2)
+    assert not system.reorganize([])
+    assert system.reorganize(branch)
+    assert system.blockchain.get_latest_block() is branch[-1]
+    assert coins(system.utxo_set) == expected
+    assert system.get_balance(receiver) == 7
+    assert system.get_balance("other") == 0
+    assert not system.blockchain.has_block(other.get_header_hash())
+
+
+def test_reorganize_needs_more_work(system):
+    branch, other, receiver, _ = mine_branch(system, 1)
+    assert not system.reorganize(branch)
+    assert system.blockchain.get_latest_block() is other
+    assert system.get_balance(receiver) == 0
+
+
+def test_reorganize_to_invalid_branch_keeps_chain(system):
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    tip = system.mine_block("miner")
+    expected = coins(system.utxo_set)
+
+    # Two blocks, the first spending a coin that does not exist
+    prev = system.blockchain.chain[1]
+    branch = []
+    for height, txs in ((2, [spend(OutPoint(bytes(32), 0), [1])]), (3, [])):
+        block = Block(height=height, prev_block_hash=prev.get_header_hash(),
+                      timestamp=prev.timestamp + 1, transactions=[coinbase(height, 50)] + txs)
+        assert BlockMiner.mine_block(block, target_difficulty=system.blockchain.difficulty)
+        branch.append(block)
+        prev = block
+    assert not system.reorganize(branch)
+    assert system.blockchain.get_latest_block().get_header_hash() == tip.get_header_hash()
+    assert coins(system.utxo_set) == expected
+    assert system.get_balance(receiver) == 7
+
+
+def test_block_diff_cancels_in_a_view(utxo_set):
+    genesis, block = build_chain()
+    coinbase_tx, parent, child = block.transactions
+    block_hash, tx_diffs = block_diff(block)
+    assert block_hash == block.get_header_hash()
+    assert [spent for _, spent in tx_diffs] == [
+        [], [OutPoint(genesis.transactions[0].get_txid(), 0)], [OutPoint(parent.get_txid(), 0)]
+    ]
+
+    utxo_set.apply_block(genesis)
+    view = CoinsViewCache(utxo_set)
+    for created, spent in tx_diffs:
+        view.batch_update(created, spent)
+    view.flush()
+    assert coins(utxo_set) == sorted([
+        UTXO(OutPoint(coinbase_tx.get_txid(), 0), 70, "miner"),
+        UTXO(OutPoint(parent.get_txid(), 1), 399_990, "payee1"),
+        UTXO(OutPoint(child.get_txid(), 0), 599_990, "child0"),
+    ])
+
+
+def test_reindex_rebuilds_the_same_chainstate(tmp_path):
+    system = XorcoinSystem(data_dir=str(tmp_path))
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    for amount in (3, 4, 5):
+        assert system.add_transaction(system.create_transaction(sender, receiver, amount, key))
+        system.mine_block("miner")
+    expected = coins(system.utxo_set), system.get_blockchain_info()["utxo_commitment"]
+    confirmed = set(system.confirmed_txs)
+    system.close()
+
+    system = XorcoinSystem(data_dir=str(tmp_path), reindex=True)
+    try:
+        assert (coins(system.utxo_set), system.get_blockchain_info()["utxo_commitment"]) == expected
+        assert system.get_balance(receiver) == 12
+        assert set(system.confirmed_txs) == confirmed
+        result = system.reindex(workers=2)
+        assert result.blocks == len(system.blockchain.chain)
+        assert coins(system.utxo_set) == expected[0]
+        assert system.utxo_set.db.best_block[1] == len(system.blockchain.chain) - 1
+    finally:
+        system.close()
+
+
+def test_muhash_is_a_set_hash():
+    items = [bytes([n]) * (n + 1) for n in range(10)]
+    forward, backward = MuHash3072(), MuHash3072()
+    for item in items:
+        forward.insert(item)
+    backward.update(reversed(items))
+    assert forward.digest() == backward.digest()
+
+    forward.insert(b'extra')
+    forward.remove(b'extra')
+    assert forward == backward
+    restored = MuHash3072.from_bytes(forward.to_bytes())
+    assert restored.digest() == backward.digest()
+    backward.remove(items[0])
+    assert restored.digest() != backward.digest()
+    assert MuHash3072().digest() == MuHash3072.from_bytes(MuHash3072().to_bytes()).digest()
+
+
+def test_commitment_is_order_independent(system):
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    system.mine_block("miner")
+
+    fresh = ThreadSafeUTXOSet()
+    for utxo in reversed(coins(system.utxo_set)):
+        fresh.add_utxo(utxo)
+    assert fresh.commitment.digest() == system.utxo_set.commitment.digest()
+    assert system.utxo_set.snapshot().commitment() == fresh.commitment.digest()
+
+
+def test_commitment_survives_restart(tmp_path):
+    system = XorcoinSystem(data_dir=str(tmp_path))
+    _, _, sender = system.generate_wallet()
+    system.mine_block(sender)
+    commitment = system.get_blockchain_info()["utxo_commitment"]
+    system.close()
+
+    system = XorcoinSystem(data_dir=str(tmp_path))
+    try:
+        assert system.get_blockchain_info()["utxo_commitment"] == commitment
+        assert system.utxo_set.commitment.digest() == system.utxo_set.db.compute_commitment().digest()
+    finally:
+        system.close()
+
+
+def fill_chainstate(path: str, count: int) -> ChainstateDB:
+    db = ChainstateDB(path)
+    for n in range(count):
+        utxo = UTXO(OutPoint(n.to_bytes(32, 'little'), n % 3), n + 1, f"addr{n % 4}")
+        db[utxo.outpoint] = utxo
+    db.commit_block("ab" * 32, 9)
+    return db
+
+
+def test_snapshot_round_trip(tmp_path):
+    source = fill_chainstate(str(tmp_path / "source.sqlite"), 25)
+    path = str(tmp_path / "utxo.snapshot")
+    header = export_chainstate(source, path, chunk_size=4)
+    assert (header.height, header.block_hash, header.coin_count) == (9, "ab" * 32, 25)
+
+    target = ChainstateDB(str(tmp_path / "target.sqlite"))
+    assert import_chainstate(target, path) == header
+    assert sorted(target.values()) == sorted(source.values())
+    assert target.best_block == ("ab" * 32, 9)
+    assert header.utxo_commitment == source.compute_commitment().digest()
+    assert ThreadSafeUTXOSet(target).commitment.digest() == header.utxo_commitment
+    for n in range(4):
+        assert target.get_balance(f"addr{n}") == source.get_balance(f"addr{n}")
+    source.close()
+    target.close()
+
+
+def test_corrupt_snapshot_keeps_previous_coins(tmp_path):
+    source = fill_chainstate(str(tmp_path / "source.sqlite"), 25)
+    path = str(tmp_path / "utxo.snapshot")
+    export_chainstate(source, path, chunk_size=4)
+    source.close()
+    # Flip a byte of the last coin's amount
+    with open(path, 'r+b') as f:
+        f.seek(-1 - len("addr0"), os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+
+    target = fill_chainstate(str(tmp_path / "target.sqlite"), 3)
+    before = sorted(target.values())
+    with pytest.raises(SnapshotError):
+        import_chainstate(target, path)
+    assert sorted(target.values()) == before
+    target.close()
+
+
+def test_snapshot_block_must_be_in_store(tmp_path):
+    source = fill_chainstate(str(tmp_path / "source.sqlite"), 5)
+    path = str(tmp_path / "utxo.snapshot")
+    export_chainstate(source, path)
+    source.close()
+
+    store = BlockStore(str(tmp_path / "blocks"))
+    target = ChainstateDB(str(tmp_path / "target.sqlite"))
+    with pytest.raises(SnapshotError):
+        import_chainstate(target, path, store=store)
+    assert len(target) == 0
+    with pytest.raises(SnapshotError):
+        export_chainstate(target, str(tmp_path / "empty.snapshot"))
+    store.close()
+    target.close()
+
+
+def test_snapshot_with_wrong_commitment_is_rejected(tmp_path):
+    source = fill_chainstate(str(tmp_path / "source.sqlite"), 5)
+    path = str(tmp_path / "utxo.snapshot")
+    export_chainstate(source, path)
+    source.close()
+
+    # Flip a byte of the commitment, the last field of the header
+    with open(path, 'r+b') as f:
+        f.seek(4 + 4 + 4 + 32 + 8 + 32)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 1]))
+
+    target = ChainstateDB(str(tmp_path / "target.sqlite"))
+    with pytest.raises(SnapshotError):
+        import_chainstate(target, path)
+    assert len(target) == 0
+    target.close()
+
+
+def test_snapshot_version_must_match(tmp_path):
+    source = fill_chainstate(str(tmp_path / "source.sqlite"), 3)
+    path = str(tmp_path / "utxo.snapshot")
+    export_chainstate(source, path)
+    source.close()
+
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write((1).to_bytes(4, 'little'))
+
+    target = ChainstateDB(str(tmp_path / "target.sqlite"))
+    with pytest.raises(SnapshotError, match="version 1"):
+        import_chainstate(target, path)
+    assert len(target) == 0
+    target.close()
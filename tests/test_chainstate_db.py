@@ -0,0 +1,138 @@
+"""
+Disk-backed UTXO database and its write-back cache
+"""
+
+import sqlite3
+
+import pytest
+
+from xorcoin import XorcoinSystem
+from xorcoin.core import OutPoint, UTXO
+from xorcoin.storage import ChainstateDB
+
+
+def coin(n: int, amount: int = 10, address: str = "addr") -> UTXO:
+    return UTXO(OutPoint(n.to_bytes(32, 'big'), 0), amount, address)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "chainstate.sqlite")
+
+
+def on_disk(path: str):
+    """The coins and tip a restart after a crash would find"""
+    with sqlite3.connect(path) as conn:
+        coins = sorted(
+            UTXO(OutPoint.from_bytes(raw), amount, script_pubkey)
+            for raw, amount, script_pubkey in conn.execute("SELECT * FROM coins")
+        )
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+    conn.close()
+    return coins, (meta.get('best_block_hash', ""), meta.get('best_height', -1))
+
+
+def test_writes_reach_disk_only_on_flush(path):
+    db = ChainstateDB(path, flush_interval=3)
+    db[coin(1).outpoint] = coin(1)
+    db[coin(2).outpoint] = coin(2)
+    assert not db.commit_block("aa" * 32, 0)
+    assert db.best_block == ("aa" * 32, 0)
+    assert db.flushed_block == ("", -1)
+    assert on_disk(path) == ([], ("", -1))
+
+    del db[coin(1).outpoint]
+    assert not db.commit_block("bb" * 32, 1)
+    assert db.needs_flush()
+    assert db.commit_block("cc" * 32, 2)
+    assert db.flushed_block == ("cc" * 32, 2)
+    assert on_disk(path) == ([coin(2)], ("cc" * 32, 2))
+    db.close()
+
+
+def test_reads_see_cache_and_disk(path):
+    db = ChainstateDB(path)
+    for n in range(5):
+        db[coin(n).outpoint] = coin(n)
+    db.flush()
+    del db[coin(0).outpoint]
+    db[coin(5).outpoint] = coin(5)
+    db[coin(1).outpoint] = coin(1, amount=99)
+
+    assert len(db) == 5
+    assert coin(0).outpoint not in db
+    assert db.get(coin(0).outpoint) is None
+    assert db[coin(1).outpoint].amount == 99
+    assert sorted(db.values()) == sorted([coin(1, amount=99)] + [coin(n) for n in range(2, 6)])
+    with pytest.raises(KeyError):
+        del db[coin(0).outpoint]
+    db.close()
+
+    db = ChainstateDB(path)
+    assert len(db) == 5
+    assert db[coin(1).outpoint].amount == 99
+    db.close()
+
+
+def test_full_cache_forces_a_flush(path):
+    db = ChainstateDB(path, cache_mb=ChainstateDB.ENTRY_BYTES * 3 / (1024 * 1024),
+                      flush_interval=1000)
+    assert db.max_entries == 3
+    for n in range(4):
+        db[coin(n).outpoint] = coin(n)
+    assert db.needs_flush()
+    assert db.commit_block("aa" * 32, 0)
+    assert len(on_disk(path)[0]) == 4
+    assert db[coin(3).outpoint] == coin(3)
+    db.close()
+
+
+def test_reads_keep_the_cache_bounded(path):
+    db = ChainstateDB(path)
+    for n in range(6):
+        db[coin(n).outpoint] = coin(n)
+    db.commit_block("aa" * 32, 0)
+    db.flush()
+    db.close()
+
+    db = ChainstateDB(path, cache_mb=ChainstateDB.ENTRY_BYTES * 3 / (1024 * 1024))
+    db[coin(0).outpoint] = coin(0, amount=99)
+    for n in range(1, 6):
+        assert db[coin(n).outpoint] == coin(n)
+        assert len(db._cache) <= 3
+    # Unflushed writes are never evicted
+    assert db._cache[coin(0).outpoint] == coin(0, amount=99)
+    assert list(db._cache) == [coin(0).outpoint, coin(4).outpoint, coin(5).outpoint]
+    db.close()
+
+
+def test_clear(path):
+    db = ChainstateDB(path)
+    db[coin(1).outpoint] = coin(1)
+    db.commit_block("aa" * 32, 0)
+    db.flush()
+    db.clear()
+    assert len(db) == 0 and db.best_block == ("", -1)
+    assert on_disk(path) == ([], ("", -1))
+    db.close()
+
+
+def test_restart_resumes_chain_and_coins(tmp_path):
+    system = XorcoinSystem(data_dir=str(tmp_path))
+    _, _, miner = system.generate_wallet()
+    for _ in range(2):
+        system.mine_block(miner)
+    balance = system.get_balance(miner)
+    confirmed = set(system.confirmed_txs)
+    system.close()
+
+    system = XorcoinSystem(data_dir=str(tmp_path))
+    try:
+        assert len(system.blockchain.chain) == 3
+        assert system.get_balance(miner) == balance > 0
+        assert set(system.confirmed_txs) == confirmed
+        assert system.utxo_set.db.best_block == (
+            system.blockchain.get_latest_block().get_header_hash(), 2
+        )
+    finally:
+        system.close()
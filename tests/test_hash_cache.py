@@ -0,0 +1,84 @@
+"""
+Memoized txids and header hashes
+"""
+
+import copy
+import pickle
+
+import pytest
+
+from xorcoin.core import Block, OutPoint, Transaction, TxInput, TxOutput
+
+
+def make_tx() -> Transaction:
+    return Transaction(
+        inputs=[TxInput(OutPoint.from_hex("ab" * 32, 0))],
+        outputs=[TxOutput(10, "addr")],
+        timestamp=1700000000
+    )
+
+
+def fresh_hash(tx: Transaction) -> str:
+    return Transaction.deserialize(tx.serialize()).get_hash()
+
+
+def test_txid_follows_field_changes():
+    tx = make_tx()
+    old = tx.get_hash()
+    tx.locktime = 5
+    assert tx.get_hash() != old
+    assert tx.get_hash() == fresh_hash(tx)
+
+
+def test_txid_follows_list_changes():
+    tx = make_tx()
+    hashes = {tx.get_hash()}
+    tx.outputs.append(TxOutput(1, "other"))
+    hashes.add(tx.get_hash())
+    tx.outputs[0] = TxOutput(11, "addr")
+    hashes.add(tx.get_hash())
+    tx.inputs = [TxInput(OutPoint.from_hex("cd" * 32, 1))]
+    hashes.add(tx.get_hash())
+    assert len(hashes) == 4
+    assert tx.get_hash() == fresh_hash(tx)
+
+
+def test_txid_follows_replaced_items():
+    tx = make_tx()
+    old = tx.get_hash()
+    tx.outputs[0] = tx.outputs[0]._replace(amount=12)
+    assert tx.get_hash() != old
+    tx.inputs[0] = TxInput(OutPoint.from_hex("ab" * 32, 3))
+    assert tx.get_hash() == fresh_hash(tx)
+
+
+def test_parts_are_immutable():
+    tx = make_tx()
+    with pytest.raises(AttributeError):
+        tx.outputs[0].amount = 12
+    with pytest.raises(AttributeError):
+        tx.inputs[0].signature = b'sig'
+
+
+def test_signatures_keep_the_txid():
+    tx = make_tx()
+    old = tx.get_hash()
+    tx.inputs[0] = tx.inputs[0]._replace(signature=b'sig')
+    assert tx.get_hash() == old
+
+
+def test_copies_hash_their_own_contents():
+    tx = make_tx()
+    tx.get_hash()
+    for clone in (copy.deepcopy(tx), pickle.loads(pickle.dumps(tx))):
+        clone.outputs.append(TxOutput(1, "other"))
+        assert clone.get_hash() == fresh_hash(clone)
+        assert clone.get_hash() != tx.get_hash()
+
+
+def test_header_hash_follows_header_fields():
+    block = Block(transactions=[make_tx()])
+    old = block.get_header_hash()
+    block.nonce += 1
+    assert block.get_header_hash() != old
+    assert block.get_header_hash() == Block.deserialize(block.serialize()).get_header_hash()
@@ -0,0 +1,295 @@
+"""
+Mempool transaction graph: conflicts, chain limits, package eviction and CPFP
+"""
+
+import random
+
+from xorcoin import XorcoinSystem
+from xorcoin.core import Block, BlockTemplateBuilder, Mempool, OutPoint, Transaction, TxInput, TxOutput, TxPriorityIndex
+from xorcoin.core.serialization import ZERO_HASH
+from xorcoin.crypto.signatures import SignatureManager
+from xorcoin.validation.transaction import TransactionValidator
+
+
+def make_tx(prev: OutPoint, outputs: int = 1, tag: str = "") -> Transaction:
+    return Transaction(
+        inputs=[TxInput(prev)],
+        outputs=[TxOutput(1000, f"addr{tag}{i}") for i in range(outputs)]
+    )
+
+
+def confirmed(n: int) -> OutPoint:
+    """An outpoint standing for a confirmed coin"""
+    return OutPoint(n.to_bytes(32, 'big'), 0)
+
+
+def out(tx: Transaction, index: int = 0) -> OutPoint:
+    return OutPoint(tx.get_txid(), index)
+
+
+def test_conflicts_are_rejected():
+    mempool = Mempool()
+    first = make_tx(confirmed(0), tag="a")
+    assert mempool.add_transaction(first, 1000)
+    assert not mempool.add_transaction(first, 1000)
+    second = make_tx(confirmed(0), tag="b")
+    assert mempool.get_conflicts(second) == [first.get_hash()]
+    assert not mempool.add_transaction(second, 5000)
+    assert mempool.get_spender(confirmed(0)) == first.get_hash()
+
+    validator = TransactionValidator(None, mempool)
+    assert validator._is_double_spend_in_mempool(confirmed(0))
+    assert not validator._is_double_spend_in_mempool(confirmed(1))
+
+
+def test_negative_outputs_are_rejected():
+    system = XorcoinSystem()
+    try:
+        key, _, sender = system.generate_wallet()
+        _, _, receiver = system.generate_wallet()
+        system.mine_block(sender)
+        tx = system.create_transaction(sender, receiver, 7, key)
+        validator = TransactionValidator(system.utxo_set)
+        assert validator.validate_transaction(tx)
+
+        # Same totals, but paying 5 more to the receiver out of a negative change
+        change = tx.outputs[1]
+        tx.outputs[:] = [TxOutput(7 + change.amount + 5, receiver), TxOutput(-5, sender)]
+        for i, tx_input in enumerate(tx.inputs):
+            signature = SignatureManager.sign_message(key, tx.serialize_for_signing(i))
+            tx.inputs[i] = tx_input._replace(signature=signature)
+        assert not validator.validate_transaction(tx)
+    finally:
+        system.close()
+
+
+def add_chain(mempool: Mempool, length: int, fee: int = 1000, start: int = 0):
+    txs = []
+    prev = confirmed(start)
+    for i in range(length):
+        tx = make_tx(prev, tag=f"{start}-{i}")
+        if not mempool.add_transaction(tx, fee):
+            break
+        txs.append(tx)
+        prev = out(tx)
+    return txs
+
+
+def test_ancestor_and_descendant_totals():
+    mempool = Mempool()
+    a, b, c = add_chain(mempool, 3, fee=100)
+    entry_a = mempool.entries[a.get_hash()]
+    entry_c = mempool.entries[c.get_hash()]
+    assert entry_c.ancestor_count == 3
+    assert entry_c.ancestor_fees == 300
+    assert entry_a.descendant_count == 3
+    assert entry_a.descendant_size == a.serialized_size + b.serialized_size + c.serialized_size
+    assert mempool.get_descendants(a.get_hash()) == {b.get_hash(), c.get_hash()}
+    assert mempool.get_utxo(out(b)).amount == 1000
+
+    # Confirming the root leaves its descendants with one ancestor fewer
+    mempool.remove_for_block(Block(transactions=[a]))
+    assert mempool.entries[c.get_hash()].ancestor_count == 2
+    assert mempool.entries[b.get_hash()].parents == set()
+
+
+def test_chain_length_limit():
+    mempool = Mempool()
+    chain = add_chain(mempool, Mempool.MAX_ANCESTORS + 1)
+    assert len(chain) == Mempool.MAX_ANCESTORS
+    assert not mempool.add_transaction(make_tx(out(chain[-1])), 1000)
+
+
+def test_descendant_limit():
+    mempool = Mempool()
+    root = make_tx(confirmed(0), outputs=Mempool.MAX_DESCENDANTS + 1)
+    assert mempool.add_transaction(root, 1000)
+    children = [make_tx(out(root, i), tag=str(i)) for i in range(Mempool.MAX_DESCENDANTS)]
+    added = [mempool.add_transaction(child, 1000) for child in children]
+    assert added == [True] * (Mempool.MAX_DESCENDANTS - 1) + [False]
+
+
+def test_eviction_takes_whole_packages():
+    mempool = Mempool()
+    parent, child = add_chain(mempool, 2, fee=100)
+    other = make_tx(confirmed(1), tag="other")
+    assert mempool.add_transaction(other, 10_000)
+
+    # Room for only one more transaction: the cheap chain goes as a whole
+    mempool.max_size = mempool.current_size
+    incoming = make_tx(confirmed(2), tag="incoming")
+    assert mempool.add_transaction(incoming, 50_000)
+    assert set(mempool.transactions) == {other.get_hash(), incoming.get_hash()}
+    assert mempool.get_spender(out(parent)) is None
+    assert mempool.current_size == other.serialized_size + incoming.serialized_size
+
+
+def test_eviction_spares_ancestors_of_incoming():
+    mempool = Mempool()
+    (parent,) = add_chain(mempool, 1, fee=100)
+    mempool.max_size = mempool.current_size
+    child = make_tx(out(parent), tag="child")
+    assert not mempool.add_transaction(child, 50_000)
+    assert parent.get_hash() in mempool.transactions
+
+
+def test_block_conflict_removes_descendants():
+    mempool = Mempool()
+    parent, child = add_chain(mempool, 2)
+    double_spend = make_tx(confirmed(0), tag="block")
+    removed = mempool.remove_for_block(Block(transactions=[double_spend]))
+    assert {tx.get_hash() for tx in removed} == {parent.get_hash(), child.get_hash()}
+    assert len(mempool) == 0 and mempool.current_size == 0
+
+
+def test_remove_transaction_frees_its_outpoints():
+    mempool = Mempool()
+    tx = make_tx(confirmed(0))
+    assert mempool.add_transaction(tx, 1000)
+    assert mempool.remove_transaction(tx.get_hash()) == tx
+    assert mempool.remove_transaction(tx.get_hash()) is None
+    assert mempool.get_spender(confirmed(0)) is None
+    assert mempool.current_size == 0
+    assert mempool.add_transaction(make_tx(confirmed(0), tag="again"), 1000)
+
+
+def test_block_removes_its_transactions_and_conflicts():
+    mempool = Mempool()
+    included = make_tx(confirmed(0), tag="included")
+    conflict = make_tx(confirmed(1), tag="mempool")
+    unrelated = make_tx(confirmed(2), tag="unrelated")
+    for tx in (included, conflict, unrelated):
+        assert mempool.add_transaction(tx, 1000)
+
+    double_spend = make_tx(confirmed(1), tag="block")
+    removed = mempool.remove_for_block(Block(transactions=[included, double_spend]))
+    assert {tx.get_hash() for tx in removed} == {included.get_hash(), conflict.get_hash()}
+    assert set(mempool.transactions) == {unrelated.get_hash()}
+    assert mempool.current_size == unrelated.serialized_size
+    assert mempool.get_spender(confirmed(1)) is None
+
+
+def test_priority_index_stays_sorted():
+    rng = random.Random(3)
+    index = TxPriorityIndex()
+    index.LOAD = 4  # Force many splits
+    expected = {}
+    for n in range(500):
+        tx_hash = f"{rng.randrange(200):03d}"
+        if rng.random() < 0.3:
+            assert index.remove(tx_hash) == (tx_hash in expected)
+            expected.pop(tx_hash, None)
+        else:
+            score = rng.randrange(50)
+            index.add(tx_hash, score)
+            expected[tx_hash] = score
+    entries = sorted((score, tx_hash) for tx_hash, score in expected.items())
+    assert list(index) == entries
+    assert list(reversed(index)) == entries[::-1]
+    assert len(index) == len(entries)
+    assert index.score(entries[0][1]) == entries[0][0]
+    assert index.pop_min() == entries[0]
+    assert entries[0][1] not in index
+    index.clear()
+    assert index.min() is None and list(index) == []
+
+
+def test_eviction_takes_lowest_fee_rate_first():
+    mempool = Mempool()
+    txs = [make_tx(confirmed(i), tag=str(i)) for i in range(4)]
+    for i, tx in enumerate(txs):
+        assert mempool.add_transaction(tx, 1000 * (i + 1))
+    # Room for exactly one more transaction once the cheapest goes
+    mempool.max_size = mempool.current_size
+    assert not mempool.add_transaction(make_tx(confirmed(9), tag="9"), 500)
+    incoming = make_tx(confirmed(10), tag="8")
+    assert mempool.add_transaction(incoming, 2500)
+    assert txs[0].get_hash() not in mempool.transactions
+    assert set(mempool.transactions) == {tx.get_hash() for tx in txs[1:]} | {incoming.get_hash()}
+    assert [tx.get_hash() for tx in mempool.get_block_template().transactions] == [
+        txs[3].get_hash(), txs[2].get_hash(), incoming.get_hash(), txs[1].get_hash()
+    ]
+
+
+def test_cpfp_template_ordering():
+    mempool = Mempool()
+    parent = make_tx(confirmed(0), tag="parent")
+    child = make_tx(out(parent), tag="child")
+    middle = make_tx(confirmed(1), tag="middle")
+    size = parent.serialized_size
+    assert mempool.add_transaction(parent, size)  # 1 per byte
+    assert mempool.add_transaction(middle, 5 * size)  # 5 per byte
+    assert mempool.add_transaction(child, 20 * size)  # Package: 10.5 per byte
+
+    assert mempool.get_ancestors(child.get_hash()) == {parent.get_hash()}
+    assert mempool.get_descendants(parent.get_hash()) == {child.get_hash()}
+    template = mempool.get_block_template()
+    assert [tx.get_hash() for tx in template.transactions] == [
+        parent.get_hash(), child.get_hash(), middle.get_hash()
+    ]
+    assert template.fees == 26 * size
+    assert template.size == 2 * size + child.serialized_size
+
+
+def test_template_limited_by_block_size():
+    txs = [make_tx(confirmed(i), tag=str(i)) for i in range(3)]
+    # Room for two of the three equally sized transactions
+    mempool = Mempool(max_block_size=BlockTemplateBuilder.RESERVED_SIZE + 2 * txs[0].serialized_size)
+    for i, tx in enumerate(txs):
+        assert mempool.add_transaction(tx, 1000 * (i + 1))
+
+    template = mempool.get_block_template()
+    assert [tx.get_hash() for tx in template.transactions] == [txs[2].get_hash(), txs[1].get_hash()]
+    # A cheaper arrival cannot displace anything, so the template is reused
+    assert mempool.add_transaction(make_tx(confirmed(7), tag="7"), 500)
+    assert mempool.get_block_template() is template
+
+
+def test_template_tracks_removals():
+    mempool = Mempool()
+    parent = make_tx(confirmed(0), tag="parent")
+    child = make_tx(out(parent), tag="child")
+    assert mempool.add_transaction(parent, 1000)
+    assert mempool.add_transaction(child, 1000)
+    assert len(mempool.get_block_template().transactions) == 2
+
+    mempool.remove_for_block(Block(transactions=[parent]))
+    assert [tx.get_hash() for tx in mempool.get_block_template().transactions] == [child.get_hash()]
+    mempool.remove_transaction(child.get_hash())
+    assert mempool.get_block_template().transactions == []
+
+    parent, child = add_chain(mempool, 2)
+    assert len(mempool.get_block_template().transactions) == 2
+    mempool.remove_with_descendants(parent.get_hash())
+    assert mempool.get_block_template().transactions == []
+
+
+def test_template_merkle_root():
+    mempool = Mempool()
+    add_chain(mempool, 3)
+    template = mempool.get_block_template()
+    for tag in ("a", "b"):
+        coinbase = Transaction(outputs=[TxOutput(50, f"miner{tag}")], timestamp=1)
+        block = Block(transactions=[coinbase] + template.transactions)
+        assert template.merkle_root(coinbase) == block.calculate_merkle_root()
+    # The shared tree keeps its placeholder coinbase leaf
+    assert template.merkle_tree.levels[0][0] == ZERO_HASH
+
+
+def test_admission_locks_are_released():
+    system = XorcoinSystem()
+    try:
+        key, _, sender = system.generate_wallet()
+        _, _, receiver = system.generate_wallet()
+        system.mine_block(sender)
+        tx = system.create_transaction(sender, receiver, 7, key)
+        assert system.add_transaction(tx)
+        assert not system.double_spend_protector.pending_utxos
+
+        # Once evicted, the same coin can be spent again
+        system.mempool.remove_transaction(tx.get_hash())
+        assert system.add_transaction(system.create_transaction(sender, receiver, 8, key))
+        assert not system.add_transaction(system.create_transaction(sender, receiver, 9, key))
+        assert not system.double_spend_protector.pending_utxos
+    finally:
+        system.close()
@@ -0,0 +1,89 @@
+"""
+Incremental Merkle tree and inclusion proofs
+"""
+
+import hashlib
+
+import pytest
+
+from xorcoin.core import Block, MerkleTree, Transaction, TxOutput
+from xorcoin.core.serialization import ZERO_HASH
+
+
+def leaf(i: int) -> bytes:
+    return hashlib.sha256(str(i).encode()).digest()
+
+
+def reference_root(leaves) -> bytes:
+    """Root computed level by level, duplicating an odd last node"""
+    if not leaves:
+        return ZERO_HASH
+    nodes = list(leaves)
+    while len(nodes) > 1:
+        if len(nodes) % 2:
+            nodes.append(nodes[-1])
+        nodes = [hashlib.sha256(nodes[i] + nodes[i + 1]).digest() for i in range(0, len(nodes), 2)]
+    return nodes[0]
+
+
+SIZES = list(range(0, 18)) + [31, 32, 33]
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_root_matches_reference(size):
+    leaves = [leaf(i) for i in range(size)]
+    assert MerkleTree(leaves).root() == reference_root(leaves)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_append_matches_bulk_build(size):
+    tree = MerkleTree()
+    for i in range(size):
+        tree.append(leaf(i))
+        assert tree.root() == reference_root([leaf(j) for j in range(i + 1)])
+    assert tree.levels == MerkleTree(leaf(i) for i in range(size)).levels
+
+
+def test_update_and_truncate():
+    leaves = [leaf(i) for i in range(13)]
+    tree = MerkleTree(leaves)
+    for i in (0, 6, 12):
+        leaves[i] = leaf(100 + i)
+        tree.update(i, leaves[i])
+        assert tree.root() == reference_root(leaves)
+    for size in (13, 9, 8, 1, 0):
+        tree.truncate(size)
+        assert tree.root() == reference_root(leaves[:size])
+    tree.extend(leaves[:5])
+    assert tree.root() == reference_root(leaves[:5])
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 13])
+def test_every_proof_verifies(size):
+    tree = MerkleTree(leaf(i) for i in range(size))
+    root = tree.root()
+    for i in range(size):
+        proof = tree.get_proof(i)
+        assert MerkleTree.verify_proof(leaf(i), i, proof, root)
+        assert not MerkleTree.verify_proof(leaf(size + 1), i, proof, root)
+        assert not MerkleTree.verify_proof(leaf(i), i, proof, leaf(size + 1))
+        assert MerkleTree.root_from_proof(leaf(i), i, proof) == root
+
+
+def test_proof_index_must_be_in_range():
+    tree = MerkleTree([leaf(0), leaf(1)])
+    with pytest.raises(IndexError):
+        tree.get_proof(2)
+    with pytest.raises(IndexError):
+        MerkleTree().get_proof(0)
+    # An index past the tree cannot reuse a real proof
+    assert not MerkleTree.verify_proof(leaf(1), 3, tree.get_proof(1), tree.root())
+    assert MerkleTree.root_from_proof(leaf(1), 3, tree.get_proof(1)) is None
+
+
+def test_block_root_is_tree_root():
+    txs = [Transaction(outputs=[TxOutput(i, "addr")], timestamp=i) for i in range(5)]
+    block = Block(transactions=txs)
+    tree = block.build_merkle_tree()
+    assert block.calculate_merkle_root() == tree.root().hex()
+    assert MerkleTree.verify_proof(txs[3].get_txid(), 3, tree.get_proof(3), tree.root())
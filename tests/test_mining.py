@@ -0,0 +1,134 @@
+"""
+Proof-of-work nonce search
+"""
+
+import threading
+
+import pytest
+
+from xorcoin.core import Block, OutPoint, ParallelMiner, Transaction, TxInput, TxOutput
+from xorcoin.core.block import BlockMiner, Blockchain
+from xorcoin.core.mining import MAX_NONCE, HeaderTemplate, difficulty_to_target, scan_nonces
+
+
+def make_block(version: int = 2) -> Block:
+    tx = Transaction(inputs=[TxInput(OutPoint.from_hex("ab" * 32, 0))],
+                     outputs=[TxOutput(5, "addr")], timestamp=1700000000)
+    block = Block(version=version, height=3, prev_block_hash="11" * 32, difficulty=1,
+                  transactions=[tx])
+    block.merkle_root = block.calculate_merkle_root()
+    return block
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_template_matches_header_hash(version):
+    block = make_block(version)
+    template = HeaderTemplate.from_block(block)
+    for nonce in (0, 1, 12345, 2**32 - 1):
+        block.nonce = nonce
+        assert template.header_hash(nonce).hex() == block.get_header_hash()
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_scan_finds_first_nonce_below_target(version):
+    block = make_block(version)
+    template = HeaderTemplate.from_block(block)
+    target = difficulty_to_target(2)
+    expected = next(n for n in range(100_000) if template.header_hash(n) < target)
+    assert scan_nonces(template, target, 0, 100_000) == expected
+    assert scan_nonces(template, target, expected + 1, expected + 1) is None
+
+
+def test_target_counts_leading_hex_zeros():
+    assert difficulty_to_target(1) == bytes([0x10]) + bytes(31)
+    assert difficulty_to_target(4) == bytes([0x00, 0x01]) + bytes(30)
+    assert all(b == 0xff for b in difficulty_to_target(0))
+    assert difficulty_to_target(64) == bytes(31) + b'\x01'
+    # Beyond 64 hex digits no hash can qualify
+    assert difficulty_to_target(65) == bytes(32)
+    assert difficulty_to_target(100) == bytes(32)
+
+
+def test_mined_block_meets_difficulty():
+    block = make_block()
+    block.transactions.append(Transaction(outputs=[TxOutput(1, "other")], timestamp=1))
+    assert BlockMiner.mine_block(block, target_difficulty=3)
+    assert block.merkle_root == block.calculate_merkle_root()
+    assert block.get_header_hash().startswith("000")
+
+
+def test_given_merkle_root_is_used():
+    block = make_block()
+    assert BlockMiner.mine_block(block, target_difficulty=1, merkle_root="ab" * 32)
+    assert block.merkle_root == "ab" * 32
+    assert HeaderTemplate.from_block(block).header_hash(block.nonce).hex() == block.get_header_hash()
+
+
+@pytest.fixture
+def miner():
+    with ParallelMiner(workers=2, batch_size=5_000) as miner:
+        yield miner
+
+
+def test_parallel_search_finds_valid_nonce(miner):
+    template = HeaderTemplate.from_block(make_block())
+    target = difficulty_to_target(3)
+    for _ in range(2):  # Workers are reused across jobs
+        result = miner.search(template, target)
+        assert result.nonce is not None and not result.cancelled
+        assert template.header_hash(result.nonce) < target
+        assert result.attempts == sum(result.worker_attempts) > 0
+
+
+def test_parallel_search_exhausts_nonce_space(miner):
+    template = HeaderTemplate.from_block(make_block())
+    result = miner.search(template, bytes(32), max_nonce=40_000)
+    assert result.nonce is None and not result.cancelled
+    assert result.attempts == 40_000
+
+
+def test_parallel_search_can_be_cancelled(miner):
+    template = HeaderTemplate.from_block(make_block())
+    threading.Timer(0.3, miner.cancel).start()
+    result = miner.search(template, bytes(32))
+    assert result.nonce is None and result.cancelled
+    assert result.attempts < MAX_NONCE
+
+
+def test_block_mined_in_parallel(miner):
+    block = make_block()
+    block.difficulty = 3
+    result = miner.mine_block(block)
+    assert result.nonce == block.nonce
+    assert block.get_header_hash().startswith("000")
+
+
+def test_lost_worker_ends_the_job(miner):
+    template = HeaderTemplate.from_block(make_block())
+    miner.search(template, difficulty_to_target(1))  # Start the workers
+    threading.Timer(0.3, miner._processes[0].terminate).start()
+    result = miner.search(template, bytes(32))
+    assert result.nonce is None and result.worker_lost and not result.cancelled
+
+    # The next job starts a fresh pool
+    result = miner.search(template, difficulty_to_target(2))
+    assert result.nonce is not None and not result.worker_lost
+
+
+def test_in_process_mining_can_be_cancelled():
+    cancel = threading.Event()
+    cancel.set()
+    block = make_block()
+    assert not BlockMiner.mine_block(block, target_difficulty=64, cancel=cancel)
+
+
+def test_tip_change_cancels_mining():
+    chain = Blockchain()
+    chain.append_block(make_block())
+    chain._mining_cancelled.clear()
+    chain.append_block(make_block())
+    assert chain._mining_cancelled.is_set()
+    chain._mining_cancelled.clear()
+    chain.rewind(1)
+    assert chain._mining_cancelled.is_set()
+    chain.close()
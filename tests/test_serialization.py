@@ -0,0 +1,104 @@
+"""
+Binary encoding round trips and legacy hash compatibility
+"""
+
+import pytest
+
+from xorcoin.core import Block, OutPoint, Transaction, TxInput, TxOutput
+from xorcoin.core.serialization import DecodeError
+
+
+def make_tx(version: int = 3) -> Transaction:
+    return Transaction(
+        version=version,
+        chain_id=1,
+        inputs=[TxInput(OutPoint.from_hex("ab" * 32, 1), b'sig', b'pk')],
+        outputs=[TxOutput(25, "addr1"), TxOutput(24, "addr2")],
+        locktime=0,
+        timestamp=1700000000
+    )
+
+
+def make_coinbase(version: int = 3) -> Transaction:
+    return Transaction(
+        version=version,
+        chain_id=1,
+        inputs=[],
+        outputs=[TxOutput(50, "miner")],
+        timestamp=1700000000
+    )
+
+
+def test_transaction_round_trip():
+    tx = make_tx()
+    decoded = Transaction.deserialize(tx.serialize())
+    assert decoded == tx
+    assert decoded.get_hash() == tx.get_hash()
+
+
+def test_block_round_trip():
+    block = Block(height=7, timestamp=1700000000, prev_block_hash="11" * 32,
+                  transactions=[make_coinbase(), make_tx()])
+    block.merkle_root = block.calculate_merkle_root()
+    decoded = Block.deserialize(block.serialize())
+    assert decoded == block
+    assert decoded.get_header_hash() == block.get_header_hash()
+
+
+def test_trailing_data_is_rejected():
+    with pytest.raises(DecodeError):
+        Transaction.deserialize(make_tx().serialize() + b'\x00')
+
+
+def test_truncated_data_is_rejected():
+    with pytest.raises(DecodeError):
+        Block.deserialize(Block(transactions=[make_tx()]).serialize()[:-1])
+
+
+def test_txid_ignores_signatures():
+    signed = make_tx()
+    signed.inputs[0] = signed.inputs[0]._replace(signature=b'other')
+    assert signed.get_hash() == make_tx().get_hash()
+    assert signed.serialize() != make_tx().serialize()
+
+
+# Hashes produced by the JSON encoding used before binary serialization
+LEGACY_TX_HASH = "cbd5301f7e4c84a887513afab4fbd4b2d8b0e706877ae6712837fc00c5e017fa"
+LEGACY_COINBASE_HASH = "189b1df6269298afb8ecbdf89054320a3835eca604e9dd2f59db9514fd1ca488"
+LEGACY_MERKLE_ROOT = "9c17e010a9be1a4d475bd479fba5fbdd2e07d8b6d1dccd85ae5083d69807b3b5"
+LEGACY_HEADER_HASH = "dc285bcf73a913f849437e777d4bb50d408562f09784264ba0adb43c7228cf47"
+
+
+def test_legacy_transaction_hashes():
+    assert make_tx(version=2).get_hash() == LEGACY_TX_HASH
+    assert make_coinbase(version=2).get_hash() == LEGACY_COINBASE_HASH
+
+
+def test_legacy_block_hashes():
+    block = Block(version=1, height=7, timestamp=1700000000, prev_block_hash="11" * 32,
+                  difficulty=4, nonce=12345,
+                  transactions=[make_coinbase(version=2), make_tx(version=2)])
+    block.merkle_root = block.calculate_merkle_root()
+    assert block.merkle_root == LEGACY_MERKLE_ROOT
+    assert block.get_header_hash() == LEGACY_HEADER_HASH
+
+
+def test_legacy_block_round_trip():
+    block = Block(version=1, height=7, timestamp=1700000000, prev_block_hash="11" * 32,
+                  transactions=[make_coinbase(version=2), make_tx(version=2)])
+    block.merkle_root = block.calculate_merkle_root()
+    decoded = Block.deserialize(block.serialize())
+    assert decoded.get_header_hash() == block.get_header_hash()
+    assert [tx.get_hash() for tx in decoded.transactions] == [LEGACY_COINBASE_HASH, LEGACY_TX_HASH]
+
+
+def test_serialized_sizes_are_exact():
+    tx = make_tx()
+    assert tx.serialized_size == len(tx.serialize())
+    tx.outputs.append(TxOutput(1, "x" * 300))
+    assert tx.serialized_size == len(tx.serialize())
+
+    block = Block(transactions=[make_coinbase()] + [make_tx() for _ in range(300)])
+    assert block.serialized_size == len(block.serialize())
+    block.transactions.append(tx)
+    assert block.serialized_size == len(block.serialize())
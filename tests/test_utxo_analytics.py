@@ -0,0 +1,136 @@
+"""
+Columnar UTXO analytics view
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from xorcoin import XorcoinSystem
+from xorcoin.core import Block, OutPoint, Transaction, TxInput, TxOutput, UTXOAnalytics
+
+
+def live_coins(system):
+    return [utxo for shard in system.utxo_set.shards for utxo in shard.values()]
+
+
+def check_matches(analytics, system):
+    coins = live_coins(system)
+    addresses = {utxo.script_pubkey for utxo in coins}
+    assert analytics.coin_count() == len(coins)
+    assert analytics.total_amount() == sum(utxo.amount for utxo in coins)
+    assert analytics.sums_by_address(addresses) == {
+        address: system.utxo_set.get_balance(address) for address in addresses
+    }
+    assert analytics.height == len(system.blockchain.chain) - 1
+
+
+def rows(analytics):
+    """Every live coin as (amount, address, creation height)"""
+    live = np.flatnonzero(analytics.live[:analytics._next_row])
+    return sorted(zip(analytics.amounts[live].tolist(),
+                      [analytics.addresses[i] for i in analytics.address_ids[live]],
+                      analytics.heights[live].tolist()))
+
+
+@pytest.fixture(params=["memory", "data_dir"])
+def system(request, tmp_path):
+    system = XorcoinSystem(data_dir=str(tmp_path) if request.param == "data_dir" else None)
+    yield system
+    system.close()
+
+
+def test_view_follows_the_chain(system):
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    analytics = system.utxo_analytics()
+    check_matches(analytics, system)
+
+    for amount in (7, 9):
+        assert system.add_transaction(system.create_transaction(sender, receiver, amount, key))
+        system.mine_block("miner")
+    assert analytics.sync(system.blockchain) == 2
+    assert analytics.sync(system.blockchain) == 0
+    check_matches(analytics, system)
+    assert analytics.balance_of(receiver) == 16
+    assert analytics.balance_of("nobody") == 0
+
+
+def test_view_survives_a_reorg(system):
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    branch = [system.mine_block("miner") for _ in range(2)]
+    for _ in branch:
+        system.disconnect_block()
+    system.mine_block("other")
+
+    analytics = system.utxo_analytics()
+    assert analytics.balance_of("other") > 0
+    assert system.reorganize(branch)
+    analytics.sync(system.blockchain)
+    check_matches(analytics, system)
+    assert analytics.balance_of("other") == 0
+    assert analytics.balance_of(receiver) == 7
+
+
+def reorg_spends_away(system, analytics):
+    """Replace two blocks, the first paying 7 to a receiver, with three others"""
+    key, _, sender = system.generate_wallet()
+    _, _, receiver = system.generate_wallet()
+    system.mine_block(sender)
+    assert system.add_transaction(system.create_transaction(sender, receiver, 7, key))
+    old = [system.mine_block("miner") for _ in range(2)]
+    analytics.sync(system.blockchain)
+    assert analytics.balance_of(receiver) == 7
+
+    for _ in old:
+        system.disconnect_block()
+    system.mine_block("other")
+    branch = [system.mine_block("other") for _ in range(2)]
+    return receiver, branch
+
+
+def test_reorg_is_stepped_back_with_undo(system):
+    analytics = system.utxo_analytics()
+    receiver, branch = reorg_spends_away(system, analytics)
+    # Only the new blocks are applied, after undoing the old ones
+    assert analytics.sync(system.blockchain) == 3
+    check_matches(analytics, system)
+    assert analytics.balance_of(receiver) == 0
+
+    fresh = UTXOAnalytics()
+    fresh.sync(system.blockchain)
+    assert rows(analytics) == rows(fresh)
+
+
+def test_reorg_deeper_than_undo_depth_rebuilds(system):
+    analytics = system.utxo_analytics()
+    analytics.UNDO_DEPTH = 1
+    receiver, _ = reorg_spends_away(system, analytics)
+    assert analytics.sync(system.blockchain) == len(system.blockchain.chain)
+    check_matches(analytics, system)
+    assert analytics.balance_of(receiver) == 0
+
+
+def test_aggregate_queries():
+    analytics = UTXOAnalytics(capacity=2)
+    coinbase = Transaction(outputs=[TxOutput(amount, f"addr{amount % 3}")
+                                    for amount in (1, 2, 3, 100, 1000)])
+    analytics.apply_block(Block(height=0, transactions=[coinbase]), 0)
+    spend = Transaction(inputs=[TxInput(OutPoint(coinbase.get_txid(), 4))],
+                        outputs=[TxOutput(600, "addr0"), TxOutput(400, "addr3")])
+    analytics.apply_block(Block(height=1, transactions=[spend]), 1)
+
+    assert analytics.coin_count() == 6
+    assert analytics.top_balances(2) == [("addr0", 603), ("addr3", 400)]
+    assert analytics.dust(50) == (3, 6)
+    counts, edges = analytics.amount_histogram()
+    assert counts.sum() == 6 and edges[0] == 0
+    counts, _ = analytics.height_histogram(bins=[0, 1, 2])
+    assert list(counts) == [4, 2]
+
+    analytics.clear()
+    assert analytics.coin_count() == 0 and analytics.top_balances() == []
@@ -0,0 +1,296 @@
+"""
+UTXO sets keyed by binary outpoints
+"""
+
+import random
+import threading
+import time
+
+import pytest
+
+from xorcoin.core import CoinMap, OutPoint, ThreadSafeUTXOSet, UTXO, UTXOSet
+from xorcoin.core.utxo_threadsafe import RWLock
+from xorcoin.storage import ChainstateDB
+
+
+def coin(n: int, index: int = 0, amount: int = 10, address: str = "addr") -> UTXO:
+    return UTXO(OutPoint(n.to_bytes(32, 'big'), index), amount, address)
+
+
+def test_outpoint_encoding():
+    outpoint = OutPoint.from_hex("ab" * 32, 70000)
+    data = outpoint.to_bytes()
+    assert len(data) == 36
+    assert OutPoint.from_bytes(data) == outpoint
+    assert str(outpoint) == "ab" * 32 + ":70000"
+
+
+def test_coin_map_behaves_like_a_dict():
+    coins = CoinMap()
+    a, b = coin(1, amount=2**40, address="ünicode"), coin(2, index=3)
+    coins[a.outpoint] = a
+    assert coins.put(b) == (b.outpoint.to_bytes(), coins._coins[b.outpoint.to_bytes()])
+    assert coins[a.outpoint] == a and coins.get(b.outpoint) == b
+    assert a.outpoint in coins and "not an outpoint" not in coins
+    assert sorted(coins) == sorted([a.outpoint, b.outpoint])
+    assert sorted(coins.values()) == sorted([a, b])
+    assert coins.pop(a.outpoint) == a
+    assert coins.pop(a.outpoint, None) is None
+    with pytest.raises(KeyError):
+        coins.pop(a.outpoint)
+    with pytest.raises(KeyError):
+        coins[a.outpoint]
+    del coins[b.outpoint]
+    assert len(coins) == 0 and coins.get(b.outpoint) is None
+
+
+@pytest.fixture(params=["dict", "threadsafe", "chainstate"])
+def utxo_set(request, tmp_path):
+    if request.param == "dict":
+        yield UTXOSet()
+    elif request.param == "threadsafe":
+        yield ThreadSafeUTXOSet()
+    else:
+        utxo_set = ThreadSafeUTXOSet(ChainstateDB(str(tmp_path / "chainstate.sqlite")))
+        yield utxo_set
+        utxo_set.close()
+
+
+def test_add_get_remove(utxo_set):
+    a, b = coin(1), coin(1, index=1, amount=5, address="other")
+    utxo_set.add_utxo(a)
+    utxo_set.add_utxo(b)
+    assert len(utxo_set) == 2
+    assert utxo_set.get_utxo(OutPoint(a.txid, 0)) == a
+    assert OutPoint.from_hex(a.tx_hash, 1) in utxo_set
+    assert utxo_set.get_balance("addr") == 10
+    assert utxo_set.get_utxos_for_address("other") == {b.get_id(): b}
+
+    utxo_set.remove_utxo(a.get_id())
+    assert utxo_set.get_utxo(a.get_id()) is None
+    assert utxo_set.get_balance("addr") == 0
+    assert len(utxo_set) == 1
+
+
+def test_batch_update_removes_before_adding():
+    utxo_set = ThreadSafeUTXOSet()
+    old, replaced = coin(1), coin(1, amount=20)
+    utxo_set.add_utxo(old)
+    utxo_set.batch_update([replaced, coin(2)], [old.get_id(), coin(3).get_id()])
+    assert utxo_set.get_utxo(old.get_id()) == replaced
+    assert len(utxo_set) == 2
+
+
+ADDRESSES = [f"addr{i}" for i in range(5)]
+
+
+def check_index(utxo_set, expected):
+    for address in ADDRESSES:
+        coins = {u.outpoint: u for u in expected.values() if u.script_pubkey == address}
+        assert utxo_set.get_utxos_for_address(address) == coins
+        assert utxo_set.get_balance(address) == sum(u.amount for u in coins.values())
+
+
+def test_address_index_follows_every_change(utxo_set):
+    rng = random.Random(7)
+    expected = {}
+    for step in range(300):
+        added = [coin(rng.randrange(40), rng.randrange(2), rng.randrange(1, 100), rng.choice(ADDRESSES))
+                 for _ in range(rng.randrange(3))]
+        removed = [coin(rng.randrange(40), rng.randrange(2)).outpoint for _ in range(rng.randrange(3))]
+        if rng.random() < 0.5:
+            utxo_set.batch_update(added, removed)
+        else:
+            for outpoint in removed:
+                if outpoint in expected:
+                    utxo_set.remove_utxo(outpoint)
+            for utxo in added:
+                utxo_set.add_utxo(utxo)
+        for outpoint in removed:
+            expected.pop(outpoint, None)
+        for utxo in added:
+            expected[utxo.outpoint] = utxo
+        if step % 50 == 0:
+            check_index(utxo_set, expected)
+        if step == 150 and getattr(utxo_set, 'db', None) is not None:
+            utxo_set.db.flush()
+    check_index(utxo_set, expected)
+    assert len(utxo_set) == len(expected)
+
+
+def test_chainstate_index_survives_reopen(tmp_path):
+    path = str(tmp_path / "chainstate.sqlite")
+    utxo_set = ThreadSafeUTXOSet(ChainstateDB(path))
+    coins = [coin(n, amount=n + 1, address=ADDRESSES[n % 3]) for n in range(12)]
+    utxo_set.batch_update(coins, [])
+    utxo_set.db.flush()
+    utxo_set.batch_update([], [c.outpoint for c in coins[:4]])
+    utxo_set.close()
+
+    utxo_set = ThreadSafeUTXOSet(ChainstateDB(path))
+    try:
+        check_index(utxo_set, {c.outpoint: c for c in coins[4:]})
+    finally:
+        utxo_set.close()
+
+
+def test_concurrent_batches_on_shared_addresses():
+    utxo_set = ThreadSafeUTXOSet(stripes=4)
+    expected = {}
+
+    def worker(offset):
+        for n in range(offset, offset + 200):
+            utxo_set.batch_update([coin(n, address=ADDRESSES[n % 5])], [coin(n - 2).outpoint])
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in (1000, 2000, 3000, 4000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for offset in (1000, 2000, 3000, 4000):
+        for n in range(offset + 198, offset + 200):
+            expected[coin(n).outpoint] = coin(n, address=ADDRESSES[n % 5])
+    check_index(utxo_set, expected)
+    assert len(utxo_set) == len(expected)
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    lock.acquire_read()
+    order = []
+    writer = threading.Thread(target=lambda: (lock.acquire_write(), order.append("w"), lock.release_write()))
+    writer.start()
+    wait_until(lambda: lock._waiting_writers == 1)
+    reader = threading.Thread(target=lambda: (lock.acquire_read(), order.append("r"), lock.release_read()))
+    reader.start()
+    wait_until(lambda: lock._waiting_readers == 1)
+    assert order == []
+    lock.release_read()
+    writer.join(2)
+    reader.join(2)
+    assert order == ["w", "r"]
+
+
+def test_queued_readers_go_before_next_writer():
+    lock = RWLock()
+    lock.acquire_write()
+    order = []
+
+    def write(tag):
+        lock.acquire_write()
+        order.append(tag)
+        lock.release_write()
+
+    def read():
+        lock.acquire_read()
+        order.append("r")
+        lock.release_read()
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    wait_until(lambda: lock._waiting_readers == 3)
+    writer = threading.Thread(target=write, args=("w",))
+    writer.start()
+    wait_until(lambda: lock._waiting_writers == 1)
+    lock.release_write()
+    for thread in readers + [writer]:
+        thread.join(2)
+    assert order == ["r", "r", "r", "w"]
+
+
+@pytest.fixture(params=["threadsafe", "chainstate"])
+def threadsafe_set(request, tmp_path):
+    if request.param == "threadsafe":
+        yield ThreadSafeUTXOSet(stripes=4)
+    else:
+        utxo_set = ThreadSafeUTXOSet(ChainstateDB(str(tmp_path / "chainstate.sqlite")))
+        yield utxo_set
+        utxo_set.close()
+
+
+def test_snapshot_keeps_its_version(threadsafe_set):
+    coins = [coin(n, amount=n + 1, address=ADDRESSES[n % 3]) for n in range(9)]
+    threadsafe_set.batch_update(coins[:6], [])
+    threadsafe_set.commit_block("00" * 32, 0)
+    snapshot = threadsafe_set.snapshot()
+    before = {c.outpoint: c for c in coins[:6]}
+
+    threadsafe_set.batch_update(coins[6:] + [coin(0, amount=99, address="addr4")],
+                                [c.outpoint for c in coins[1:3]])
+    threadsafe_set.remove_utxo(coins[3].outpoint)
+    check_index(snapshot, before)
+    for c in coins:
+        assert snapshot.get_utxo(c.outpoint) == before.get(c.outpoint)
+        assert (c.outpoint in snapshot) == (c.outpoint in before)
+
+    # Unpublished changes stay invisible until the next commit
+    assert threadsafe_set.snapshot() is snapshot
+    threadsafe_set.commit_block("11" * 32, 1)
+    latest = threadsafe_set.snapshot()
+    assert latest.version == snapshot.version + 1
+    after = {c.outpoint: c for c in coins[4:]}
+    after[coins[0].outpoint] = coin(0, amount=99, address="addr4")
+    check_index(latest, after)
+    check_index(snapshot, before)
+
+
+def test_snapshot_reads_race_with_writers():
+    utxo_set = ThreadSafeUTXOSet(stripes=4)
+    coins = [coin(n, address=ADDRESSES[n % 5]) for n in range(50)]
+    utxo_set.batch_update(coins, [])
+    utxo_set.publish()
+    snapshot = utxo_set.snapshot()
+    stop = threading.Event()
+
+    def writer():
+        n = 50
+        while not stop.is_set():
+            utxo_set.batch_update([coin(n, address=ADDRESSES[n % 5])], [coin(n - 50).outpoint])
+            n += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for _ in range(200):
+            assert snapshot.get_balance("addr0") == 100
+            assert len(utxo_set.get_utxos_for_address("addr1")) == 10
+            assert len(snapshot.get_utxos_for_address("addr2")) == 10
+            assert all(snapshot.get_utxo(c.outpoint) == c for c in coins[:10])
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_snapshot_keeps_only_what_changed(threadsafe_set):
+    big = [coin(n, address="whale") for n in range(200)]
+    threadsafe_set.batch_update(big, [])
+    threadsafe_set.commit_block("00" * 32, 0)
+    snapshot = threadsafe_set.snapshot()
+
+    threadsafe_set.batch_update([coin(500, amount=3, address="whale")], [big[0].outpoint])
+    assert snapshot._changed == {"whale": {big[0].outpoint, coin(500).outpoint}}
+    assert snapshot._balance_delta == {"whale": 10 - 3}
+    assert snapshot.get_balance("whale") == 2000
+    assert snapshot.get_utxos_for_address("whale") == {c.outpoint: c for c in big}
+    assert threadsafe_set.get_balance("whale") == 1993
+
+
+def test_snapshot_survives_clear(threadsafe_set):
+    coins = [coin(n, amount=n + 1, address=ADDRESSES[n % 3]) for n in range(9)]
+    threadsafe_set.batch_update(coins, [])
+    threadsafe_set.commit_block("00" * 32, 0)
+    snapshot = threadsafe_set.snapshot()
+
+    threadsafe_set.clear()
+    assert len(threadsafe_set) == 0
+    check_index(threadsafe_set, {})
+    check_index(snapshot, {c.outpoint: c for c in coins})
+    assert all(snapshot.get_utxo(c.outpoint) == c for c in coins)
@@ -3,7 +3,7 @@ Xorcoin - A minimalistic secure UTXO-based token system
 """
 
 from .system import XorcoinSystem
-from .core.models import Transaction, Block, UTXO, TxInput, TxOutput
+from .core.models import Transaction, Block, OutPoint, UTXO, TxInput, TxOutput
 from .crypto.keys import KeyManager
 
 __version__ = "0.1.0"
@@ -11,6 +11,7 @@ __all__ = [
     "XorcoinSystem",
     "Transaction",
     "Block",
+    "OutPoint",
     "UTXO",
     "TxInput",
     "TxOutput",
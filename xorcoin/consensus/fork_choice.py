@@ -1,10 +1,20 @@
 """
 Fork choice rules for handling blockchain forks
 """
-from typing import List, Dict
+from typing import Iterable, List, Dict
 from xorcoin.core.models import Block, Transaction, Transaction, Transaction
 
 class ForkChoice:
+    @staticmethod
+    def chain_work(blocks: Iterable[Block]) -> int:
+        """
+        Expected hashes needed to mine the blocks
+        
+        Each difficulty step demands one more leading zero hex digit, so
+        it multiplies a block's work by 16.
+        """
+        return sum(16 ** max(block.difficulty, 0) for block in blocks)
+        
     @staticmethod
     def get_canonical_chain(chains: Dict[str, List[Block]]) -> List[Block]:
         """
@@ -14,7 +24,7 @@ class ForkChoice:
         best_work = 0
         
         for chain_id, chain in chains.items():
-            total_work = sum(2 ** block.difficulty for block in chain)
+            total_work = ForkChoice.chain_work(chain)
             if total_work > best_work:
                 best_work = total_work
                 best_chain = chain
@@ -17,9 +17,7 @@ class ConsensusRules:
     @staticmethod
     def validate_block_size(block: Block) -> bool:
         """Validate block doesn't exceed size limits"""
-        # Serialize and check size
-        block_size = len(str(block).encode())
-        return block_size <= ConsensusRules.MAX_BLOCK_SIZE
+        return block.serialized_size <= ConsensusRules.MAX_BLOCK_SIZE
     
     @staticmethod
     def validate_timestamp(block: Block, previous_block: Block) -> bool:
@@ -31,7 +29,7 @@ class ConsensusRules:
             return False
             
         # Check not before previous block
-        if block.timestamp <= previous_block.timestamp:
+        if block.timestamp < previous_block.timestamp:
             return False
             
         return True
@@ -2,21 +2,42 @@
 Xorcoin core components
 """
 
-from .models import UTXO, TxInput, TxOutput, Transaction, Block
+from .models import OutPoint, UTXO, TxInput, TxOutput, Transaction, Block
 from .utxo import UTXOSet
+from .coin_map import CoinMap
+from .address_index import AddressIndex
 from .block import BlockMiner, Blockchain
+from .mining import ParallelMiner
+from .merkle import MerkleTree
+from .undo import BlockUndo
+from .coins_view import CoinsViewCache
 from .utxo_threadsafe import ThreadSafeUTXOSet
-from .mempool import Mempool
+from .utxo_analytics import UTXOAnalytics
+from .priority_index import TxPriorityIndex
+from .block_template import BlockTemplate, BlockTemplateBuilder
+from .mempool import Mempool, MempoolEntry
 
 __all__ = [
+    "OutPoint",
     "UTXO",
     "TxInput", 
     "TxOutput",
     "Transaction",
     "Block",
     "UTXOSet",
+    "CoinMap",
+    "AddressIndex",
     "ThreadSafeUTXOSet",
+    "UTXOAnalytics",
     "Mempool",
+    "MempoolEntry",
+    "TxPriorityIndex",
+    "BlockTemplate",
+    "BlockTemplateBuilder",
     "BlockMiner",
     "Blockchain",
+    "ParallelMiner",
+    "MerkleTree",
+    "BlockUndo",
+    "CoinsViewCache",
 ]
@@ -0,0 +1,58 @@
+"""
+Secondary address index for UTXO sets
+"""
+
+from typing import Dict, Optional, Tuple
+from .coin_map import pack_coin, unpack_coin
+from .models import OutPoint, UTXO
+
+
+class AddressIndex:
+    """
+    Coins and running balance per address
+
+    Kept in step with the primary OutPoint -> UTXO map so balance queries
+    are O(1) and listing an address's coins is O(k) in its coin count.
+    Coins are held in CoinMap's packed layout; pass the key and value a
+    CoinMap already stores to share the objects rather than copy them.
+    """
+    
+    def __init__(self):
+        self.coins: Dict[str, Dict[bytes, bytes]] = {}
+        self.balances: Dict[str, int] = {}
+        
+    def add(self, utxo: UTXO, stored: Optional[Tuple[bytes, bytes]] = None) -> None:
+        """Index a coin that was added to the set"""
+        address = utxo.script_pubkey
+        key, value = stored if stored is not None else (utxo.outpoint.to_bytes(), pack_coin(utxo))
+        self.coins.setdefault(address, {})[key] = value
+        self.balances[address] = self.balances.get(address, 0) + utxo.amount
+        
+    def remove(self, utxo: UTXO) -> None:
+        """Drop a coin that left the set"""
+        address = utxo.script_pubkey
+        coins = self.coins.get(address)
+        if coins is None or coins.pop(utxo.outpoint.to_bytes(), None) is None:
+            return
+        if coins:
+            self.balances[address] -= utxo.amount
+        else:
+            # Forget empty addresses so spent-out wallets cost nothing
+            del self.coins[address]
+            del self.balances[address]
+            
+    def get_balance(self, address: str) -> int:
+        return self.balances.get(address, 0)
+        
+    def get_utxos(self, address: str) -> Dict[OutPoint, UTXO]:
+        """Copy of the coins held by an address"""
+        result = {}
+        # One C-level copy, so lock-free snapshot readers never see it change size
+        for key, value in list(self.coins.get(address, {}).items()):
+            utxo = unpack_coin(key, value)
+            result[utxo.outpoint] = utxo
+        return result
+        
+    def clear(self) -> None:
+        self.coins.clear()
+        self.balances.clear()
@@ -2,63 +2,132 @@
 Block mining and blockchain operations for Xorcoin
 """
 
+import threading
 import time
-import secrets
+from typing import Dict, List, Optional, Sequence
 from .models import Block
+from .undo import BlockUndo
+from .mining import (
+    MAX_NONCE, HeaderTemplate, ParallelMiner, difficulty_to_target, scan_nonces
+)
+from xorcoin.storage.block_store import BlockStore
 
 
 class BlockMiner:
     """Handles block mining operations"""
     
+    PROGRESS_INTERVAL = 100_000  # Nonces scanned between progress updates
+    
     @staticmethod
-    def mine_block(block: Block, target_difficulty: int = None) -> bool:
+    def mine_block(block: Block, target_difficulty: int = None,
+                   miner: Optional[ParallelMiner] = None,
+                   cancel: Optional[threading.Event] = None,
+                   merkle_root: Optional[str] = None) -> bool:
         """
-        Proof-of-Work mining with secure nonce
+        Proof-of-Work mining over a sequential nonce range
         
         Args:
             block: The block to mine
             target_difficulty: Override block's difficulty if provided
+            miner: Multi-process miner to use instead of the current process
+            cancel: Checked between batches; once set, in-process mining stops
+            merkle_root: Root of the block's transactions, if the caller
+                already has it; calculated otherwise
             
         Returns:
-            True if block was successfully mined
+            True if block was successfully mined, False if the nonce
+            space was exhausted or mining was cancelled
         """
         if target_difficulty:
             block.difficulty = target_difficulty
             
-        block.merkle_root = block.calculate_merkle_root()
-        target = "0" * block.difficulty
-        attempts = 0
+        block.merkle_root = merkle_root or block.calculate_merkle_root()
+        
+        if miner is not None:
+            return BlockMiner._mine_parallel(block, miner)
+            
+        template = HeaderTemplate.from_block(block)
+        target = difficulty_to_target(block.difficulty)
         start_time = time.time()
         
         print(f"Mining block at height {block.height} with difficulty {block.difficulty}...")
         
-        while True:
-            # Use cryptographically secure random nonce
-            block.nonce = secrets.randbits(32)
-            hash_result = block.get_header_hash()
+        for batch_start in range(0, MAX_NONCE, BlockMiner.PROGRESS_INTERVAL):
+            batch_end = min(batch_start + BlockMiner.PROGRESS_INTERVAL, MAX_NONCE)
+            nonce = scan_nonces(template, target, batch_start, batch_end)
             
-            if hash_result.startswith(target):
+            if nonce is not None:
+                block.nonce = nonce
                 elapsed = time.time() - start_time
-                print(f"Block mined! Hash: {hash_result}")
-                print(f"Nonce: {block.nonce}, Attempts: {attempts}, Time: {elapsed:.2f}s")
+                print(f"Block mined! Hash: {block.get_header_hash()}")
+                print(f"Nonce: {nonce}, Attempts: {nonce + 1}, Time: {elapsed:.2f}s")
                 return True
                 
-            attempts += 1
+            if cancel is not None and cancel.is_set():
+                print(f"Mining stopped (cancelled) after {batch_end:,} attempts")
+                return False
+                
+            # Progress update after every batch
+            elapsed = time.time() - start_time
+            rate = batch_end / elapsed if elapsed > 0 else 0
+            print(f"Mining... Attempts: {batch_end:,}, Rate: {rate:,.0f} H/s")
             
-            # Progress update every 100k attempts
-            if attempts % 100000 == 0:
-                elapsed = time.time() - start_time
-                rate = attempts / elapsed
-                print(f"Mining... Attempts: {attempts:,}, Rate: {rate:,.0f} H/s")
+        return False
+        
+    @staticmethod
+    def _mine_parallel(block: Block, miner: ParallelMiner) -> bool:
+        """Mine on all of the miner's worker processes"""
+        print(f"Mining block at height {block.height} with difficulty {block.difficulty} "
+              f"on {miner.workers} workers...")
+        
+        result = miner.mine_block(block)
+        
+        if result.nonce is None:
+            if result.cancelled:
+                reason = "cancelled"
+            elif result.worker_lost:
+                reason = "worker lost"
+            else:
+                reason = "nonce space exhausted"
+            print(f"Mining stopped ({reason}) after {result.attempts:,} attempts")
+            return False
+            
+        per_worker = ", ".join(f"{rate:,.0f}" for rate in result.worker_hashrates)
+        print(f"Block mined! Hash: {block.get_header_hash()}")
+        print(f"Nonce: {result.nonce}, Attempts: {result.attempts}, Time: {result.elapsed:.2f}s")
+        print(f"Rate: {result.hashrate:,.0f} H/s (per worker: {per_worker})")
+        return True
 
 
 class Blockchain:
     """Simple blockchain implementation"""
     
-    def __init__(self):
-        self.chain: list[Block] = []
+    def __init__(self, mining_workers: int = 1, data_dir: Optional[str] = None):
+        # Blocks live in memory unless a data directory is given, in which
+        # case they are persisted and read back lazily from the block store
+        self.store: Optional[BlockStore] = BlockStore(data_dir) if data_dir else None
+        self.chain: Sequence[Block] = self.store if self.store is not None else []
         self.difficulty = 4
         
+        # Header hash -> height for every block on the active chain
+        if self.store is not None:
+            self.block_index: Dict[str, int] = {
+                block_hash: height for height, block_hash in enumerate(self.store.hashes)
+            }
+        else:
+            self.block_index = {}
+            
+        # Undo records by block hash, when there is no block store to hold
+        # them; like the store's, they outlive a rewind so that views of
+        # the old chain can still be stepped back
+        self.undo: Dict[str, BlockUndo] = {}
+        
+        # Mining runs in-process unless more than one worker is requested
+        self.miner: Optional[ParallelMiner] = (
+            ParallelMiner(mining_workers) if mining_workers > 1 else None
+        )
+        self._mining_cancelled = threading.Event()
+        
     def add_genesis_block(self):
         """Create and add the genesis block"""
         genesis = Block(
@@ -66,11 +135,15 @@ class Blockchain:
             prev_block_hash="0" * 64,
             difficulty=self.difficulty
         )
-        BlockMiner.mine_block(genesis)
-        self.chain.append(genesis)
+        BlockMiner.mine_block(genesis, miner=self.miner)
+        self.append_block(genesis)
+        
+    def add_block(self, block: Block, merkle_root: Optional[str] = None) -> bool:
+        """
+        Add a new block to the chain after validation
         
-    def add_block(self, block: Block) -> bool:
-        """Add a new block to the chain after validation"""
+        merkle_root is passed on to the miner; see BlockMiner.mine_block.
+        """
         if not self.chain:
             raise ValueError("Cannot add block to empty chain")
             
@@ -79,12 +152,96 @@ class Blockchain:
         block.prev_block_hash = self.chain[-1].get_header_hash()
         block.difficulty = self.difficulty
         
-        # Mine the block
-        if BlockMiner.mine_block(block):
-            self.chain.append(block)
+        # Mine the block, unless the tip moves first
+        self._mining_cancelled.clear()
+        if BlockMiner.mine_block(block, miner=self.miner, cancel=self._mining_cancelled,
+                                 merkle_root=merkle_root):
+            if block.prev_block_hash != self.chain[-1].get_header_hash():
+                print(f"Tip changed while mining block {block.height}, discarding it")
+                return False
+            self.append_block(block)
             return True
         return False
         
+    def append_block(self, block: Block) -> None:
+        """Append an already mined block to the tip and index it"""
+        # Work on the old tip is wasted from here on
+        self.cancel_mining()
+        self.block_index[block.get_header_hash()] = len(self.chain)
+        self.chain.append(block)
+        
+    def rewind(self, height: int) -> List[Block]:
+        """
+        Disconnect every block at and above height, e.g. during a reorg
+        
+        Returns the removed blocks, tip last.
+        """
+        self.cancel_mining()
+        removed = list(self.chain[height:])
+        for block in removed:
+            self.block_index.pop(block.get_header_hash(), None)
+        if self.store is not None:
+            self.store.truncate(height)
+        else:
+            del self.chain[height:]
+        return removed
+        
+    def put_undo(self, block_hash: str, undo: BlockUndo) -> None:
+        """Keep the undo record of a connected block"""
+        if self.store is not None:
+            self.store.write_undo(block_hash, undo.serialize())
+        else:
+            self.undo[block_hash] = undo
+            
+    def get_undo(self, block_hash: str) -> Optional[BlockUndo]:
+        """Undo record of a block, or None if it was never connected; kept after a rewind"""
+        if self.store is not None:
+            data = self.store.read_undo(block_hash)
+            return BlockUndo.deserialize(data) if data is not None else None
+        return self.undo.get(block_hash)
+        
+    def has_undo(self, block_hash: str) -> bool:
+        if self.store is not None:
+            return block_hash in self.store.undo_by_hash
+        return block_hash in self.undo
+        
+    def has_block(self, block_hash: str) -> bool:
+        """Check whether a block is on the active chain"""
+        return block_hash in self.block_index
+        
+    def get_block_height(self, block_hash: str) -> Optional[int]:
+        """Height of a block on the active chain, or None"""
+        return self.block_index.get(block_hash)
+        
+    def get_block_by_hash(self, block_hash: str) -> Optional[Block]:
+        """Look up a block on the active chain by header hash"""
+        height = self.block_index.get(block_hash)
+        if height is None:
+            return None
+        return self.chain[height]
+        
+    def flush(self) -> None:
+        """Force stored blocks to disk"""
+        if self.store is not None:
+            self.store.flush()
+            
+    def close(self) -> None:
+        """Flush the block store and stop mining workers"""
+        if self.store is not None:
+            self.store.close()
+        if self.miner is not None:
+            self.miner.close()
+            
+    def cancel_mining(self) -> None:
+        """
+        Abort an in-progress mining job; called whenever the tip changes
+        
+        Safe to call from any thread, and a no-op when nothing is mining.
+        """
+        self._mining_cancelled.set()
+        if self.miner is not None:
+            self.miner.cancel()
+            
     def get_latest_block(self) -> Block:
         """Get the most recent block"""
         if not self.chain:
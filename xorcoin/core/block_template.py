@@ -0,0 +1,189 @@
+"""
+Incremental block template assembly from the mempool
+"""
+
+import heapq
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from .merkle import MerkleTree
+from .models import Transaction
+from .priority_index import TxPriorityIndex
+from .serialization import ZERO_HASH
+
+
+class BlockTemplate(NamedTuple):
+    """
+    Mempool transactions chosen for the next block, parents first
+
+    merkle_tree covers their txids behind a first leaf kept for the
+    coinbase, so the block's root costs one O(log n) proof fold once the
+    coinbase is known. The tree itself is never changed, as a template
+    may be shared.
+    """
+    transactions: List[Transaction]
+    size: int
+    fees: int
+    merkle_tree: MerkleTree
+
+    def merkle_root(self, coinbase: Transaction) -> str:
+        """Merkle root of the block made of coinbase and these transactions"""
+        proof = self.merkle_tree.get_proof(0)
+        return MerkleTree.root_from_proof(coinbase.get_txid(), 0, proof).hex()
+
+
+class BlockTemplateBuilder:
+    """
+    Keeps the most profitable next block for a Mempool
+
+    Transactions are ranked by ancestor package fee rate: their fee and
+    size together with those of every unconfirmed transaction they
+    depend on, since a block can only take them all. A cheap parent is
+    thus mined for the sake of a well-paying child. Assembly walks the
+    ranking from the top and takes each package whole. Once part of a
+    package is in the block, the rest is re-ranked on what it still needs
+    through a side heap.
+
+    The mempool reports every arrival and departure. Only that
+    transaction and its descendants are re-ranked, and the last template
+    is reused until a change could alter it: a package that would beat
+    the block's weakest one or fits its free space, or the removal of
+    something in it.
+    """
+
+    RESERVED_SIZE = 1000  # Bytes kept for the block header and coinbase
+    MAX_CONSECUTIVE_FAILURES = 1000  # Packages that did not fit before giving up on a nearly full block
+    BLOCK_FULL_MARGIN = 4000  # Bytes short of the maximum that count as nearly full
+
+    def __init__(self, mempool, max_block_size: Optional[int] = None):
+        if max_block_size is None:
+            # Imported here: xorcoin.consensus imports xorcoin.core
+            from xorcoin.consensus.rules import ConsensusRules
+            max_block_size = ConsensusRules.MAX_BLOCK_SIZE
+        self.mempool = mempool
+        self.max_size = max_block_size - self.RESERVED_SIZE
+        self.by_ancestor_score = TxPriorityIndex()  # tx_hash by package fee per byte
+        self._template: Optional[BlockTemplate] = None
+        self._selected: Set[str] = set()
+        self._floor = 0.0  # Lowest package fee rate in the template
+        self._free = 0  # Bytes the template leaves unused
+
+    def _package(self, tx_hash: str, included: Set[str] = frozenset()) -> Tuple[Set[str], int, int]:
+        """tx_hash and its ancestors not yet in `included`, with their total fee and size"""
+        entries = self.mempool.entries
+        entry = entries[tx_hash]
+        if entry.ancestor_count == 1:
+            return {tx_hash}, entry.fee, entry.size
+        package = self.mempool.get_ancestors(tx_hash) - included
+        package.add(tx_hash)
+        fee = sum(entries[h].fee for h in package)
+        size = sum(entries[h].size for h in package)
+        return package, fee, size
+
+    def _rescore(self, tx_hash: str) -> None:
+        entry = self.mempool.entries[tx_hash]
+        score = entry.ancestor_score
+        self.by_ancestor_score.add(tx_hash, score)
+        if (self._template is not None and tx_hash not in self._selected
+                and (score > self._floor or entry.ancestor_size <= self._free)):
+            self._template = None
+
+    def tx_added(self, tx_hash: str) -> None:
+        """Rank a transaction that just entered the mempool"""
+        self._rescore(tx_hash)
+
+    def tx_removed(self, tx_hash: str, descendants: Set[str] = frozenset()) -> None:
+        """
+        Forget a transaction that just left the mempool
+
+        descendants are those that stayed, and now need less to be mined.
+        """
+        self.by_ancestor_score.remove(tx_hash)
+        if tx_hash in self._selected:
+            self._template = None
+        for descendant in descendants:
+            self._rescore(descendant)
+
+    def get_template(self) -> BlockTemplate:
+        """The best block the mempool can currently fill"""
+        if self._template is None:
+            self._template = self._assemble()
+        return self._template
+
+    @staticmethod
+    def _stale(heap_entry: Tuple[float, str], modified: Dict[str, List[int]]) -> bool:
+        fee, size = modified[heap_entry[1]]
+        return -heap_entry[0] != fee / size
+
+    def _assemble(self) -> BlockTemplate:
+        entries = self.mempool.entries
+        selected: Set[str] = set()
+        failed: Set[str] = set()
+        txs: List[Transaction] = []
+        size = 0
+        fees = 0
+        floor = float('inf')
+        # Packages partly in the block: the fee and size they still need
+        modified: Dict[str, List[int]] = {}
+        modified_heap: List[Tuple[float, str]] = []
+        failures = 0
+
+        ranked = reversed(self.by_ancestor_score)
+        head = next(ranked, None)
+        while True:
+            while head is not None and (head[1] in selected or head[1] in modified or head[1] in failed):
+                head = next(ranked, None)
+            while modified_heap and (modified_heap[0][1] in selected
+                                     or modified_heap[0][1] in failed
+                                     or self._stale(modified_heap[0], modified)):
+                heapq.heappop(modified_heap)
+            if head is None and not modified_heap:
+                break
+
+            if modified_heap and (head is None or -modified_heap[0][0] > head[0]):
+                tx_hash = heapq.heappop(modified_heap)[1]
+            else:
+                tx_hash = head[1]
+                head = next(ranked, None)
+
+            package, package_fee, package_size = self._package(tx_hash, selected)
+            if size + package_size > self.max_size:
+                failed.add(tx_hash)
+                failures += 1
+                if (failures > self.MAX_CONSECUTIVE_FAILURES
+                        and size > self.max_size - self.BLOCK_FULL_MARGIN):
+                    break
+                continue
+            failures = 0
+
+            # Parents first: an ancestor always has fewer ancestors itself
+            if len(package) > 1:
+                package = sorted(package, key=lambda h: entries[h].ancestor_count)
+            for h in package:
+                selected.add(h)
+                modified.pop(h, None)
+                txs.append(entries[h].tx)
+            size += package_size
+            fees += package_fee
+            floor = min(floor, package_fee / package_size)
+
+            # Whatever depends on the package now needs that much less
+            for h in package:
+                entry = entries[h]
+                if not entry.children:
+                    continue
+                for descendant in self.mempool.get_descendants(h):
+                    if descendant in selected or descendant in failed:
+                        continue
+                    remaining = modified.get(descendant)
+                    if remaining is None:
+                        d = entries[descendant]
+                        remaining = modified[descendant] = [d.ancestor_fees, d.ancestor_size]
+                    remaining[0] -= entry.fee
+                    remaining[1] -= entry.size
+                    heapq.heappush(modified_heap, (-remaining[0] / remaining[1], descendant))
+
+        self._selected = selected
+        self._floor = floor if txs else 0.0
+        self._free = self.max_size - size
+        merkle_tree = MerkleTree([ZERO_HASH] + [tx.get_txid() for tx in txs])
+        return BlockTemplate(txs, size, fees, merkle_tree)
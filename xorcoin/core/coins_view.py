@@ -0,0 +1,180 @@
+"""
+Layered views of the UTXO set
+"""
+
+from typing import Dict, Iterable, Optional, Set
+
+from xorcoin.economics import XorcoinEconomics
+from .models import Block, OutPoint, UTXO
+from .undo import BlockUndo
+
+
+class CoinsViewCache:
+    """
+    A layer of coin changes on top of a parent view
+
+    The parent is anything with get_utxo(), get_utxos() and
+    batch_update(), such as a ThreadSafeUTXOSet or another
+    CoinsViewCache, so layers stack: the
+    backing chainstate, the shared UTXO set with its cache, and a scratch
+    view per block. Reads fall through to the parent and are cached here;
+    writes stay here until flush() hands them to the parent in one
+    batch_update. discard() just drops the layer, leaving the parent as
+    it was.
+
+    A coin created in this layer and spent again before a flush never
+    reaches the parent at all.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        # None marks a parent coin spent in this layer
+        self._coins: Dict[OutPoint, Optional[UTXO]] = {}
+        self._dirty: Set[OutPoint] = set()
+        self._fresh: Set[OutPoint] = set()  # Created here, unknown to the parent
+        self._absent: Set[OutPoint] = set()  # Known to be missing from the parent
+
+    def get_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """Get a UTXO by its ID"""
+        if utxo_id in self._coins:
+            return self._coins[utxo_id]
+        if utxo_id in self._absent:
+            return None
+        utxo = self.parent.get_utxo(utxo_id)
+        if utxo is not None:
+            self._coins[utxo_id] = utxo
+        else:
+            self._absent.add(utxo_id)
+        return utxo
+
+    def get_utxos(self, utxo_ids: Iterable[OutPoint]) -> Dict[OutPoint, UTXO]:
+        """Look up several coins, asking the parent once for those not cached here"""
+        utxo_ids = list(utxo_ids)
+        missing = [
+            utxo_id for utxo_id in utxo_ids
+            if utxo_id not in self._coins and utxo_id not in self._absent
+        ]
+        if missing:
+            found = self.parent.get_utxos(missing)
+            self._coins.update(found)
+            self._absent.update(utxo_id for utxo_id in missing if utxo_id not in found)
+        return {
+            utxo_id: self._coins[utxo_id] for utxo_id in utxo_ids
+            if self._coins.get(utxo_id) is not None
+        }
+
+    def __contains__(self, utxo_id: OutPoint) -> bool:
+        return self.get_utxo(utxo_id) is not None
+
+    def add_utxo(self, utxo: UTXO) -> Optional[UTXO]:
+        """Add a coin; returns the coin it overwrote, if any"""
+        utxo_id = utxo.outpoint
+        old = self.get_utxo(utxo_id)
+        if utxo_id not in self._coins:
+            self._fresh.add(utxo_id)
+            self._absent.discard(utxo_id)
+        self._coins[utxo_id] = utxo
+        self._dirty.add(utxo_id)
+        return old
+
+    def spend_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """Remove a coin; returns it, or None if it does not exist"""
+        utxo = self.get_utxo(utxo_id)
+        if utxo is None:
+            return None
+        if utxo_id in self._fresh:
+            # The parent never saw it, so there is nothing to tell it
+            del self._coins[utxo_id]
+            self._fresh.discard(utxo_id)
+            self._dirty.discard(utxo_id)
+            self._absent.add(utxo_id)
+        else:
+            self._coins[utxo_id] = None
+            self._dirty.add(utxo_id)
+        return utxo
+
+    def batch_update(self, to_add: list[UTXO], to_remove: list[OutPoint]) -> None:
+        """Remove spent UTXOs, then add new ones"""
+        for utxo_id in to_remove:
+            self.spend_utxo(utxo_id)
+        for utxo in to_add:
+            self.add_utxo(utxo)
+
+    def connect_block(self, block: Block) -> Optional[BlockUndo]:
+        """
+        Validate and apply a block's coin changes to this view
+
+        Every input must spend an existing coin, no output may be
+        negative, and no transaction may create more value than it spends. Only the first transaction may
+        have no inputs: the coinbase, which may claim at most the block
+        reward plus the fees of the others. Returns the undo record, or
+        None if the block is invalid, in which case this view is left
+        partly updated and should be discarded.
+        """
+        # Fetch every coin the block may touch in one round trip
+        txids = [tx.get_txid() for tx in block.transactions]
+        self.get_utxos(
+            [inp.get_utxo_id() for tx in block.transactions for inp in tx.inputs]
+            + [OutPoint(txid, idx) for tx, txid in zip(block.transactions, txids)
+               for idx in range(len(tx.outputs))]
+        )
+
+        undo = BlockUndo()
+        fees = 0
+        coinbase_value = 0
+        for position, (tx, txid) in enumerate(zip(block.transactions, txids)):
+            if any(out.amount < 0 for out in tx.outputs):
+                print(f"Block {block.height}: transaction {tx.get_hash()} has a negative output")
+                return None
+            if not tx.inputs:
+                if position != 0:
+                    print(f"Block {block.height}: transaction {tx.get_hash()} has no inputs but is not the coinbase")
+                    return None
+                coinbase_value = sum(out.amount for out in tx.outputs)
+            spent = []
+            total_in = 0
+            for inp in tx.inputs:
+                utxo = self.spend_utxo(inp.get_utxo_id())
+                if utxo is None:
+                    print(f"Block {block.height}: missing or spent input {inp.get_utxo_id()}")
+                    return None
+                spent.append(utxo)
+                total_in += utxo.amount
+            if tx.inputs:
+                total_out = sum(out.amount for out in tx.outputs)
+                if total_in < total_out:
+                    print(f"Block {block.height}: transaction {tx.get_hash()} spends more than its inputs")
+                    return None
+                fees += total_in - total_out
+
+            for idx, out in enumerate(tx.outputs):
+                overwritten = self.add_utxo(UTXO(OutPoint(txid, idx), out.amount, out.script_pubkey))
+                if overwritten is not None:
+                    spent.append(overwritten)
+            undo.spent.append(spent)
+
+        if coinbase_value > XorcoinEconomics.get_block_reward(block.height) + fees:
+            print(f"Block {block.height}: coinbase claims more than the reward and fees")
+            return None
+        return undo
+
+    def flush(self) -> None:
+        """Write this layer's changes to the parent in one batch and empty it"""
+        to_add = []
+        to_remove = []
+        for utxo_id in self._dirty:
+            utxo = self._coins[utxo_id]
+            if utxo is None:
+                to_remove.append(utxo_id)
+            else:
+                to_add.append(utxo)
+        if to_add or to_remove:
+            self.parent.batch_update(to_add, to_remove)
+        self.discard()
+
+    def discard(self) -> None:
+        """Drop every change made in this layer"""
+        self._coins = {}
+        self._dirty = set()
+        self._fresh = set()
+        self._absent = set()
@@ -1,98 +1,290 @@
 """
 Enhanced mempool with size limits and fee prioritization
 """
-import heapq
-from typing import List, Dict, Optional
-from xorcoin.core.models import Transaction
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Set
+from xorcoin.core.block_template import BlockTemplate, BlockTemplateBuilder
+from xorcoin.core.models import Block, OutPoint, Transaction, UTXO
+from xorcoin.core.priority_index import TxPriorityIndex
+
+
+@dataclass
+class MempoolEntry:
+    """
+    A mempool transaction and its place among unconfirmed chains
+
+    parents and children are the mempool transactions it spends from and
+    that spend from it. The ancestor totals cover the transaction and
+    everything it depends on, the descendant totals it and everything
+    depending on it; both are kept current as the mempool changes.
+    """
+    tx: Transaction
+    fee: int
+    size: int
+    parents: Set[str] = field(default_factory=set)
+    children: Set[str] = field(default_factory=set)
+    ancestor_count: int = 1
+    ancestor_size: int = 0
+    ancestor_fees: int = 0
+    descendant_count: int = 1
+    descendant_size: int = 0
+    descendant_fees: int = 0
+
+    def __post_init__(self):
+        self.ancestor_size = self.descendant_size = self.size
+        self.ancestor_fees = self.descendant_fees = self.fee
+
+    @property
+    def fee_rate(self) -> float:
+        return self.fee / self.size
+
+    @property
+    def ancestor_score(self) -> float:
+        """Fee rate of the transaction together with everything it needs mined first"""
+        return self.ancestor_fees / self.ancestor_size
+
+    @property
+    def descendant_score(self) -> float:
+        """
+        Fee rate the mempool loses by evicting the transaction and its
+        descendants: the better of its own and theirs combined
+        """
+        return max(self.fee_rate, self.descendant_fees / self.descendant_size)
+
 
 class Mempool:
-    def __init__(self, max_size: int = 300_000_000):  # 300MB default
+    # Unconfirmed chain limits, counting the transaction itself
+    MAX_ANCESTORS = 25
+    MAX_ANCESTOR_SIZE = 101_000
+    MAX_DESCENDANTS = 25
+    MAX_DESCENDANT_SIZE = 101_000
+        
+    def __init__(self, max_size: int = 300_000_000, max_block_size: Optional[int] = None):  # 300MB default
         self.transactions: Dict[str, Transaction] = {}
-        self.tx_by_fee: List[tuple] = []  # Min heap of (-fee_per_byte, tx_hash)
+        self.entries: Dict[str, MempoolEntry] = {}
+        self.by_descendant_score = TxPriorityIndex()  # tx_hash by descendant score, lowest first
+        self.spent_outpoints: Dict[OutPoint, str] = {}  # Outpoint -> hash of the tx spending it
         self.current_size = 0
         self.max_size = max_size
         self.min_fee_rate = 0.01  # Satoshis per byte (lowered for demo)
+        self.template_builder = BlockTemplateBuilder(self, max_block_size)
         
     def add_transaction(self, tx: Transaction, fee: int) -> bool:
-        """Add transaction with fee-based prioritization"""
+        """
+        Add transaction with fee-based prioritization
+        
+        It may spend outputs of other mempool transactions, within the
+        chain limits. Costs O(ancestors).
+        """
         tx_hash = tx.get_hash()
-        tx_size = len(str(tx).encode())
+        tx_size = tx.serialized_size
         fee_rate = fee / tx_size
         
         # Check minimum fee
         if fee_rate < self.min_fee_rate:
             return False
-            
+        
+        # Never hold two transactions spending the same coin
+        if tx_hash in self.transactions or self.get_conflicts(tx):
+            return False
+        
+        entry = MempoolEntry(tx, fee, tx_size)
+        entry.parents = {
+            inp.prev_tx_hash for inp in tx.inputs
+            if inp.prev_tx_hash in self.entries
+        }
+        ancestors = self._walk(entry.parents, 'parents')
+        if not self._within_limits(entry, ancestors):
+            return False
+        
         # Check if mempool is full
         if self.current_size + tx_size > self.max_size:
-            # Try to evict lower fee transactions
-            if not self._make_room(tx_size, fee_rate):
+            # Try to evict lower fee transactions, never its own ancestors
+            if not self._make_room(tx_size, fee_rate, ancestors):
                 return False
-                
+        
         # Add transaction
+        for ancestor_hash in ancestors:
+            ancestor = self.entries[ancestor_hash]
+            entry.ancestor_count += 1
+            entry.ancestor_size += ancestor.size
+            entry.ancestor_fees += ancestor.fee
+            ancestor.descendant_count += 1
+            ancestor.descendant_size += tx_size
+            ancestor.descendant_fees += fee
+            self.by_descendant_score.add(ancestor_hash, ancestor.descendant_score)
+        for parent in entry.parents:
+            self.entries[parent].children.add(tx_hash)
+        
         self.transactions[tx_hash] = tx
-        heapq.heappush(self.tx_by_fee, (-fee_rate, tx_hash))
+        self.entries[tx_hash] = entry
+        self.by_descendant_score.add(tx_hash, entry.descendant_score)
         self.current_size += tx_size
+        for inp in tx.inputs:
+            self.spent_outpoints[inp.get_utxo_id()] = tx_hash
+        self.template_builder.tx_added(tx_hash)
         
         return True
         
-    def _make_room(self, needed_size: int, new_fee_rate: float) -> bool:
-        """Evict low-fee transactions to make room"""
-        evicted_size = 0
-        to_evict = []
+    def _within_limits(self, entry: MempoolEntry, ancestors: Set[str]) -> bool:
+        """Check a new transaction against the unconfirmed chain limits"""
+        if len(ancestors) + 1 > self.MAX_ANCESTORS:
+            return False
+        if entry.size + sum(self.entries[h].size for h in ancestors) > self.MAX_ANCESTOR_SIZE:
+            return False
+        for ancestor_hash in ancestors:
+            ancestor = self.entries[ancestor_hash]
+            if (ancestor.descendant_count + 1 > self.MAX_DESCENDANTS
+                    or ancestor.descendant_size + entry.size > self.MAX_DESCENDANT_SIZE):
+                return False
+        return True
         
-        # Find transactions with lower fee rate
-        temp_heap = []
-        while self.tx_by_fee and evicted_size < needed_size:
-            neg_fee_rate, tx_hash = heapq.heappop(self.tx_by_fee)
-            fee_rate = -neg_fee_rate
-            
-            if fee_rate < new_fee_rate:
-                to_evict.append(tx_hash)
-                if tx_hash in self.transactions:
-                    tx = self.transactions[tx_hash]
-                    evicted_size += len(str(tx).encode())
-            else:
-                temp_heap.append((neg_fee_rate, tx_hash))
-                
-        # Restore heap
-        for item in temp_heap:
-            heapq.heappush(self.tx_by_fee, item)
-            
-        # Evict if we can make enough room
-        if evicted_size >= needed_size:
-            for tx_hash in to_evict:
-                if tx_hash in self.transactions:
-                    del self.transactions[tx_hash]
-            return True
-            
-        return False
-        
-    def get_transactions_for_block(self, max_block_size: int) -> List[Transaction]:
-        """Get highest fee transactions for block"""
-        selected = []
-        current_size = 0
-        
-        # Sort by fee rate
-        sorted_txs = sorted(
-            self.tx_by_fee,
-            key=lambda x: x[0]  # Negative fee rate
-        )
-        
-        for neg_fee_rate, tx_hash in sorted_txs:
-            tx = self.transactions.get(tx_hash)
-            if not tx:
-                continue
-                
-            tx_size = len(str(tx).encode())
-            if current_size + tx_size <= max_block_size:
-                selected.append(tx)
-                current_size += tx_size
-            else:
+    def _walk(self, start: Set[str], direction: str) -> Set[str]:
+        """Every transaction reachable from start along 'parents' or 'children'"""
+        found = set(start)
+        stack = list(start)
+        while stack:
+            for tx_hash in getattr(self.entries[stack.pop()], direction):
+                if tx_hash not in found:
+                    found.add(tx_hash)
+                    stack.append(tx_hash)
+        return found
+        
+    def remove_transaction(self, tx_hash: str) -> Optional[Transaction]:
+        """
+        Remove one transaction; returns it, or None if it was not here
+        
+        Meant for transactions that confirmed: its descendants stay, now
+        with one ancestor fewer. Costs O(ancestors + descendants).
+        """
+        entry = self.entries.pop(tx_hash, None)
+        if entry is None:
+            return None
+        tx = self.transactions.pop(tx_hash)
+        self.by_descendant_score.remove(tx_hash)
+        self.current_size -= entry.size
+        for inp in tx.inputs:
+            utxo_id = inp.get_utxo_id()
+            if self.spent_outpoints.get(utxo_id) == tx_hash:
+                del self.spent_outpoints[utxo_id]
+        
+        for ancestor_hash in self._walk(entry.parents, 'parents'):
+            ancestor = self.entries[ancestor_hash]
+            ancestor.descendant_count -= 1
+            ancestor.descendant_size -= entry.size
+            ancestor.descendant_fees -= entry.fee
+            self.by_descendant_score.add(ancestor_hash, ancestor.descendant_score)
+        descendants = self._walk(entry.children, 'children')
+        for descendant_hash in descendants:
+            descendant = self.entries[descendant_hash]
+            descendant.ancestor_count -= 1
+            descendant.ancestor_size -= entry.size
+            descendant.ancestor_fees -= entry.fee
+        for parent in entry.parents:
+            self.entries[parent].children.discard(tx_hash)
+        for child in entry.children:
+            self.entries[child].parents.discard(tx_hash)
+        
+        self.template_builder.tx_removed(tx_hash, descendants)
+        return tx
+        
+    def remove_with_descendants(self, tx_hash: str) -> List[Transaction]:
+        """
+        Remove a transaction and everything depending on it, which could
+        no longer confirm without it
+        
+        Returns the removed transactions.
+        """
+        entry = self.entries.get(tx_hash)
+        if entry is None:
+            return []
+        package = self._walk(entry.children, 'children')
+        package.add(tx_hash)
+        # Children before parents, so each removal has no descendants left to update
+        order = sorted(package, key=lambda h: self.entries[h].ancestor_count, reverse=True)
+        return [self.remove_transaction(h) for h in order]
+        
+    def remove_for_block(self, block: Block) -> List[Transaction]:
+        """
+        Drop a connected block's transactions, and any others spending
+        the same coins, which can no longer confirm
+        
+        Returns the removed transactions.
+        """
+        removed = []
+        for tx in block.transactions:
+            tx_hash = tx.get_hash()
+            for inp in tx.inputs:
+                spender = self.spent_outpoints.get(inp.get_utxo_id())
+                if spender is not None and spender != tx_hash:
+                    removed.extend(self.remove_with_descendants(spender))
+            if tx_hash in self.transactions:
+                removed.append(self.remove_transaction(tx_hash))
+        return removed
+        
+    def get_spender(self, utxo_id: OutPoint) -> Optional[str]:
+        """Hash of the mempool transaction spending an outpoint, if any"""
+        return self.spent_outpoints.get(utxo_id)
+        
+    def get_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """An output of a mempool transaction as a coin, spent or not"""
+        tx = self.transactions.get(utxo_id.txid.hex())
+        if tx is None or utxo_id.index >= len(tx.outputs):
+            return None
+        out = tx.outputs[utxo_id.index]
+        return UTXO(utxo_id, out.amount, out.script_pubkey)
+        
+    def get_ancestors(self, tx_hash: str) -> Set[str]:
+        """Hashes of every unconfirmed transaction tx_hash depends on"""
+        return self._walk(self.entries[tx_hash].parents, 'parents')
+        
+    def get_descendants(self, tx_hash: str) -> Set[str]:
+        """Hashes of every mempool transaction depending on tx_hash"""
+        return self._walk(self.entries[tx_hash].children, 'children')
+        
+    def get_conflicts(self, tx: Transaction) -> List[str]:
+        """Hashes of mempool transactions spending any of tx's inputs"""
+        conflicts = []
+        for inp in tx.inputs:
+            spender = self.spent_outpoints.get(inp.get_utxo_id())
+            if spender is not None and spender not in conflicts:
+                conflicts.append(spender)
+        return conflicts
+        
+    def _make_room(self, needed_size: int, new_fee_rate: float, protected: Set[str] = frozenset()) -> bool:
+        """
+        Evict the lowest descendant score packages to make room
+        
+        A package is a transaction with all its descendants, so no chain
+        is left without its parent. Only packages scoring below
+        new_fee_rate are candidates, those in protected are kept, and
+        nothing is evicted unless enough room can be made.
+        """
+        to_free = self.current_size + needed_size - self.max_size
+        to_evict = []
+        planned = set()
+        freed = 0
+        for score, tx_hash in self.by_descendant_score:
+            if freed >= to_free or score >= new_fee_rate:
                 break
-                
-        return selected
-
+            if tx_hash in planned or tx_hash in protected:
+                continue
+            to_evict.append(tx_hash)
+            for h in self.get_descendants(tx_hash) | {tx_hash}:
+                if h not in planned:
+                    planned.add(h)
+                    freed += self.entries[h].size
+        
+        if freed < to_free:
+            return False
+        for tx_hash in to_evict:
+            self.remove_with_descendants(tx_hash)
+        return True
+        
+    def get_block_template(self) -> BlockTemplate:
+        """Highest fee transactions for the next block, parents first"""
+        return self.template_builder.get_template()
+        
     def __len__(self) -> int:
         """Return number of transactions in mempool"""
         return len(self.transactions)
@@ -0,0 +1,126 @@
+"""
+Incremental Merkle tree over raw 32-byte transaction hashes
+"""
+
+import hashlib
+from typing import Iterable, List, Optional
+
+from .serialization import ZERO_HASH
+
+
+def _hash_pair(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(left + right).digest()
+
+
+class MerkleTree:
+    """
+    Merkle tree with every level cached
+
+    An odd node at the end of a level is paired with itself. Appending or
+    replacing a leaf rehashes only the path from that leaf to the root.
+    """
+
+    def __init__(self, leaves: Iterable[bytes] = ()):
+        self.levels: List[List[bytes]] = [list(leaves)]
+        self._build()
+
+    def _build(self) -> None:
+        """Rebuild all interior levels from the leaves"""
+        del self.levels[1:]
+        nodes = self.levels[0]
+        while len(nodes) > 1:
+            parents = [
+                _hash_pair(nodes[i], nodes[i + 1] if i + 1 < len(nodes) else nodes[i])
+                for i in range(0, len(nodes), 2)
+            ]
+            self.levels.append(parents)
+            nodes = parents
+
+    def _update_path(self, index: int) -> None:
+        """Rehash the ancestors of leaf `index`"""
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            parent = index // 2
+            left = nodes[2 * parent]
+            right = nodes[2 * parent + 1] if 2 * parent + 1 < len(nodes) else left
+
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            parents = self.levels[level + 1]
+            node = _hash_pair(left, right)
+            if parent < len(parents):
+                parents[parent] = node
+            else:
+                parents.append(node)
+
+            index = parent
+            level += 1
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    def append(self, leaf: bytes) -> None:
+        """Add a leaf at the end in O(log n)"""
+        self.levels[0].append(leaf)
+        self._update_path(len(self.levels[0]) - 1)
+
+    def extend(self, leaves: Iterable[bytes]) -> None:
+        """Add several leaves at the end"""
+        for leaf in leaves:
+            self.append(leaf)
+
+    def update(self, index: int, leaf: bytes) -> None:
+        """Replace the leaf at `index` in O(log n)"""
+        self.levels[0][index] = leaf
+        self._update_path(index)
+
+    def truncate(self, size: int) -> None:
+        """Drop every leaf from position `size` onwards"""
+        if size >= len(self):
+            return
+        del self.levels[0][size:]
+        self._build()
+
+    def root(self) -> bytes:
+        """Merkle root, or 32 zero bytes for an empty tree"""
+        if not self.levels[0]:
+            return ZERO_HASH
+        return self.levels[-1][0]
+
+    def get_proof(self, index: int) -> List[bytes]:
+        """
+        Sibling hashes from leaf `index` up to the root
+
+        The position of each sibling follows from the leaf index, so the
+        proof is just the list of 32-byte hashes.
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("Leaf index out of range")
+        proof = []
+        for nodes in self.levels[:-1]:
+            sibling = index ^ 1
+            proof.append(nodes[sibling] if sibling < len(nodes) else nodes[index])
+            index //= 2
+        return proof
+
+    @staticmethod
+    def root_from_proof(leaf: bytes, index: int, proof: List[bytes]) -> Optional[bytes]:
+        """
+        Root of the tree with `leaf` at `index` and the given proof
+
+        None if the index lies beyond what the proof can reach.
+        """
+        node = leaf
+        for sibling in proof:
+            if index & 1:
+                node = _hash_pair(sibling, node)
+            else:
+                node = _hash_pair(node, sibling)
+            index //= 2
+        return node if index == 0 else None
+
+    @staticmethod
+    def verify_proof(leaf: bytes, index: int, proof: List[bytes], root: bytes) -> bool:
+        """Check that `leaf` sits at `index` under `root`"""
+        return MerkleTree.root_from_proof(leaf, index, proof) == root
@@ -0,0 +1,327 @@
+"""
+Nonce search engine for Xorcoin proof-of-work
+"""
+
+import hashlib
+import json
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from .serialization import BLOCK_VERSION_BINARY, encode_header_prefix
+
+MAX_NONCE = 2**32
+
+_U32 = struct.Struct('<I')
+
+
+def difficulty_to_target(difficulty: int) -> bytes:
+    """
+    Convert a difficulty to a 32-byte big-endian target
+
+    Difficulty counts leading zero hex digits of the header hash, so a hash
+    is valid when its digest compares lower than the returned bytes.
+    """
+    if difficulty <= 0:
+        return b'\xff' * 33  # Longer than any digest, so every hash passes
+    if difficulty > 64:
+        return b'\x00' * 32  # More zero digits than a hash has: nothing passes
+    return (1 << (256 - 4 * difficulty)).to_bytes(32, 'big')
+
+
+class HeaderTemplate:
+    """
+    Header bytes surrounding the nonce, serialized once per mining job
+
+    Binary headers end with the nonce, so the template is just the prefix.
+    Legacy JSON headers have the nonce in the middle and carry a suffix.
+    """
+
+    def __init__(self, prefix: bytes, suffix: bytes = b'', binary: bool = True):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.binary = binary
+
+    @staticmethod
+    def from_block(block) -> 'HeaderTemplate':
+        """Build the template for a block's current header fields"""
+        if block.version >= BLOCK_VERSION_BINARY:
+            return HeaderTemplate(encode_header_prefix(block))
+
+        header = {
+            'version': block.version,
+            'height': block.height,
+            'prev_block_hash': block.prev_block_hash,
+            'merkle_root': block.merkle_root,
+            'difficulty': block.difficulty,
+            'nonce': -1
+        }
+        encoded = json.dumps(header, sort_keys=True).encode()
+        marker = b'"nonce": '
+        start = encoded.index(marker) + len(marker)
+        end = encoded.index(b'-1', start) + 2
+        return HeaderTemplate(encoded[:start], encoded[end:], binary=False)
+
+    def encode_nonce(self, nonce: int) -> bytes:
+        if self.binary:
+            return _U32.pack(nonce)
+        return str(nonce).encode()
+
+    def header_hash(self, nonce: int) -> bytes:
+        """Double-SHA256 of the full header for one nonce"""
+        data = self.prefix + self.encode_nonce(nonce) + self.suffix
+        return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def scan_nonces(template: HeaderTemplate, target: bytes,
+                start: int, end: int) -> Optional[int]:
+    """
+    Walk nonces in [start, end) and return the first one below target
+
+    The prefix is absorbed into a SHA-256 midstate once and copied for
+    each nonce, so per-attempt work is one copy and two short hashes.
+    """
+    midstate = hashlib.sha256(template.prefix)
+    copy = midstate.copy
+    sha256 = hashlib.sha256
+
+    if template.binary:
+        pack = _U32.pack
+        for nonce in range(start, end):
+            h = copy()
+            h.update(pack(nonce))
+            if sha256(h.digest()).digest() < target:
+                return nonce
+        return None
+
+    suffix = template.suffix
+    for nonce in range(start, end):
+        h = copy()
+        h.update(str(nonce).encode() + suffix)
+        if sha256(h.digest()).digest() < target:
+            return nonce
+    return None
+
+
+
+@dataclass
+class MiningResult:
+    """Outcome of a ParallelMiner job"""
+    nonce: Optional[int]
+    attempts: int
+    elapsed: float
+    worker_attempts: List[int] = field(default_factory=list)
+    cancelled: bool = False
+    worker_lost: bool = False  # A worker died, so its range went unsearched
+
+    @property
+    def hashrate(self) -> float:
+        """Aggregate hashes per second across all workers"""
+        return self.attempts / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def worker_hashrates(self) -> List[float]:
+        """Hashes per second for each worker"""
+        if self.elapsed <= 0:
+            return [0.0] * len(self.worker_attempts)
+        return [attempts / self.elapsed for attempts in self.worker_attempts]
+
+
+def _mining_worker(worker_id: int, n_workers: int, jobs, results,
+                   current_job, counters) -> None:
+    """
+    Worker process loop
+
+    Worker i scans batches i, i + n, i + 2n, ... of the nonce space and
+    abandons its job as soon as current_job moves on.
+    """
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, prefix, suffix, binary, target, batch_size, max_nonce = job
+        template = HeaderTemplate(prefix, suffix, binary)
+        attempts = 0
+        found = None
+        lo = worker_id * batch_size
+        stride = n_workers * batch_size
+
+        while lo < max_nonce and current_job.value == job_id:
+            hi = min(lo + batch_size, max_nonce)
+            found = scan_nonces(template, target, lo, hi)
+            if found is not None:
+                attempts += found - lo + 1
+                counters[worker_id] = attempts
+                break
+            attempts += hi - lo
+            counters[worker_id] = attempts
+            lo += stride
+
+        results.put((job_id, worker_id, found))
+
+
+class ParallelMiner:
+    """
+    Multi-process nonce search
+
+    Worker processes are started lazily and reused across jobs. A job ends
+    on the first valid nonce, when the nonce space is exhausted or when
+    cancel() is called, e.g. because a new tip arrived.
+    """
+
+    PROGRESS_INTERVAL = 5.0  # Seconds between progress updates
+    STOP_TIMEOUT = 10.0  # Seconds to wait for workers to drop a finished job
+
+    def __init__(self, workers: Optional[int] = None, batch_size: int = 50_000):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self._processes: List[multiprocessing.Process] = []
+        self._job_queues = []
+        self._results = None
+        self._current_job = None
+        self._counters = None
+        self._job_id = 0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        if self._processes:
+            return
+        self._results = multiprocessing.Queue()
+        self._current_job = multiprocessing.Value('L', 0)
+        self._counters = multiprocessing.Array('Q', self.workers, lock=False)
+        for worker_id in range(self.workers):
+            jobs = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=_mining_worker,
+                args=(worker_id, self.workers, jobs, self._results,
+                      self._current_job, self._counters),
+                daemon=True
+            )
+            process.start()
+            self._job_queues.append(jobs)
+            self._processes.append(process)
+
+    def _workers_alive(self) -> bool:
+        return all(process.is_alive() for process in self._processes)
+
+    def _kill(self) -> None:
+        """Terminate every worker; the next job starts a fresh pool"""
+        for process in self._processes:
+            process.terminate()
+            process.join(timeout=1)
+        self._processes = []
+        self._job_queues = []
+
+    def close(self) -> None:
+        """Stop all worker processes"""
+        if not self._processes:
+            return
+        self.cancel()
+        for jobs in self._job_queues:
+            jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._job_queues = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def cancel(self) -> None:
+        """Abort the running job; safe to call from any thread"""
+        self._cancel.set()
+        if self._current_job is not None:
+            self._current_job.value = 0
+
+    def search(self, template: HeaderTemplate, target: bytes,
+               max_nonce: int = MAX_NONCE) -> MiningResult:
+        """Search [0, max_nonce) for a nonce whose header hash is below target"""
+        with self._lock:
+            self._start()
+            self._cancel.clear()
+            self._job_id = self._job_id % 0xffffffff + 1
+            job_id = self._job_id
+            for worker_id in range(self.workers):
+                self._counters[worker_id] = 0
+            self._current_job.value = job_id
+
+            job = (job_id, template.prefix, template.suffix, template.binary,
+                   target, self.batch_size, max_nonce)
+            for jobs in self._job_queues:
+                jobs.put(job)
+
+            start_time = time.time()
+            last_report = start_time
+            finished = 0
+            nonce = None
+            worker_lost = False
+
+            while finished < self.workers and nonce is None:
+                if self._cancel.is_set():
+                    break
+                try:
+                    result_job, _, found = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    if not self._workers_alive():
+                        print("Mining worker exited unexpectedly, restarting workers")
+                        worker_lost = True
+                        break
+                    now = time.time()
+                    if now - last_report >= self.PROGRESS_INTERVAL:
+                        last_report = now
+                        attempts = sum(self._counters)
+                        print(f"Mining... Attempts: {attempts:,}, "
+                              f"Rate: {attempts / (now - start_time):,.0f} H/s "
+                              f"({self.workers} workers)")
+                    continue
+                if result_job != job_id:
+                    continue
+                finished += 1
+                if found is not None:
+                    nonce = found
+
+            # Stop the remaining workers and wait for each to acknowledge,
+            # so no stale work overlaps the next job
+            elapsed = time.time() - start_time
+            self._current_job.value = 0
+            deadline = time.time() + self.STOP_TIMEOUT
+            while finished < self.workers:
+                try:
+                    result_job, _, _ = self._results.get(timeout=0.1)
+                except queue.Empty:
+                    if not self._workers_alive() or time.time() > deadline:
+                        # A dead or stuck worker would never answer
+                        self._kill()
+                        break
+                    continue
+                if result_job == job_id:
+                    finished += 1
+            worker_attempts = list(self._counters)
+            return MiningResult(
+                nonce=nonce,
+                attempts=sum(worker_attempts),
+                elapsed=elapsed,
+                worker_attempts=worker_attempts,
+                cancelled=nonce is None and self._cancel.is_set(),
+                worker_lost=worker_lost
+            )
+
+    def mine_block(self, block) -> MiningResult:
+        """Mine a block whose merkle root and difficulty are already set"""
+        result = self.search(
+            HeaderTemplate.from_block(block),
+            difficulty_to_target(block.difficulty)
+        )
+        if result.nonce is not None:
+            block.nonce = result.nonce
+        return result
@@ -5,78 +5,272 @@ Core data structures for Xorcoin
 import hashlib
 import time
 import json
-from typing import List
+from typing import List, NamedTuple
 from dataclasses import dataclass, field
 
+from . import serialization
+from .merkle import MerkleTree
+from .serialization import TX_VERSION_BINARY, BLOCK_VERSION_BINARY
 
-@dataclass
-class UTXO:
-    """Unspent Transaction Output"""
-    tx_hash: str
-    output_index: int
+
+class OutPoint(NamedTuple):
+    """
+    Reference to one transaction output: raw 32-byte txid and output index
+
+    Used as the key for UTXO lookups, spent-coin tracking and validation.
+    str() gives the familiar "<tx_hash>:<index>" form.
+    """
+    txid: bytes
+    index: int
+
+    def __str__(self) -> str:
+        return f"{self.txid.hex()}:{self.index}"
+
+    @staticmethod
+    def from_hex(tx_hash: str, index: int) -> 'OutPoint':
+        """Build an OutPoint from a hex transaction hash"""
+        return OutPoint(bytes.fromhex(tx_hash), index)
+
+    def to_bytes(self) -> bytes:
+        """Fixed 36-byte encoding: txid followed by little-endian index"""
+        return self.txid + serialization.pack_u32(self.index)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'OutPoint':
+        """Inverse of to_bytes()"""
+        return OutPoint(bytes(data[:32]), int.from_bytes(data[32:36], 'little'))
+
+
+class UTXO(NamedTuple):
+    """
+    Unspent Transaction Output
+
+    Immutable and tuple-backed. The outpoint doubles as the UTXO set key,
+    so the index and the value share one object.
+    """
+    outpoint: OutPoint
     amount: int
     script_pubkey: str  # Hash of public key (address)
 
-    def get_id(self) -> str:
+    @property
+    def txid(self) -> bytes:
+        """Raw hash of the transaction that created this output"""
+        return self.outpoint.txid
+
+    @property
+    def tx_hash(self) -> str:
+        """Hex hash of the transaction that created this output"""
+        return self.outpoint.txid.hex()
+
+    @property
+    def output_index(self) -> int:
+        return self.outpoint.index
+
+    def get_id(self) -> OutPoint:
         """Get unique identifier for this UTXO"""
-        return f"{self.tx_hash}:{self.output_index}"
+        return self.outpoint
 
 
-@dataclass
-class TxInput:
-    """Transaction Input referencing a UTXO"""
-    prev_tx_hash: str
-    prev_output_index: int
+class TxInput(NamedTuple):
+    """
+    Transaction Input referencing a UTXO
+
+    Immutable; use _replace() to attach a signature.
+    """
+    prev_out: OutPoint
     signature: bytes = b''
     pubkey: bytes = b''
 
-    def get_utxo_id(self) -> str:
+    @property
+    def prev_tx_hash(self) -> str:
+        return self.prev_out.txid.hex()
+
+    @property
+    def prev_output_index(self) -> int:
+        return self.prev_out.index
+
+    def get_utxo_id(self) -> OutPoint:
         """Get the UTXO ID this input references"""
-        return f"{self.prev_tx_hash}:{self.prev_output_index}"
+        return self.prev_out
 
 
-@dataclass
-class TxOutput:
-    """Transaction Output creating new UTXO"""
+class TxOutput(NamedTuple):
+    """Transaction Output creating new UTXO (immutable)"""
     amount: int
     script_pubkey: str
 
 
+class _TrackedList(list):
+    """
+    List that invalidates its owner's cached values whenever it is mutated
+
+    Inputs and outputs are immutable, so replacing or reordering list
+    items is the only way a transaction's contents can change.
+    """
+
+    def __init__(self, owner, items=()):
+        super().__init__(items)
+        self._owner = owner
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain lists; the owner re-wraps them on restore
+        return (list, (list(self),))
+
+    def _changed(self):
+        self._owner._contents_changed()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._changed()
+
+    def __iadd__(self, other):
+        result = super().__iadd__(other)
+        self._changed()
+        return result
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._changed()
+        return result
+
+    def append(self, item):
+        super().append(item)
+        self._changed()
+
+    def extend(self, items):
+        super().extend(items)
+        self._changed()
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._changed()
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self._changed()
+        return item
+
+    def remove(self, item):
+        super().remove(item)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
+
+
 @dataclass
 class Transaction:
     """Xorcoin transaction with security features"""
-    version: int = 2
+    version: int = TX_VERSION_BINARY
     chain_id: int = 1  # Replay protection
     inputs: List[TxInput] = field(default_factory=list)
     outputs: List[TxOutput] = field(default_factory=list)
     locktime: int = 0
     timestamp: int = field(default_factory=lambda: int(time.time()))
 
+    _HASHED_FIELDS = frozenset({'version', 'chain_id', 'inputs', 'outputs', 'locktime'})
+    _CACHED = ('_txid', '_hash', '_size')
+
+    def __setattr__(self, name, value):
+        if name in ('inputs', 'outputs'):
+            value = _TrackedList(self, value)
+        object.__setattr__(self, name, value)
+        if name in self._HASHED_FIELDS:
+            self._contents_changed()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self._CACHED}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _contents_changed(self) -> None:
+        """Drop the memoized txid and size after a field or input/output changed"""
+        for key in self._CACHED:
+            self.__dict__.pop(key, None)
+
+    @property
+    def serialized_size(self) -> int:
+        """Exact length of serialize() in bytes, computed once"""
+        size = self.__dict__.get('_size')
+        if size is None:
+            size = len(self.serialize())
+            self.__dict__['_size'] = size
+        return size
+
     def serialize_for_signing(self, input_index: int) -> bytes:
         """Serialize transaction for signing specific input"""
-        data = {
-            'version': self.version,
-            'chain_id': self.chain_id,
-                        'inputs': [
-                {
-                    'prev_tx_hash': inp.prev_tx_hash,
-                    'prev_output_index': inp.prev_output_index
-                } for inp in self.inputs
-            ],
-            'outputs': [
-                {
-                    'amount': out.amount,
-                    'script_pubkey': out.script_pubkey
-                } for out in self.outputs
-            ],
-            'locktime': self.locktime,
-            'signing_input': input_index
-        }
-        return json.dumps(data, sort_keys=True).encode()
+        if self.version >= TX_VERSION_BINARY:
+            return serialization.encode_tx_body(self, signing_input=input_index)
+        return self._legacy_serialize_for_signing(input_index)
+
+    def get_txid(self) -> bytes:
+        """Raw 32-byte transaction hash (excluding signatures)"""
+        txid = self.__dict__.get('_txid')
+        if txid is None:
+            if self.version >= TX_VERSION_BINARY:
+                tx_data = serialization.encode_tx_body(self)
+            else:
+                tx_data = self._legacy_hash_preimage()
+            txid = hashlib.sha256(hashlib.sha256(tx_data).digest()).digest()
+            self.__dict__['_txid'] = txid
+        return txid
 
     def get_hash(self) -> str:
         """Calculate transaction hash (excluding signatures) to prevent malleability"""
-        data = {
+        tx_hash = self.__dict__.get('_hash')
+        if tx_hash is None:
+            tx_hash = self.get_txid().hex()
+            self.__dict__['_hash'] = tx_hash
+        return tx_hash
+
+    def serialize(self) -> bytes:
+        """Serialize the full transaction, signatures included"""
+        return serialization.encode_tx(self)
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'Transaction':
+        """Deserialize a transaction produced by serialize()"""
+        reader = serialization.ByteReader(data)
+        tx = Transaction.read_from(reader)
+        if not reader.at_end():
+            raise serialization.DecodeError("Trailing data after transaction")
+        return tx
+
+    @staticmethod
+    def read_from(reader: serialization.ByteReader) -> 'Transaction':
+        """Read one serialized transaction from a ByteReader"""
+        version, chain_id, inputs, outputs, locktime, timestamp = \
+            serialization.decode_tx_fields(reader)
+        return Transaction(
+            version=version,
+            chain_id=chain_id,
+            inputs=[
+                TxInput(OutPoint(txid, index), signature, pubkey)
+                for txid, index, signature, pubkey in inputs
+            ],
+            outputs=[TxOutput(*out) for out in outputs],
+            locktime=locktime,
+            timestamp=timestamp
+        )
+
+    def _legacy_fields(self) -> dict:
+        """Hashed fields in the legacy JSON layout (tx version < 3)"""
+        return {
             'version': self.version,
             'chain_id': self.chain_id,
             'inputs': [
@@ -93,14 +287,20 @@ class Transaction:
             ],
             'locktime': self.locktime
         }
-        tx_data = json.dumps(data, sort_keys=True).encode()
-        return hashlib.sha256(hashlib.sha256(tx_data).digest()).hexdigest()
+
+    def _legacy_serialize_for_signing(self, input_index: int) -> bytes:
+        data = self._legacy_fields()
+        data['signing_input'] = input_index
+        return json.dumps(data, sort_keys=True).encode()
+
+    def _legacy_hash_preimage(self) -> bytes:
+        return json.dumps(self._legacy_fields(), sort_keys=True).encode()
 
 
 @dataclass
 class Block:
     """Xorcoin blockchain block"""
-    version: int = 1
+    version: int = BLOCK_VERSION_BINARY
     height: int = 0
     timestamp: int = field(default_factory=lambda: int(time.time()))
     prev_block_hash: str = "0" * 64
@@ -109,8 +309,61 @@ class Block:
     nonce: int = 0
     transactions: List[Transaction] = field(default_factory=list)
 
+    _HASHED_FIELDS = frozenset({
+        'version', 'height', 'prev_block_hash', 'merkle_root', 'difficulty', 'nonce'
+    })
+
+    def __setattr__(self, name, value):
+        if name == 'transactions':
+            value = _TrackedList(self, value)
+        object.__setattr__(self, name, value)
+        if name in self._HASHED_FIELDS:
+            self.__dict__.pop('_header_hash', None)
+        elif name == 'transactions':
+            self._contents_changed()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != '_size'}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _contents_changed(self) -> None:
+        """Drop the memoized size after the transaction list changed"""
+        self.__dict__.pop('_size', None)
+
+    @property
+    def serialized_size(self) -> int:
+        """
+        Exact length of serialize() in bytes, computed once
+
+        Summed from the transactions' own cached sizes; transactions are
+        expected not to change once they are in a block.
+        """
+        size = self.__dict__.get('_size')
+        if size is None:
+            size = (
+                serialization.HEADER_SIZE
+                + 8  # timestamp
+                + serialization.varint_size(len(self.transactions))
+                + sum(tx.serialized_size for tx in self.transactions)
+            )
+            self.__dict__['_size'] = size
+        return size
+
     def calculate_merkle_root(self) -> str:
         """Calculate Merkle root of transactions"""
+        if self.version < BLOCK_VERSION_BINARY:
+            return self._legacy_merkle_root()
+        return self.build_merkle_tree().root().hex()
+
+    def build_merkle_tree(self) -> MerkleTree:
+        """Merkle tree over the raw txids, usable for inclusion proofs"""
+        return MerkleTree(tx.get_txid() for tx in self.transactions)
+
+    def _legacy_merkle_root(self) -> str:
+        """Merkle root over hex-string concatenations (block version < 2)"""
         if not self.transactions:
             return "0" * 64
         
@@ -132,13 +385,58 @@ class Block:
 
     def get_header_hash(self) -> str:
         """Calculate block header hash"""
+        header_hash = self.__dict__.get('_header_hash')
+        if header_hash is None:
+            if self.version >= BLOCK_VERSION_BINARY:
+                header_data = serialization.encode_header(self)
+            else:
+                header_data = self._legacy_header_preimage()
+            header_hash = hashlib.sha256(hashlib.sha256(header_data).digest()).hexdigest()
+            self.__dict__['_header_hash'] = header_hash
+        return header_hash
+
+    def serialize(self) -> bytes:
+        """Serialize header, timestamp and all transactions"""
+        parts = [
+            serialization.encode_header(self),
+            serialization.pack_u64(self.timestamp),
+            serialization.encode_varint(len(self.transactions)),
+        ]
+        parts.extend(tx.serialize() for tx in self.transactions)
+        return b''.join(parts)
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'Block':
+        """Deserialize a block produced by serialize()"""
+        reader = serialization.ByteReader(data)
+        version, height, prev_block_hash, merkle_root, difficulty, nonce = \
+            serialization.decode_header_fields(reader)
+        timestamp = reader.read_u64()
+        transactions = [
+            Transaction.read_from(reader)
+            for _ in range(reader.read_varint())
+        ]
+        if not reader.at_end():
+            raise serialization.DecodeError("Trailing data after block")
+        return Block(
+            version=version,
+            height=height,
+            timestamp=timestamp,
+            prev_block_hash=prev_block_hash,
+            merkle_root=merkle_root,
+            difficulty=difficulty,
+            nonce=nonce,
+            transactions=transactions
+        )
+
+    def _legacy_header_preimage(self) -> bytes:
+        """Header in the legacy JSON layout (block version < 2)"""
         header = {
             'version': self.version,
             'height': self.height,
-                        'prev_block_hash': self.prev_block_hash,
+            'prev_block_hash': self.prev_block_hash,
             'merkle_root': self.merkle_root,
             'difficulty': self.difficulty,
             'nonce': self.nonce
         }
-        header_str = json.dumps(header, sort_keys=True)
-        return hashlib.sha256(hashlib.sha256(header_str.encode()).digest()).hexdigest()
+        return json.dumps(header, sort_keys=True).encode()
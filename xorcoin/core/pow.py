@@ -22,20 +22,26 @@ class ProofOfWork:
         return int(hash_hex, 16)
         
     @staticmethod
-    def mine_block_secure(block, max_nonce: int = 2**32) -> Optional[int]:
+    def mine_block_secure(block, max_nonce: int = 2**32, workers: int = 1) -> Optional[int]:
         """
         Mine block with incremental nonce (more efficient than random)
+        
+        With workers > 1 the nonce range is split across that many processes.
         """
-        target = ProofOfWork.calculate_target(block.difficulty)
+        from xorcoin.core.mining import HeaderTemplate, ParallelMiner, scan_nonces
         
-        for nonce in range(max_nonce):
-            block.nonce = nonce
-            hash_result = block.get_header_hash()
+        target = ProofOfWork.calculate_target(block.difficulty).to_bytes(32, 'big')
+        template = HeaderTemplate.from_block(block)
+        
+        if workers > 1:
+            with ParallelMiner(workers) as miner:
+                nonce = miner.search(template, target, max_nonce).nonce
+        else:
+            nonce = scan_nonces(template, target, 0, max_nonce)
             
-            if ProofOfWork.hash_to_int(hash_result) < target:
-                return nonce
-                
-        return None
+        if nonce is not None:
+            block.nonce = nonce
+        return nonce
         
     @staticmethod
     def verify_pow(block) -> bool:
@@ -0,0 +1,109 @@
+"""
+Sorted index of mempool transactions by score
+"""
+
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+Entry = Tuple[Any, str]  # (score, tx hash)
+
+
+class TxPriorityIndex:
+    """
+    Transaction hashes kept sorted by a score, such as fee rate
+
+    Entries live in a list of short sorted runs, indexed by each run's
+    largest entry, so inserting or removing by hash costs a bisection plus
+    a shift within one run, O(log n) in practice. The lowest entry is
+    always at hand for eviction and the whole index can be walked in order
+    for block building. Unlike a heap, a removed transaction leaves
+    nothing behind.
+
+    Ties on score are broken by hash, so the order is deterministic.
+    """
+
+    LOAD = 512  # Target run length; runs split at twice this
+
+    def __init__(self):
+        self._runs: List[List[Entry]] = []
+        self._maxes: List[Entry] = []
+        self._scores: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, tx_hash: str) -> bool:
+        return tx_hash in self._scores
+
+    def score(self, tx_hash: str) -> Optional[Any]:
+        """Current score of a transaction, or None if it is not indexed"""
+        return self._scores.get(tx_hash)
+
+    def add(self, tx_hash: str, score: Any) -> None:
+        """Index a transaction, replacing any score it already had"""
+        if tx_hash in self._scores:
+            self.remove(tx_hash)
+        self._scores[tx_hash] = score
+        entry = (score, tx_hash)
+
+        if not self._runs:
+            self._runs.append([entry])
+            self._maxes.append(entry)
+            return
+
+        i = bisect_left(self._maxes, entry)
+        if i == len(self._maxes):
+            i -= 1
+            self._runs[i].append(entry)
+            self._maxes[i] = entry
+        else:
+            insort(self._runs[i], entry)
+
+        run = self._runs[i]
+        if len(run) > 2 * self.LOAD:
+            self._runs.insert(i + 1, run[self.LOAD:])
+            del run[self.LOAD:]
+            self._maxes.insert(i, run[-1])
+
+    def remove(self, tx_hash: str) -> bool:
+        """Drop a transaction; returns False if it was not indexed"""
+        score = self._scores.pop(tx_hash, None)
+        if score is None:
+            return False
+        entry = (score, tx_hash)
+        i = bisect_left(self._maxes, entry)
+        run = self._runs[i]
+        j = bisect_left(run, entry)
+        del run[j]
+        if not run:
+            del self._runs[i]
+            del self._maxes[i]
+        elif j == len(run):
+            self._maxes[i] = run[-1]
+        return True
+
+    def min(self) -> Optional[Entry]:
+        """Lowest (score, tx hash), or None if empty"""
+        return self._runs[0][0] if self._runs else None
+
+    def pop_min(self) -> Optional[Entry]:
+        """Remove and return the lowest (score, tx hash)"""
+        entry = self.min()
+        if entry is not None:
+            self.remove(entry[1])
+        return entry
+
+    def __iter__(self) -> Iterator[Entry]:
+        """(score, tx hash) from lowest to highest"""
+        for run in self._runs:
+            yield from run
+
+    def __reversed__(self) -> Iterator[Entry]:
+        """(score, tx hash) from highest to lowest"""
+        for run in reversed(self._runs):
+            yield from reversed(run)
+
+    def clear(self) -> None:
+        self._runs = []
+        self._maxes = []
+        self._scores = {}
@@ -0,0 +1,249 @@
+"""
+Binary consensus encoding for Xorcoin
+
+Fixed-layout encoding used for txids, signature hashes, block header hashes
+and wire transfer. Integers are little-endian, hashes are raw 32 bytes and
+variable-length fields are prefixed with a compact-size varint.
+"""
+
+import struct
+from typing import Tuple
+
+# Transactions and blocks at or above these versions are hashed with the
+# binary encoding. Older versions keep the legacy JSON preimage so chains
+# mined before the switch still validate.
+TX_VERSION_BINARY = 3
+BLOCK_VERSION_BINARY = 2
+
+HASH_SIZE = 32
+ZERO_HASH = b'\x00' * HASH_SIZE
+
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_I64 = struct.Struct('<q')
+
+# Header layout: version, height, prev_block_hash, merkle_root, difficulty, nonce
+_HEADER_PREFIX = struct.Struct('<II32s32sI')
+HEADER_SIZE = _HEADER_PREFIX.size + _U32.size
+
+
+class DecodeError(ValueError):
+    """Raised when binary data cannot be decoded"""
+
+
+def encode_varint(n: int) -> bytes:
+    """Encode a non-negative integer as a compact-size varint"""
+    if n < 0xfd:
+        return bytes((n,))
+    if n <= 0xffff:
+        return b'\xfd' + struct.pack('<H', n)
+    if n <= 0xffffffff:
+        return b'\xfe' + _U32.pack(n)
+    return b'\xff' + _U64.pack(n)
+
+
+def varint_size(n: int) -> int:
+    """Number of bytes encode_varint(n) produces"""
+    if n < 0xfd:
+        return 1
+    if n <= 0xffff:
+        return 3
+    if n <= 0xffffffff:
+        return 5
+    return 9
+
+
+def encode_bytes(data: bytes) -> bytes:
+    """Encode a length-prefixed byte string"""
+    return encode_varint(len(data)) + data
+
+
+def encode_str(value: str) -> bytes:
+    """Encode a length-prefixed UTF-8 string"""
+    return encode_bytes(value.encode())
+
+
+def hash_to_bytes(hash_hex: str) -> bytes:
+    """Convert a 64-char hex hash to raw bytes (empty string maps to zeros)"""
+    if not hash_hex:
+        return ZERO_HASH
+    raw = bytes.fromhex(hash_hex)
+    if len(raw) != HASH_SIZE:
+        raise ValueError(f"Expected {HASH_SIZE}-byte hash, got {len(raw)}")
+    return raw
+
+
+def pack_u32(n: int) -> bytes:
+    return _U32.pack(n)
+
+
+def pack_u64(n: int) -> bytes:
+    return _U64.pack(n)
+
+
+def pack_i64(n: int) -> bytes:
+    return _I64.pack(n)
+
+
+class ByteReader:
+    """Sequential reader over a bytes buffer"""
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = memoryview(data)
+        self.offset = offset
+
+    def read(self, n: int) -> bytes:
+        end = self.offset + n
+        if end > len(self.data):
+            raise DecodeError("Unexpected end of data")
+        chunk = self.data[self.offset:end].tobytes()
+        self.offset = end
+        return chunk
+
+    def read_u32(self) -> int:
+        return _U32.unpack(self.read(4))[0]
+
+    def read_u64(self) -> int:
+        return _U64.unpack(self.read(8))[0]
+
+    def read_i64(self) -> int:
+        return _I64.unpack(self.read(8))[0]
+
+    def read_varint(self) -> int:
+        prefix = self.read(1)[0]
+        if prefix < 0xfd:
+            return prefix
+        if prefix == 0xfd:
+            return struct.unpack('<H', self.read(2))[0]
+        if prefix == 0xfe:
+            return self.read_u32()
+        return self.read_u64()
+
+    def read_bytes(self) -> bytes:
+        return self.read(self.read_varint())
+
+    def read_str(self) -> str:
+        return self.read_bytes().decode()
+
+    def read_hash(self) -> str:
+        return self.read(HASH_SIZE).hex()
+
+    def at_end(self) -> bool:
+        return self.offset == len(self.data)
+
+
+def encode_tx_body(tx, signing_input: int = None) -> bytes:
+    """
+    Encode the signature-free part of a transaction
+
+    This is the txid preimage. When signing_input is given the input index
+    is appended, producing the signature hash preimage for that input.
+    """
+    parts = [
+        _U32.pack(tx.version),
+        _U32.pack(tx.chain_id),
+        encode_varint(len(tx.inputs)),
+    ]
+    for inp in tx.inputs:
+        parts.append(inp.prev_out.txid)
+        parts.append(_U32.pack(inp.prev_out.index))
+    parts.append(encode_varint(len(tx.outputs)))
+    for out in tx.outputs:
+        parts.append(_I64.pack(out.amount))
+        parts.append(encode_str(out.script_pubkey))
+    parts.append(_U32.pack(tx.locktime))
+    if signing_input is not None:
+        parts.append(_U32.pack(signing_input))
+    return b''.join(parts)
+
+
+def encode_tx(tx) -> bytes:
+    """Encode a full transaction, including signatures, for storage and relay"""
+    parts = [
+        _U32.pack(tx.version),
+        _U32.pack(tx.chain_id),
+        encode_varint(len(tx.inputs)),
+    ]
+    for inp in tx.inputs:
+        parts.append(inp.prev_out.txid)
+        parts.append(_U32.pack(inp.prev_out.index))
+        parts.append(encode_bytes(inp.signature))
+        parts.append(encode_bytes(inp.pubkey))
+    parts.append(encode_varint(len(tx.outputs)))
+    for out in tx.outputs:
+        parts.append(_I64.pack(out.amount))
+        parts.append(encode_str(out.script_pubkey))
+    parts.append(_U32.pack(tx.locktime))
+    parts.append(_U64.pack(tx.timestamp))
+    return b''.join(parts)
+
+
+def decode_tx_fields(reader: ByteReader) -> Tuple[int, int, list, list, int, int]:
+    """
+    Decode a full transaction into plain field values
+
+    Returns (version, chain_id, inputs, outputs, locktime, timestamp) where
+    inputs are (prev_txid, prev_output_index, signature, pubkey) tuples
+    and outputs are (amount, script_pubkey) tuples.
+    """
+    version = reader.read_u32()
+    chain_id = reader.read_u32()
+    inputs = []
+    for _ in range(reader.read_varint()):
+        prev_txid = reader.read(HASH_SIZE)
+        prev_output_index = reader.read_u32()
+        signature = reader.read_bytes()
+        pubkey = reader.read_bytes()
+        inputs.append((prev_txid, prev_output_index, signature, pubkey))
+    outputs = []
+    for _ in range(reader.read_varint()):
+        amount = reader.read_i64()
+        script_pubkey = reader.read_str()
+        outputs.append((amount, script_pubkey))
+    locktime = reader.read_u32()
+    timestamp = reader.read_u64()
+    return version, chain_id, inputs, outputs, locktime, timestamp
+
+
+def encode_utxo(utxo) -> bytes:
+    """Encode a coin: txid, output index, amount and script"""
+    return b''.join((
+        utxo.outpoint.txid,
+        _U32.pack(utxo.outpoint.index),
+        _I64.pack(utxo.amount),
+        encode_str(utxo.script_pubkey),
+    ))
+
+
+def decode_utxo_fields(reader: ByteReader) -> Tuple[bytes, int, int, str]:
+    """Decode (txid, output_index, amount, script_pubkey)"""
+    txid = reader.read(HASH_SIZE)
+    index = reader.read_u32()
+    amount = reader.read_i64()
+    script_pubkey = reader.read_str()
+    return txid, index, amount, script_pubkey
+
+
+def encode_header_prefix(block) -> bytes:
+    """Encode every header field except the trailing nonce"""
+    return _HEADER_PREFIX.pack(
+        block.version,
+        block.height,
+        hash_to_bytes(block.prev_block_hash),
+        hash_to_bytes(block.merkle_root),
+        block.difficulty,
+    )
+
+
+def encode_header(block) -> bytes:
+    """Encode the 80-byte block header used for proof-of-work"""
+    return encode_header_prefix(block) + _U32.pack(block.nonce)
+
+
+def decode_header_fields(reader: ByteReader) -> Tuple[int, int, str, str, int, int]:
+    """Decode (version, height, prev_block_hash, merkle_root, difficulty, nonce)"""
+    version, height, prev_hash, merkle_root, difficulty = _HEADER_PREFIX.unpack(
+        reader.read(_HEADER_PREFIX.size)
+    )
+    nonce = reader.read_u32()
+    return version, height, prev_hash.hex(), merkle_root.hex(), difficulty, nonce
@@ -0,0 +1,42 @@
+"""
+Block undo records for disconnecting blocks
+"""
+
+from dataclasses import dataclass, field
+from typing import List
+
+from . import serialization
+from .models import OutPoint, UTXO
+
+
+@dataclass
+class BlockUndo:
+    """
+    Coins a block removed from the UTXO set, per transaction
+
+    spent[i] holds the coins transaction i spent, in input order, followed
+    by any coin its outputs overwrote. Together with the block itself this
+    is enough to restore the UTXO set without replaying the chain.
+    """
+    spent: List[List[UTXO]] = field(default_factory=list)
+
+    def serialize(self) -> bytes:
+        parts = [serialization.encode_varint(len(self.spent))]
+        for coins in self.spent:
+            parts.append(serialization.encode_varint(len(coins)))
+            parts.extend(serialization.encode_utxo(utxo) for utxo in coins)
+        return b''.join(parts)
+
+    @staticmethod
+    def deserialize(data: bytes) -> 'BlockUndo':
+        reader = serialization.ByteReader(data)
+        spent = []
+        for _ in range(reader.read_varint()):
+            coins = []
+            for _ in range(reader.read_varint()):
+                txid, index, amount, script_pubkey = serialization.decode_utxo_fields(reader)
+                coins.append(UTXO(OutPoint(txid, index), amount, script_pubkey))
+            spent.append(coins)
+        if not reader.at_end():
+            raise serialization.DecodeError("Trailing bytes after block undo")
+        return BlockUndo(spent=spent)
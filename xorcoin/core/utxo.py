@@ -3,48 +3,55 @@ UTXO Set Management for Xorcoin
 """
 
 from typing import Dict, Optional
-from .models import UTXO
+from .models import OutPoint, UTXO
+from .address_index import AddressIndex
+from .coin_map import CoinMap
 
 
 class UTXOSet:
     """Manages the set of unspent transaction outputs"""
     
     def __init__(self):
-        self.utxos: Dict[str, UTXO] = {}
+        self.utxos = CoinMap()
+        self.index = AddressIndex()
 
     def add_utxo(self, utxo: UTXO) -> None:
         """Add a new UTXO to the set"""
-        self.utxos[utxo.get_id()] = utxo
+        utxo_id = utxo.get_id()
+        old = self.utxos.get(utxo_id)
+        if old is not None:
+            self.index.remove(old)
+        self.index.add(utxo, self.utxos.put(utxo))
 
-    def remove_utxo(self, utxo_id: str) -> None:
+    def remove_utxo(self, utxo_id: OutPoint) -> None:
         """Remove a spent UTXO from the set"""
-        if utxo_id in self.utxos:
-            del self.utxos[utxo_id]
-
-    def get_utxo(self, utxo_id: str) -> Optional[UTXO]:
+        utxo = self.utxos.pop(utxo_id, None)
+        if utxo is not None:
+            self.index.remove(utxo)
+
+    def batch_update(self, to_add: list[UTXO], to_remove: list[OutPoint]) -> None:
+        """Remove spent UTXOs, then add new ones"""
+        for utxo_id in to_remove:
+            self.remove_utxo(utxo_id)
+        for utxo in to_add:
+            self.add_utxo(utxo)
+
+    def get_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
         """Get a UTXO by its ID"""
         return self.utxos.get(utxo_id)
 
     def get_balance(self, address: str) -> int:
         """Get the balance for a given address (pubkey hash)"""
-        return sum(
-            utxo.amount 
-            for utxo in self.utxos.values() 
-            if utxo.script_pubkey == address
-        )
+        return self.index.get_balance(address)
 
-    def get_utxos_for_address(self, address: str) -> Dict[str, UTXO]:
+    def get_utxos_for_address(self, address: str) -> Dict[OutPoint, UTXO]:
         """Get all UTXOs for a given address"""
-        return {
-            utxo_id: utxo
-            for utxo_id, utxo in self.utxos.items()
-            if utxo.script_pubkey == address
-        }
+        return self.index.get_utxos(address)
 
     def __len__(self) -> int:
         """Get the number of UTXOs in the set"""
         return len(self.utxos)
 
-    def __contains__(self, utxo_id: str) -> bool:
+    def __contains__(self, utxo_id: OutPoint) -> bool:
         """Check if a UTXO exists in the set"""
         return utxo_id in self.utxos
@@ -0,0 +1,303 @@
+"""
+Columnar UTXO analytics backed by NumPy
+
+NumPy is an optional dependency: pip install numpy (or xorcoin[analytics]).
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+from .models import Block, OutPoint
+from .undo import BlockUndo
+
+
+class _AppliedBlock(NamedTuple):
+    """What disconnecting a block needs besides its undo record"""
+    prev_hash: str
+    outputs: List[Tuple[bytes, int]]  # (txid, output count) per transaction
+    spent_heights: List[List[int]]  # Creation heights of the coins in undo.spent
+
+
+class UTXOAnalytics:
+    """
+    Read-mostly columnar copy of the UTXO set for aggregate queries
+
+    Each coin occupies one row of parallel columns: amount, interned
+    address id and creation height. Rows are addressed through an
+    OutPoint -> row map and reused once spent, and a running balance is
+    kept per address id, so rich lists and histograms are single
+    vectorized passes instead of Python loops over every coin.
+
+    The view follows a Blockchain: sync() applies the blocks connected
+    since the last call, one vectorized update per block. If the block it
+    last saw has left the active chain, it first disconnects blocks with
+    their undo records until it is back on the active chain. Undo records
+    lack creation heights, so those are kept for the last UNDO_DEPTH
+    blocks; a deeper reorg rebuilds the view from genesis.
+    """
+
+    UNDO_DEPTH = 100  # Blocks that can be disconnected without a rebuild
+
+    def __init__(self, capacity: int = 1024):
+        if np is None:
+            raise ImportError("UTXO analytics requires numpy (pip install numpy)")
+        self.amounts = np.zeros(capacity, dtype=np.int64)
+        self.address_ids = np.zeros(capacity, dtype=np.int32)
+        self.heights = np.zeros(capacity, dtype=np.int32)
+        self.live = np.zeros(capacity, dtype=bool)
+        self.balances = np.zeros(256, dtype=np.int64)  # Indexed by address id
+
+        self._rows: Dict[OutPoint, int] = {}
+        self._free: List[int] = []
+        self._next_row = 0
+        self._address_ids: Dict[str, int] = {}
+        self.addresses: List[str] = []  # Address id -> address
+
+        self.height = -1
+        self.tip_hash: Optional[str] = None
+        self._applied: "OrderedDict[str, _AppliedBlock]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Maintenance
+
+    def _address_id(self, address: str) -> int:
+        address_id = self._address_ids.get(address)
+        if address_id is None:
+            address_id = len(self.addresses)
+            self._address_ids[address] = address_id
+            self.addresses.append(address)
+            if address_id >= len(self.balances):
+                self.balances = np.concatenate([self.balances, np.zeros_like(self.balances)])
+        return address_id
+
+    def _reserve(self, rows: int) -> None:
+        """Grow the columns so `rows` new rows fit past the last used one"""
+        needed = self._next_row + rows
+        capacity = len(self.amounts)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ('amounts', 'address_ids', 'heights', 'live'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def apply_block(self, block: Block, height: int) -> None:
+        """
+        Apply a connected block's coin changes
+
+        Mirrors XorcoinSystem._process_block: inputs are removed, then
+        outputs added, per transaction. Rows freed by the block are only
+        reused by later blocks, so all additions can be written before
+        all removals in two vectorized steps.
+        """
+        with self._lock:
+            removed: List[int] = []
+            added_rows: List[int] = []
+            added_amounts: List[int] = []
+            added_addresses: List[int] = []
+            added_heights: List[int] = []
+            outputs: List[Tuple[bytes, int]] = []
+            spent_heights: List[List[int]] = []
+            new_rows = set()
+
+            def spend(row: int, heights: List[int]) -> None:
+                removed.append(row)
+                # Rows added by this block have no height written yet
+                heights.append(height if row in new_rows else int(self.heights[row]))
+
+            for tx in block.transactions:
+                heights: List[int] = []
+                for inp in tx.inputs:
+                    row = self._rows.pop(inp.prev_out, None)
+                    if row is not None:
+                        spend(row, heights)
+                txid = tx.get_txid()
+                self._reserve(len(tx.outputs))
+                for idx, out in enumerate(tx.outputs):
+                    outpoint = OutPoint(txid, idx)
+                    overwritten = self._rows.get(outpoint)
+                    if overwritten is not None:
+                        spend(overwritten, heights)
+                    row = self._new_row()
+                    new_rows.add(row)
+                    self._rows[outpoint] = row
+                    added_rows.append(row)
+                    added_amounts.append(out.amount)
+                    added_addresses.append(self._address_id(out.script_pubkey))
+                    added_heights.append(height)
+                outputs.append((txid, len(tx.outputs)))
+                spent_heights.append(heights)
+
+            self._write_rows(added_rows, added_amounts, added_addresses, added_heights, removed)
+            block_hash = block.get_header_hash()
+            self._applied[block_hash] = _AppliedBlock(block.prev_block_hash, outputs, spent_heights)
+            while len(self._applied) > self.UNDO_DEPTH:
+                self._applied.popitem(last=False)
+            self.height = height
+            self.tip_hash = block_hash
+
+    def disconnect_block(self, block_hash: str, undo: BlockUndo) -> bool:
+        """
+        Reverse the tip block, given its undo record
+
+        Returns False, leaving the view untouched, if the block is not the
+        tip or is more than UNDO_DEPTH blocks old.
+        """
+        with self._lock:
+            applied = self._applied.get(block_hash)
+            if (block_hash != self.tip_hash or applied is None
+                    or [len(coins) for coins in undo.spent]
+                    != [len(heights) for heights in applied.spent_heights]):
+                return False
+            del self._applied[block_hash]
+
+            removed: List[int] = []
+            added_rows: List[int] = []
+            added_amounts: List[int] = []
+            added_addresses: List[int] = []
+            added_heights: List[int] = []
+            self._reserve(sum(len(coins) for coins in undo.spent))
+            # Transactions in reverse, so coins created and spent within
+            # the block are restored before their creator removes them
+            for (txid, count), coins, heights in reversed(list(
+                    zip(applied.outputs, undo.spent, applied.spent_heights))):
+                for idx in range(count):
+                    row = self._rows.pop(OutPoint(txid, idx), None)
+                    if row is not None:
+                        removed.append(row)
+                for utxo, coin_height in zip(coins, heights):
+                    row = self._new_row()
+                    self._rows[utxo.outpoint] = row
+                    added_rows.append(row)
+                    added_amounts.append(utxo.amount)
+                    added_addresses.append(self._address_id(utxo.script_pubkey))
+                    added_heights.append(coin_height)
+
+            self._write_rows(added_rows, added_amounts, added_addresses, added_heights, removed)
+            self.height -= 1
+            self.tip_hash = applied.prev_hash
+            return True
+
+    def _new_row(self) -> int:
+        """A free row, or the next unused one; _reserve() must make room first"""
+        if self._free:
+            return self._free.pop()
+        row = self._next_row
+        self._next_row += 1
+        return row
+
+    def _write_rows(self, added_rows: List[int], amounts: List[int], address_ids: List[int],
+                    heights: List[int], removed: List[int]) -> None:
+        """
+        Write added coins, then clear removed ones, in two vectorized steps
+
+        Removed rows only become free afterwards, so no row is both
+        reused and cleared in one update.
+        """
+        if added_rows:
+            rows = np.array(added_rows, dtype=np.int64)
+            amounts = np.array(amounts, dtype=np.int64)
+            address_ids = np.array(address_ids, dtype=np.int32)
+            self.amounts[rows] = amounts
+            self.address_ids[rows] = address_ids
+            self.heights[rows] = np.array(heights, dtype=np.int32)
+            self.live[rows] = True
+            np.add.at(self.balances, address_ids, amounts)
+        if removed:
+            rows = np.array(removed, dtype=np.int64)
+            np.subtract.at(self.balances, self.address_ids[rows], self.amounts[rows])
+            self.live[rows] = False
+        self._free.extend(removed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.live[:] = False
+            self.balances[:] = 0
+            self._rows.clear()
+            self._free.clear()
+            self._next_row = 0
+            self._applied.clear()
+            self.height = -1
+            self.tip_hash = None
+
+    def sync(self, blockchain) -> int:
+        """Catch up with the blockchain's active chain; returns blocks applied"""
+        chain = blockchain.chain
+        # Step back off blocks that were reorganized away
+        while self.tip_hash is not None and blockchain.get_block_height(self.tip_hash) != self.height:
+            undo = blockchain.get_undo(self.tip_hash)
+            if undo is None or not self.disconnect_block(self.tip_hash, undo):
+                self.clear()
+        applied = 0
+        for height in range(self.height + 1, len(chain)):
+            self.apply_block(chain[height], height)
+            applied += 1
+        return applied
+
+    # Queries
+
+    def _live_rows(self) -> "np.ndarray":
+        return np.flatnonzero(self.live[:self._next_row])
+
+    def coin_count(self) -> int:
+        return len(self._rows)
+
+    def total_amount(self) -> int:
+        with self._lock:
+            return int(self.balances.sum())
+
+    def balance_of(self, address: str) -> int:
+        address_id = self._address_ids.get(address)
+        return int(self.balances[address_id]) if address_id is not None else 0
+
+    def sums_by_address(self, addresses: Iterable[str]) -> Dict[str, int]:
+        """Balance of each of the given addresses"""
+        with self._lock:
+            return {address: self.balance_of(address) for address in addresses}
+
+    def top_balances(self, n: int = 10) -> List[Tuple[str, int]]:
+        """Rich list: the n largest balances, largest first"""
+        with self._lock:
+            balances = self.balances[:len(self.addresses)]
+            n = min(n, len(balances))
+            if n <= 0:
+                return []
+            top = np.argpartition(balances, -n)[-n:]
+            top = top[np.argsort(balances[top])[::-1]]
+            return [(self.addresses[i], int(balances[i])) for i in top if balances[i] > 0]
+
+    def amount_histogram(self, bins=None) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        Coin counts per amount bucket, as returned by numpy.histogram
+
+        By default buckets are powers of two, which suits amounts spread
+        over many orders of magnitude.
+        """
+        with self._lock:
+            amounts = self.amounts[self._live_rows()]
+        if bins is None:
+            top = int(amounts.max()) if len(amounts) else 1
+            bins = np.concatenate([[0], 2 ** np.arange(top.bit_length() + 1)])
+        return np.histogram(amounts, bins=bins)
+
+    def height_histogram(self, bins=10) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Coin counts by creation height, as returned by numpy.histogram"""
+        with self._lock:
+            heights = self.heights[self._live_rows()]
+        return np.histogram(heights, bins=bins)
+
+    def dust(self, threshold: int) -> Tuple[int, int]:
+        """Number and total value of coins worth less than threshold"""
+        with self._lock:
+            amounts = self.amounts[self._live_rows()]
+        small = amounts[amounts < threshold]
+        return len(small), int(small.sum())
@@ -2,113 +2,515 @@
 Thread-safe UTXO set implementation
 """
 import threading
-from typing import Dict, Optional
-from xorcoin.core.models import UTXO
+import weakref
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, List, MutableMapping, Optional, Set, Tuple
+from xorcoin.core import serialization
+from xorcoin.core.models import Block, OutPoint, UTXO
+from xorcoin.core.address_index import AddressIndex
+from xorcoin.core.coin_map import CoinMap
+from xorcoin.core.coins_view import CoinsViewCache
+from xorcoin.core.undo import BlockUndo
+from xorcoin.crypto.muhash import MuHash3072
+from xorcoin.storage.chainstate import ChainstateDB
 
 class ThreadSafeUTXOSet:
-    """Thread-safe UTXO set management"""
-    
-    def __init__(self):
-        self.utxos: Dict[str, UTXO] = {}
-        self.lock = RWLock()  # Read-write lock for better performance
-        
+    """
+    Thread-safe UTXO set management
+
+    Coins are partitioned by outpoint across `stripes` shards and the
+    address index by address across the same number of stripes, each
+    guarded by its own RWLock. Threads touching different coins or
+    addresses never contend, and batch_update only locks the stripes it
+    touches. Shard locks are always taken before index locks, each group
+    in ascending order, so multi-stripe updates cannot deadlock.
+
+    snapshot() returns an immutable view of the last published version
+    that can normally be read without taking any of these locks;
+    commit_block() publishes a new version once a block has been
+    applied. With a ChainstateDB attached, snapshot reads still take the
+    chainstate's own internal lock for each lookup.
+
+    `commitment` is a MuHash3072 over every coin, updated with each
+    change, so two nodes can compare UTXO sets by a 32-byte digest.
+    """
+
+    DEFAULT_STRIPES = 16
+
+    def __init__(self, db: Optional[ChainstateDB] = None, stripes: int = DEFAULT_STRIPES):
+        # Coins live in compact in-memory maps unless a persistent
+        # chainstate is given; the chainstate has a single cache and its
+        # own address index, so it forms one shard
+        self.db = db
+        if db is not None:
+            self.shards: List[MutableMapping[OutPoint, UTXO]] = [db]
+            self.indexes: List[AddressIndex] = []
+        else:
+            self.shards = [CoinMap() for _ in range(stripes)]
+            self.indexes = [AddressIndex() for _ in range(stripes)]
+        self.shard_locks = [RWLock() for _ in self.shards]
+        self.index_locks = [RWLock() for _ in self.indexes]
+        # Bumped before and after each write to a stripe's address view, so
+        # an odd or changed count tells a lock-free reader it raced a writer
+        self._address_seq = [0] * max(len(self.indexes), 1)
+
+        self.commitment = MuHash3072()
+        self._commitment_lock = threading.Lock()
+        if db is not None:
+            if db.commitment is not None:
+                self.commitment = db.commitment
+            elif len(db):
+                self.commitment = db.compute_commitment()
+
+        # Every snapshot still referenced somewhere; writers record what
+        # they change into them
+        self._snapshots: "weakref.WeakSet[UTXOSnapshot]" = weakref.WeakSet()
+        self._current = UTXOSnapshot(self, 0)
+        self._snapshots.add(self._current)
+
+    def _shard_of(self, utxo_id: OutPoint) -> int:
+        # txids are hashes, so their leading bytes are already uniform
+        return (int.from_bytes(utxo_id.txid[:4], 'little') + utxo_id.index) % len(self.shards)
+
+    def _index_of(self, address: str) -> int:
+        return hash(address) % len(self.indexes)
+
+    @staticmethod
+    def _write_locks(stack: ExitStack, locks: List['RWLock'], stripes: Iterable[int]) -> None:
+        for stripe in sorted(set(stripes)):
+            stack.enter_context(locks[stripe].write())
+
+    def _peek_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """Read of the live coin without the shard lock"""
+        return self.shards[self._shard_of(utxo_id)].get(utxo_id)
+
+    def _peek_balance(self, address: str) -> int:
+        """Read of the live balance of an address without the index lock"""
+        if self.db is not None:
+            return self.db.get_balance(address)
+        return self.indexes[self._index_of(address)].get_balance(address)
+
+    def _peek_address(self, address: str) -> Dict[OutPoint, UTXO]:
+        """Read of the live coins of an address without the index lock"""
+        if self.db is not None:
+            return self.db.get_utxos(address)
+        return self.indexes[self._index_of(address)].get_utxos(address)
+
+    def _address_stripe(self, address: str) -> int:
+        return self._index_of(address) if self.indexes else 0
+
+    def _address_lock(self, address: str) -> 'RWLock':
+        """The lock writers of this address's live view hold"""
+        if self.db is not None:
+            return self.shard_locks[0]
+        return self.index_locks[self._index_of(address)]
+
+    @contextmanager
+    def _address_writes(self, stripes: Iterable[int], snapshots: List['UTXOSnapshot'],
+                        changes: List[Tuple[int, OutPoint, Optional[UTXO], Optional[UTXO]]]):
+        """
+        Bracket an update of the live address view, with those stripes
+        write-locked, and record its balance changes into the snapshots
+        """
+        stripes = sorted(set(stripes))
+        for stripe in stripes:
+            self._address_seq[stripe] += 1
+        for snapshot in snapshots:
+            snapshot._record(changes)
+        try:
+            yield
+        finally:
+            for stripe in stripes:
+                self._address_seq[stripe] += 1
+
+    def _apply(self, changes: List[Tuple[int, OutPoint, Optional[UTXO], Optional[UTXO]]]) -> None:
+        """
+        Apply (shard, outpoint, old, new) changes with their shards locked
+
+        Live snapshots first get the old version of every coin about to
+        change, so their view stays fixed; addresses are then read from
+        the live index and corrected by what the snapshot recorded.
+        """
+        snapshots = list(self._snapshots)
+        for snapshot in snapshots:
+            for _, utxo_id, old, _ in changes:
+                snapshot._coins.setdefault(utxo_id, old)
+
+        if self.db is not None:
+            # The chainstate keeps its own address index, under the shard lock
+            with self._address_writes([0], snapshots, changes):
+                for _, utxo_id, _, new in changes:
+                    if new is None:
+                        self.db.pop(utxo_id, None)
+                    else:
+                        self.db[utxo_id] = new
+        else:
+            # The address index shares each coin's stored objects with its shard
+            stored: Dict[OutPoint, Tuple[bytes, bytes]] = {}
+            for shard, utxo_id, _, new in changes:
+                if new is None:
+                    self.shards[shard].pop(utxo_id, None)
+                else:
+                    stored[utxo_id] = self.shards[shard].put(new)
+            self._update_index(changes, stored, snapshots)
+
+        with self._commitment_lock:
+            self.commitment.update(
+                [serialization.encode_utxo(new) for _, _, _, new in changes if new is not None],
+                [serialization.encode_utxo(old) for _, _, old, _ in changes if old is not None]
+            )
+
+    def _update_index(self, changes: List[Tuple[int, OutPoint, Optional[UTXO], Optional[UTXO]]],
+                      stored: Dict[OutPoint, Tuple[bytes, bytes]],
+                      snapshots: List['UTXOSnapshot']) -> None:
+        """Apply coin changes to the address index, in order, sharing the shards' stored objects"""
+        stripes = [
+            self._index_of(utxo.script_pubkey)
+            for _, _, old, new in changes for utxo in (old, new) if utxo is not None
+        ]
+        with ExitStack() as stack:
+            self._write_locks(stack, self.index_locks, stripes)
+            stack.enter_context(self._address_writes(stripes, snapshots, changes))
+            for _, utxo_id, old, new in changes:
+                if old is not None:
+                    self.indexes[self._index_of(old.script_pubkey)].remove(old)
+                if new is not None:
+                    self.indexes[self._index_of(new.script_pubkey)].add(new, stored.get(utxo_id))
+
     def add_utxo(self, utxo: UTXO) -> None:
         """Add a new UTXO to the set"""
-        with self.lock.write():
-            self.utxos[utxo.get_id()] = utxo
-            
-    def remove_utxo(self, utxo_id: str) -> bool:
+        utxo_id = utxo.get_id()
+        shard = self._shard_of(utxo_id)
+        with self.shard_locks[shard].write():
+            self._apply([(shard, utxo_id, self.shards[shard].get(utxo_id), utxo)])
+
+    def remove_utxo(self, utxo_id: OutPoint) -> bool:
         """Remove a spent UTXO from the set"""
-        with self.lock.write():
-            if utxo_id in self.utxos:
-                del self.utxos[utxo_id]
-                return True
-            return False
-            
-    def get_utxo(self, utxo_id: str) -> Optional[UTXO]:
+        shard = self._shard_of(utxo_id)
+        with self.shard_locks[shard].write():
+            old = self.shards[shard].get(utxo_id)
+            if old is None:
+                return False
+            self._apply([(shard, utxo_id, old, None)])
+            return True
+
+    def get_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
         """Get a UTXO by its ID"""
-        with self.lock.read():
-            return self.utxos.get(utxo_id)
-            
+        shard = self._shard_of(utxo_id)
+        with self.shard_locks[shard].read():
+            return self.shards[shard].get(utxo_id)
+
+    def get_utxos(self, utxo_ids: Iterable[OutPoint]) -> Dict[OutPoint, UTXO]:
+        """Look up several UTXOs, taking each shard's read lock once"""
+        by_shard: Dict[int, List[OutPoint]] = {}
+        for utxo_id in utxo_ids:
+            by_shard.setdefault(self._shard_of(utxo_id), []).append(utxo_id)
+        found = {}
+        for shard, shard_ids in by_shard.items():
+            coins = self.shards[shard]
+            with self.shard_locks[shard].read():
+                for utxo_id in shard_ids:
+                    utxo = coins.get(utxo_id)
+                    if utxo is not None:
+                        found[utxo_id] = utxo
+        return found
+
     def get_balance(self, address: str) -> int:
         """Get the balance for a given address"""
-        with self.lock.read():
-            return sum(
-                utxo.amount 
-                for utxo in self.utxos.values() 
-                if utxo.script_pubkey == address
-            )
-            
-    def get_utxos_for_address(self, address: str) -> Dict[str, UTXO]:
+        if self.db is not None:
+            with self.shard_locks[0].read():
+                return self.db.get_balance(address)
+        stripe = self._index_of(address)
+        with self.index_locks[stripe].read():
+            return self.indexes[stripe].get_balance(address)
+
+    def get_utxos_for_address(self, address: str) -> Dict[OutPoint, UTXO]:
         """Get all UTXOs for a given address"""
-        with self.lock.read():
-            return {
-                utxo_id: utxo
-                for utxo_id, utxo in self.utxos.items()
-                if utxo.script_pubkey == address
-            }
-            
-    def batch_update(self, to_add: list[UTXO], to_remove: list[str]) -> None:
-        """Atomically add and remove multiple UTXOs"""
-        with self.lock.write():
-            # Remove first to free memory
-            for utxo_id in to_remove:
-                self.utxos.pop(utxo_id, None)
-                
-            # Then add new ones
-            for utxo in to_add:
-                self.utxos[utxo.get_id()] = utxo
+        if self.db is not None:
+            with self.shard_locks[0].read():
+                return self.db.get_utxos(address)
+        stripe = self._index_of(address)
+        with self.index_locks[stripe].read():
+            return self.indexes[stripe].get_utxos(address)
+
+    def batch_update(self, to_add: list[UTXO], to_remove: list[OutPoint]) -> None:
+        """Atomically add and remove multiple UTXOs, locking only the shards touched"""
+        removals = [(self._shard_of(utxo_id), utxo_id) for utxo_id in to_remove]
+        additions = [(self._shard_of(utxo.get_id()), utxo) for utxo in to_add]
+
+        with ExitStack() as stack:
+            self._write_locks(
+                stack, self.shard_locks,
+                [shard for shard, _ in removals] + [shard for shard, _ in additions]
+            )
+
+            # Resolve each change against the batch so far: removals first,
+            # then additions
+            pending: Dict[OutPoint, Optional[UTXO]] = {}
+            changes = []
+            for shard, utxo_id in removals:
+                old = pending[utxo_id] if utxo_id in pending else self.shards[shard].get(utxo_id)
+                if old is not None:
+                    changes.append((shard, utxo_id, old, None))
+                    pending[utxo_id] = None
+            for shard, utxo in additions:
+                utxo_id = utxo.get_id()
+                old = pending[utxo_id] if utxo_id in pending else self.shards[shard].get(utxo_id)
+                changes.append((shard, utxo_id, old, utxo))
+                pending[utxo_id] = utxo
+
+            self._apply(changes)
+
+    def apply_block(self, block: Block) -> Optional[BlockUndo]:
+        """
+        Validate and connect a block through a scratch CoinsViewCache
+
+        The block is applied entirely in the scratch layer, where coins
+        created and spent within the block cancel out, and the net diff
+        then reaches the set in a single batch_update. Returns the undo
+        record, or None if the block is invalid, in which case the set is
+        untouched.
+        """
+        view = CoinsViewCache(self)
+        undo = view.connect_block(block)
+        if undo is None:
+            view.discard()
+            return None
+        view.flush()
+        return undo
+
+    def snapshot(self) -> 'UTXOSnapshot':
+        """Immutable view of the last published version; never blocks"""
+        return self._current
+
+    def publish(self) -> 'UTXOSnapshot':
+        """Make the current contents the version new snapshots see"""
+        with ExitStack() as stack:
+            self._write_locks(stack, self.shard_locks, range(len(self.shards)))
+            snapshot = UTXOSnapshot(self, self._current.version + 1)
+            self._snapshots.add(snapshot)
+            self._current = snapshot
+            return snapshot
+
+    def needs_flush(self) -> bool:
+        """True if the next commit_block() will write the chainstate to disk"""
+        return self.db is not None and self.db.needs_flush()
+
+    def commit_block(self, block_hash: str, height: int) -> None:
+        """Publish the set as of a connected block; may flush to disk"""
+        if self.db is not None:
+            with self.shard_locks[0].write():
+                self.db.commit_block(block_hash, height, self.commitment)
+        self.publish()
+
+    def clear(self) -> None:
+        """
+        Remove every coin, e.g. before rebuilding the chainstate
+
+        Live snapshots are given every coin first, as for any removal.
+        """
+        with ExitStack() as stack:
+            self._write_locks(stack, self.shard_locks, range(len(self.shards)))
+            self._write_locks(stack, self.index_locks, range(len(self.indexes)))
+            snapshots = list(self._snapshots)
+            changes = [
+                (shard_no, utxo_id, utxo, None)
+                for shard_no, shard in enumerate(self.shards) for utxo_id, utxo in shard.items()
+            ]
+            for snapshot in snapshots:
+                for _, utxo_id, old, _ in changes:
+                    snapshot._coins.setdefault(utxo_id, old)
+            with self._address_writes(range(len(self._address_seq)), snapshots, changes):
+                for shard in self.shards:
+                    shard.clear()
+                for index in self.indexes:
+                    index.clear()
+            with self._commitment_lock:
+                self.commitment = MuHash3072()
+
+    def close(self) -> None:
+        """Flush and close the persistent chainstate, if any"""
+        if self.db is not None:
+            with self.shard_locks[0].write():
+                self.db.close()
 
     def __len__(self) -> int:
         """Return the number of UTXOs in the set"""
-        with self.lock.read():
-            return len(self.utxos)
+        total = 0
+        for shard, lock in zip(self.shards, self.shard_locks):
+            with lock.read():
+                total += len(shard)
+        return total
 
-    def __contains__(self, utxo_id: str) -> bool:
+    def __contains__(self, utxo_id: OutPoint) -> bool:
         """Check if a UTXO exists in the set"""
-        with self.lock.read():
-            return utxo_id in self.utxos
+        shard = self._shard_of(utxo_id)
+        with self.shard_locks[shard].read():
+            return utxo_id in self.shards[shard]
+
+
+class UTXOSnapshot:
+    """
+    Read-only view of a ThreadSafeUTXOSet at one published version
+
+    Reads go to the live set without taking its RWLocks, though a
+    ChainstateDB behind it locks internally. Before a writer changes a
+    coin it copies the old version into every live snapshot, so a coin
+    read that races with a write re-checks the copies and still answers
+    for this version.
+
+    Addresses are not copied: each snapshot only keeps, per address, the
+    balance change since its version and the outpoints involved, and
+    corrects the live view with them. The writer bumps a per-stripe
+    sequence around each update, and a reader that sees it move retries
+    under the stripe's read lock.
+    """
+
+    def __init__(self, utxo_set: ThreadSafeUTXOSet, version: int):
+        self.version = version
+        self._set = utxo_set
+        self._coins: Dict[OutPoint, Optional[UTXO]] = {}
+        self._balance_delta: Dict[str, int] = {}  # This version's balance minus the live one
+        self._changed: Dict[str, Set[OutPoint]] = {}  # Outpoints that entered or left each address
+        self._commitment = utxo_set.commitment.copy()
+        self._digest: Optional[bytes] = None
+
+    def _record(self, changes: List[Tuple[int, OutPoint, Optional[UTXO], Optional[UTXO]]]) -> None:
+        """Note changes the live address view is about to undergo"""
+        delta = self._balance_delta
+        for _, utxo_id, old, new in changes:
+            if old is not None:
+                delta[old.script_pubkey] = delta.get(old.script_pubkey, 0) + old.amount
+                self._changed.setdefault(old.script_pubkey, set()).add(utxo_id)
+            if new is not None:
+                delta[new.script_pubkey] = delta.get(new.script_pubkey, 0) - new.amount
+                self._changed.setdefault(new.script_pubkey, set()).add(utxo_id)
+
+    def _read(self, address: str, view):
+        """Run view() without the address's read lock, or under it if it raced a writer"""
+        seq = self._set._address_seq
+        stripe = self._set._address_stripe(address)
+        before = seq[stripe]
+        if not before % 2:
+            result = view(address)
+            if seq[stripe] == before:
+                return result
+        with self._set._address_lock(address).read():
+            return view(address)
+
+    def get_utxo(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """Get a UTXO by its ID"""
+        coins = self._coins
+        if utxo_id in coins:
+            return coins[utxo_id]
+        utxo = self._set._peek_utxo(utxo_id)
+        if utxo_id in coins:
+            return coins[utxo_id]
+        return utxo
+
+    def _balance(self, address: str) -> int:
+        return self._set._peek_balance(address) + self._balance_delta.get(address, 0)
+
+    def _utxos(self, address: str) -> Dict[OutPoint, UTXO]:
+        coins = self._set._peek_address(address)
+        for utxo_id in list(self._changed.get(address, ())):
+            old = self._coins[utxo_id]
+            if old is not None and old.script_pubkey == address:
+                coins[utxo_id] = old
+            else:
+                coins.pop(utxo_id, None)
+        return coins
+
+    def get_balance(self, address: str) -> int:
+        """Get the balance for a given address"""
+        return self._read(address, self._balance)
+
+    def get_utxos_for_address(self, address: str) -> Dict[OutPoint, UTXO]:
+        """Get all UTXOs for a given address"""
+        return self._read(address, self._utxos)
+
+    def __contains__(self, utxo_id: OutPoint) -> bool:
+        return self.get_utxo(utxo_id) is not None
+
+    def commitment(self) -> bytes:
+        """MuHash3072 digest of the set at this version"""
+        if self._digest is None:
+            self._digest = self._commitment.digest()
+        return self._digest
 
 
 class RWLock:
-    """Simple read-write lock implementation"""
-    
+    """
+    Fair, writer-preferring read-write lock
+
+    New readers queue behind a waiting writer, so a steady stream of
+    readers cannot starve writers. When a writer releases, the readers
+    already queued are let in before the next writer, so writers cannot
+    starve readers either. Not reentrant.
+    """
+
     def __init__(self):
-        self._read_ready = threading.Condition(threading.RLock())
+        self._cond = threading.Condition(threading.Lock())
         self._readers = 0
-        
+        self._writer = False
+        self._waiting_readers = 0
+        self._waiting_writers = 0
+        self._read_quota = 0  # Readers admitted ahead of the next writer
+
     def read(self):
         """Acquire read lock"""
         return self._ReadLock(self)
-        
+
     def write(self):
         """Acquire write lock"""
         return self._WriteLock(self)
-        
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            self._waiting_readers += 1
+            while self._writer or (self._waiting_writers and not self._read_quota):
+                self._cond.wait()
+            self._waiting_readers -= 1
+            if self._read_quota:
+                self._read_quota -= 1
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers or self._read_quota:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._read_quota = self._waiting_readers
+            self._cond.notify_all()
+
     class _ReadLock:
         def __init__(self, rwlock):
             self.rwlock = rwlock
-            
+
         def __enter__(self):
-            self.rwlock._read_ready.acquire()
-            self.rwlock._readers += 1
-            self.rwlock._read_ready.release()
-            
+            self.rwlock.acquire_read()
+
         def __exit__(self, *args):
-            self.rwlock._read_ready.acquire()
-            self.rwlock._readers -= 1
-            if self.rwlock._readers == 0:
-                self.rwlock._read_ready.notifyAll()
-            self.rwlock._read_ready.release()
-            
+            self.rwlock.release_read()
+
     class _WriteLock:
         def __init__(self, rwlock):
             self.rwlock = rwlock
-            
+
         def __enter__(self):
-            self.rwlock._read_ready.acquire()
-            while self.rwlock._readers > 0:
-                self.rwlock._read_ready.wait()
-                
+            self.rwlock.acquire_write()
+
         def __exit__(self, *args):
-            self.rwlock._read_ready.release()
+            self.rwlock.release_write()
@@ -4,8 +4,10 @@ Xorcoin cryptographic operations
 
 from .keys import KeyManager
 from .signatures import SignatureManager
+from .muhash import MuHash3072
 
 __all__ = [
     "KeyManager",
     "SignatureManager",
+    "MuHash3072",
 ]
@@ -0,0 +1,86 @@
+"""
+MuHash3072 rolling set hash
+"""
+
+import hashlib
+from typing import Iterable
+
+
+class MuHash3072:
+    """
+    Order-independent hash of a multiset of byte strings
+
+    Each element is hashed to a number modulo a 3072-bit prime and the set
+    hash is their product, so adding or removing an element costs one
+    modular multiplication and two sets with the same elements hash alike
+    however they were built. Removals multiply into a separate
+    denominator; the single modular inverse is only paid in digest().
+    """
+
+    # 2^3072 - 1103717 is the largest 3072-bit safe prime
+    _BITS = 3072
+    _C = 1103717
+    PRIME = (1 << _BITS) - _C
+    _MASK = (1 << _BITS) - 1
+    SIZE = _BITS // 8
+
+    def __init__(self, numerator: int = 1, denominator: int = 1):
+        self.numerator = numerator
+        self.denominator = denominator
+
+    @classmethod
+    def _reduce(cls, x: int) -> int:
+        """x mod PRIME for x < PRIME^2, by folding the high bits (2^3072 = C)"""
+        x = (x & cls._MASK) + (x >> cls._BITS) * cls._C
+        x = (x & cls._MASK) + (x >> cls._BITS) * cls._C
+        return x - cls.PRIME if x >= cls.PRIME else x
+
+    @classmethod
+    def element(cls, data: bytes) -> int:
+        """Map a byte string to a group element"""
+        value = int.from_bytes(hashlib.shake_256(data).digest(cls.SIZE), 'little')
+        return value - cls.PRIME if value >= cls.PRIME else value
+
+    def insert(self, data: bytes) -> None:
+        self.numerator = self._reduce(self.numerator * self.element(data))
+
+    def remove(self, data: bytes) -> None:
+        self.denominator = self._reduce(self.denominator * self.element(data))
+
+    def update(self, inserted: Iterable[bytes] = (), removed: Iterable[bytes] = ()) -> None:
+        """Insert and remove several elements"""
+        numerator = self.numerator
+        for data in inserted:
+            numerator = self._reduce(numerator * self.element(data))
+        denominator = self.denominator
+        for data in removed:
+            denominator = self._reduce(denominator * self.element(data))
+        self.numerator, self.denominator = numerator, denominator
+
+    def _value(self) -> int:
+        if self.denominator == 1:
+            return self.numerator
+        return self._reduce(self.numerator * pow(self.denominator, -1, self.PRIME))
+
+    def digest(self) -> bytes:
+        """32-byte hash of the set"""
+        return hashlib.sha256(self._value().to_bytes(self.SIZE, 'little')).digest()
+
+    def hexdigest(self) -> str:
+        return self.digest().hex()
+
+    def copy(self) -> 'MuHash3072':
+        return MuHash3072(self.numerator, self.denominator)
+
+    def to_bytes(self) -> bytes:
+        """Serialized state, so the hash can be resumed later"""
+        return self._value().to_bytes(self.SIZE, 'little')
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'MuHash3072':
+        if len(data) != cls.SIZE:
+            raise ValueError(f"MuHash3072 state must be {cls.SIZE} bytes")
+        return cls(int.from_bytes(data, 'little'))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MuHash3072) and self.digest() == other.digest()
@@ -11,6 +11,8 @@ from ecdsa import SECP256k1
 class SignatureManager:
     """Handles signature creation and verification"""
     
+    MAX_SIGNATURE_SIZE = 72  # DER-encoded secp256k1 signature upper bound
+    
     @staticmethod
     def normalize_signature(signature: bytes) -> bytes:
         """
@@ -350,10 +350,7 @@ class P2PNode:
     # Helper methods
     def _have_block(self, block_hash: str) -> bool:
         """Check if we have a block"""
-        for block in self.system.blockchain.chain:
-            if block.get_header_hash() == block_hash:
-                return True
-        return False
+        return self.system.blockchain.has_block(block_hash)
         
     def _have_transaction(self, tx_hash: str) -> bool:
         """Check if we have a transaction"""
@@ -362,10 +359,7 @@ class P2PNode:
                
     def _get_block(self, block_hash: str) -> Optional[Block]:
         """Get block by hash"""
-        for block in self.system.blockchain.chain:
-            if block.get_header_hash() == block_hash:
-                return block
-        return None
+        return self.system.blockchain.get_block_by_hash(block_hash)
         
     def _get_transaction(self, tx_hash: str) -> Optional[Transaction]:
         """Get transaction by hash"""
@@ -377,20 +371,24 @@ class P2PNode:
         
     def _serialize_block(self, block: Block) -> dict:
         """Serialize block for network transmission"""
-        # TODO: Implement proper serialization
-        return {}
+        return {'data': block.serialize().hex()}
         
     def _deserialize_block(self, data: dict) -> Optional[Block]:
         """Deserialize block from network data"""
-        # TODO: Implement proper deserialization
-        return None
+        try:
+            return Block.deserialize(bytes.fromhex(data['data']))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Invalid block data: {e}")
+            return None
         
     def _serialize_transaction(self, tx: Transaction) -> dict:
         """Serialize transaction for network transmission"""
-        # TODO: Implement proper serialization
-        return {}
+        return {'data': tx.serialize().hex()}
         
     def _deserialize_transaction(self, data: dict) -> Optional[Transaction]:
         """Deserialize transaction from network data"""
-        # TODO: Implement proper deserialization
-        return None
+        try:
+            return Transaction.deserialize(bytes.fromhex(data['data']))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Invalid transaction data: {e}")
+            return None
@@ -3,12 +3,12 @@ Enhanced double-spend protection
 """
 import threading
 from typing import Set, Dict
-from xorcoin.core.models import Transaction
+from xorcoin.core.models import OutPoint, Transaction
 
 class DoubleSpendProtector:
     def __init__(self):
-        self.spent_utxos: Set[str] = set()
-        self.pending_utxos: Dict[str, Transaction] = {}
+        self.spent_utxos: Set[OutPoint] = set()
+        self.pending_utxos: Dict[OutPoint, Transaction] = {}
         self.lock = threading.RLock()
         
     def check_and_lock_utxos(self, tx: Transaction) -> bool:
@@ -0,0 +1,22 @@
+"""
+Xorcoin persistent storage components
+"""
+
+from .block_store import BlockStore, BlockIndexEntry
+from .chainstate import ChainstateDB
+from .reindex import ReindexResult, reindex_chainstate
+from .snapshot import (
+    SnapshotError, SnapshotHeader, export_chainstate, import_chainstate
+)
+
+__all__ = [
+    "BlockStore",
+    "BlockIndexEntry",
+    "ChainstateDB",
+    "ReindexResult",
+    "reindex_chainstate",
+    "SnapshotError",
+    "SnapshotHeader",
+    "export_chainstate",
+    "import_chainstate",
+]
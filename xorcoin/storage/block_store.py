@@ -0,0 +1,298 @@
+"""
+Append-only block storage in segmented flat files
+"""
+
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from xorcoin.core.models import Block
+
+
+class BlockIndexEntry(NamedTuple):
+    """Location of one stored block"""
+    height: int
+    file_no: int
+    offset: int  # Offset of the block bytes, after the record header
+    length: int
+
+
+class _Segment:
+    """The blk or rev file currently being appended to"""
+
+    def __init__(self, file_no: int, handle):
+        self.file_no = file_no
+        self.handle = handle
+        self.offset = handle.tell()
+
+
+class BlockStore:
+    """
+    Persistent block storage
+
+    Blocks are appended to blk00000.dat, blk00001.dat, ... as
+    (magic, length, serialized block) records, and their undo records to
+    rev00000.dat, ... the same way. A separate append-only index.dat maps
+    block hash to (file, offset, length) for both and rebuilds the
+    height -> hash list on open. Writes are fsynced every sync_interval
+    blocks; reads go through read-only mmaps and only a small LRU of
+    decoded blocks is kept in memory.
+
+    The store behaves like a sequence of the active chain, so it can stand
+    in for Blockchain.chain.
+    """
+
+    MAGIC = b'XORB'
+    DEFAULT_FILE_SIZE = 128 * 1024 * 1024
+
+    _RECORD_HEADER = struct.Struct('<4sI')
+    # kind, hash, height, file_no, offset, length
+    _INDEX_RECORD = struct.Struct('<B32sIIQI')
+    _KIND_BLOCK = 0
+    _KIND_TRUNCATE = 1
+    _KIND_UNDO = 2
+
+    def __init__(self, data_dir: str, max_file_size: int = DEFAULT_FILE_SIZE,
+                 sync_interval: int = 100, cache_size: int = 64):
+        self.data_dir = data_dir
+        self.max_file_size = max_file_size
+        self.sync_interval = sync_interval
+        self.cache_size = cache_size
+
+        self.by_hash: Dict[str, BlockIndexEntry] = {}
+        self.undo_by_hash: Dict[str, BlockIndexEntry] = {}
+        self.hashes: List[str] = []  # Active chain, indexed by height
+
+        self._cache: "OrderedDict[str, Block]" = OrderedDict()
+        self._maps: Dict[Tuple[str, int], mmap.mmap] = {}
+        self._unsynced = 0
+        self._lock = threading.RLock()
+
+        os.makedirs(data_dir, exist_ok=True)
+        self._load_index()
+        self._open_for_append()
+
+    # Files
+
+    def _data_path(self, file_no: int, prefix: str = "blk") -> str:
+        return os.path.join(self.data_dir, f"{prefix}{file_no:05d}.dat")
+
+    def _load_index(self) -> None:
+        """Replay index.dat, dropping a torn tail left by a crash"""
+        index_path = os.path.join(self.data_dir, "index.dat")
+        valid_length = 0
+        file_sizes: Dict[Tuple[str, int], int] = {}
+
+        def fits(prefix: str, file_no: int, end: int) -> bool:
+            key = (prefix, file_no)
+            if key not in file_sizes:
+                path = self._data_path(file_no, prefix)
+                file_sizes[key] = os.path.getsize(path) if os.path.exists(path) else 0
+            return end <= file_sizes[key]
+
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                data = f.read()
+            record_size = self._INDEX_RECORD.size
+            for pos in range(0, len(data) - record_size + 1, record_size):
+                kind, raw_hash, height, file_no, offset, length = \
+                    self._INDEX_RECORD.unpack_from(data, pos)
+                if kind == self._KIND_TRUNCATE:
+                    del self.hashes[height:]
+                elif kind == self._KIND_UNDO:
+                    if not fits("rev", file_no, offset + length):
+                        break  # Undo data never reached disk
+                    self.undo_by_hash[raw_hash.hex()] = BlockIndexEntry(height, file_no, offset, length)
+                else:
+                    if not fits("blk", file_no, offset + length) or height != len(self.hashes):
+                        break  # Block data never reached disk
+                    block_hash = raw_hash.hex()
+                    self.by_hash[block_hash] = BlockIndexEntry(height, file_no, offset, length)
+                    self.hashes.append(block_hash)
+                valid_length = pos + record_size
+
+        self._index_file = open(index_path, 'ab')
+        self._index_file.truncate(valid_length)
+
+    def _open_for_append(self) -> None:
+        self._segments: Dict[str, _Segment] = {}
+        for prefix in ("blk", "rev"):
+            file_no = 0
+            while os.path.exists(self._data_path(file_no + 1, prefix)):
+                file_no += 1
+            self._segments[prefix] = _Segment(file_no, open(self._data_path(file_no, prefix), 'ab'))
+
+    def _write_record(self, prefix: str, data: bytes) -> Tuple[int, int]:
+        """Append a record to the current blk or rev file; returns (file_no, offset)"""
+        record = self._RECORD_HEADER.pack(self.MAGIC, len(data)) + data
+        segment = self._segments[prefix]
+        if segment.offset > 0 and segment.offset + len(record) > self.max_file_size:
+            self._sync_files()
+            segment.handle.close()
+            segment = _Segment(segment.file_no + 1, open(self._data_path(segment.file_no + 1, prefix), 'ab'))
+            self._segments[prefix] = segment
+
+        offset = segment.offset + self._RECORD_HEADER.size
+        segment.handle.write(record)
+        segment.offset += len(record)
+        return segment.file_no, offset
+
+    def _sync_files(self) -> None:
+        """fsync block and undo data before the index that points into it"""
+        for segment in self._segments.values():
+            segment.handle.flush()
+            os.fsync(segment.handle.fileno())
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+        self._unsynced = 0
+
+    def _write_index(self, kind: int, block_hash: str, height: int,
+                     file_no: int = 0, offset: int = 0, length: int = 0) -> None:
+        self._index_file.write(self._INDEX_RECORD.pack(
+            kind, bytes.fromhex(block_hash) if block_hash else b'\x00' * 32,
+            height, file_no, offset, length
+        ))
+
+    # Writing
+
+    def append(self, block: Block) -> BlockIndexEntry:
+        """Store a block at the next height of the active chain"""
+        with self._lock:
+            block_hash = block.get_header_hash()
+            data = block.serialize()
+            file_no, offset = self._write_record("blk", data)
+            entry = BlockIndexEntry(len(self.hashes), file_no, offset, len(data))
+
+            self._write_index(self._KIND_BLOCK, block_hash, entry.height,
+                              entry.file_no, entry.offset, entry.length)
+            self.by_hash[block_hash] = entry
+            self.hashes.append(block_hash)
+            self._remember(block_hash, block)
+
+            self._unsynced += 1
+            if self._unsynced >= self.sync_interval:
+                self._sync_files()
+            return entry
+
+    def write_undo(self, block_hash: str, data: bytes) -> None:
+        """Store the undo record of a block, next to the block itself"""
+        with self._lock:
+            height = self.by_hash[block_hash].height
+            file_no, offset = self._write_record("rev", data)
+            entry = BlockIndexEntry(height, file_no, offset, len(data))
+            self._write_index(self._KIND_UNDO, block_hash, height, file_no, offset, len(data))
+            self.undo_by_hash[block_hash] = entry
+
+    def read_undo(self, block_hash: str) -> Optional[bytes]:
+        """Undo record bytes of a block, if one was written"""
+        with self._lock:
+            entry = self.undo_by_hash.get(block_hash)
+            if entry is None:
+                return None
+            return self._read(entry, "rev")
+
+    def truncate(self, height: int) -> None:
+        """
+        Drop blocks at and above height from the active chain
+
+        Their data stays on disk and remains reachable by hash.
+        """
+        with self._lock:
+            if height >= len(self.hashes):
+                return
+            self._write_index(self._KIND_TRUNCATE, '', height)
+            del self.hashes[height:]
+            self._unsynced += 1
+
+    def flush(self) -> None:
+        """Force pending writes to disk"""
+        with self._lock:
+            self._sync_files()
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync_files()
+            for block_map in self._maps.values():
+                block_map.close()
+            self._maps.clear()
+            for segment in self._segments.values():
+                segment.handle.close()
+            self._index_file.close()
+
+    # Reading
+
+    def _remember(self, block_hash: str, block: Block) -> None:
+        self._cache[block_hash] = block
+        self._cache.move_to_end(block_hash)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _map(self, prefix: str, file_no: int, end: int) -> mmap.mmap:
+        """Read-only mmap of a data file covering at least `end` bytes"""
+        key = (prefix, file_no)
+        block_map = self._maps.get(key)
+        if block_map is None or len(block_map) < end:
+            segment = self._segments[prefix]
+            if file_no == segment.file_no:
+                segment.handle.flush()
+            if block_map is not None:
+                block_map.close()
+            with open(self._data_path(file_no, prefix), 'rb') as f:
+                block_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[key] = block_map
+        return block_map
+
+    def _read(self, entry: BlockIndexEntry, prefix: str) -> bytes:
+        block_map = self._map(prefix, entry.file_no, entry.offset + entry.length)
+        return block_map[entry.offset:entry.offset + entry.length]
+
+    def read_raw(self, block_hash: str) -> Optional[bytes]:
+        """Serialized bytes of a stored block"""
+        with self._lock:
+            entry = self.by_hash.get(block_hash)
+            if entry is None:
+                return None
+            return self._read(entry, "blk")
+
+    def get_block(self, block_hash: str) -> Optional[Block]:
+        """Load a block by hash, active chain or not"""
+        with self._lock:
+            block = self._cache.get(block_hash)
+            if block is not None:
+                self._cache.move_to_end(block_hash)
+                return block
+            data = self.read_raw(block_hash)
+            if data is None:
+                return None
+            block = Block.deserialize(data)
+            self._remember(block_hash, block)
+            return block
+
+    def get_entry(self, block_hash: str) -> Optional[BlockIndexEntry]:
+        return self.by_hash.get(block_hash)
+
+    def get_hash(self, height: int) -> str:
+        return self.hashes[height]
+
+    # Sequence interface over the active chain
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self.get_block(h) for h in self.hashes[index]]
+        return self.get_block(self.hashes[index])
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(len(self.hashes)):
+            yield self.get_block(self.hashes[height])
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self.by_hash
+
+    def __bool__(self) -> bool:
+        return bool(self.hashes)
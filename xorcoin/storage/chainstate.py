@@ -0,0 +1,389 @@
+"""
+Disk-backed UTXO database with a write-back cache
+"""
+
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from xorcoin.core import serialization
+from xorcoin.core.models import OutPoint, UTXO
+from xorcoin.crypto.muhash import MuHash3072
+
+
+class ChainstateDB(MutableMapping):
+    """
+    Persistent UTXO set stored in SQLite
+
+    Behaves like the OutPoint -> UTXO dict used by the in-memory sets, so
+    it can be dropped in as ThreadSafeUTXOSet's storage. Reads fill an
+    in-memory cache, evicting the oldest clean entries beyond
+    max_entries; writes only touch the cache and are marked dirty.
+    commit_block() records the new tip and, every flush_interval blocks or
+    once the cache outgrows cache_mb, writes all dirty coins and the tip
+    in one SQLite transaction, so the database always matches some block.
+
+    Per-address balances are stored alongside the coins and served from
+    the balances table plus the unflushed deltas, so address queries never
+    scan the whole set. The MuHash commitment of the set is written with
+    the tip, if the caller supplies one.
+    """
+
+    # Rough cost of one cached coin (UTXO, OutPoint, key and dict slot),
+    # see benchmarks/bench_utxo_memory.py
+    ENTRY_BYTES = 400
+
+    def __init__(self, path: str, cache_mb: float = 64, flush_interval: int = 100):
+        self.path = path
+        self.max_entries = max(1, int(cache_mb * 1024 * 1024 / self.ENTRY_BYTES))
+        self.flush_interval = flush_interval
+
+        # None marks a coin spent since the last flush
+        self._cache: Dict[OutPoint, Optional[UTXO]] = {}
+        self._dirty: Set[OutPoint] = set()
+        self._pending_blocks = 0
+        self._best_block: Tuple[str, int] = ("", -1)
+        self._commitment: Optional[MuHash3072] = None  # At the best block
+        self._lock = threading.RLock()
+
+        # Unflushed balance changes and dirty outpoints, per address
+        self._balance_delta: Dict[str, int] = {}
+        self._touched: Dict[str, Set[OutPoint]] = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS coins ("
+            "outpoint BLOB PRIMARY KEY, amount INTEGER NOT NULL, "
+            "script_pubkey TEXT NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS coins_by_address ON coins (script_pubkey)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)"
+        )
+        has_balances = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balances'"
+        ).fetchone()
+        if not has_balances:
+            self._conn.execute(
+                "CREATE TABLE balances (address TEXT PRIMARY KEY, amount INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT INTO balances SELECT script_pubkey, SUM(amount) FROM coins "
+                "GROUP BY script_pubkey"
+            )
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COUNT(*) FROM coins").fetchone()
+        self._count = row[0]
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        if 'best_block_hash' in meta:
+            self._best_block = (meta['best_block_hash'], meta['best_height'])
+        if meta.get('utxo_commitment') is not None:
+            self._commitment = MuHash3072.from_bytes(meta['utxo_commitment'])
+        self._flushed_block = self._best_block
+
+    # Lookups
+
+    def _load(self, outpoint: OutPoint) -> Optional[UTXO]:
+        """Fetch a coin from the database, bypassing the cache"""
+        row = self._conn.execute(
+            "SELECT amount, script_pubkey FROM coins WHERE outpoint = ?",
+            (outpoint.to_bytes(),)
+        ).fetchone()
+        if row is None:
+            return None
+        return UTXO(outpoint=outpoint, amount=row[0], script_pubkey=row[1])
+
+    def _lookup(self, outpoint: OutPoint) -> Optional[UTXO]:
+        with self._lock:
+            if outpoint in self._cache:
+                return self._cache[outpoint]
+            utxo = self._load(outpoint)
+            if utxo is not None:
+                self._cache[outpoint] = utxo
+                self._evict()
+            return utxo
+
+    def _evict(self) -> None:
+        """Drop the oldest clean entries until the cache fits max_entries"""
+        excess = len(self._cache) - self.max_entries
+        if excess <= 0:
+            return
+        victims = []
+        for outpoint in self._cache:
+            if outpoint not in self._dirty:
+                victims.append(outpoint)
+                if len(victims) == excess:
+                    break
+        for outpoint in victims:
+            del self._cache[outpoint]
+
+    def __getitem__(self, outpoint: OutPoint) -> UTXO:
+        utxo = self._lookup(outpoint)
+        if utxo is None:
+            raise KeyError(outpoint)
+        return utxo
+
+    def get(self, outpoint: OutPoint, default=None):
+        utxo = self._lookup(outpoint)
+        return default if utxo is None else utxo
+
+    def __contains__(self, outpoint) -> bool:
+        return self._lookup(outpoint) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get_balance(self, address: str) -> int:
+        """Balance of an address, including unflushed changes"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT amount FROM balances WHERE address = ?", (address,)
+            ).fetchone()
+            return (row[0] if row else 0) + self._balance_delta.get(address, 0)
+
+    def get_utxos(self, address: str) -> Dict[OutPoint, UTXO]:
+        """Coins held by an address, read through the address index"""
+        with self._lock:
+            touched = self._touched.get(address, set())
+            coins = {}
+            for raw, amount in self._conn.execute(
+                "SELECT outpoint, amount FROM coins WHERE script_pubkey = ?", (address,)
+            ):
+                outpoint = OutPoint.from_bytes(raw)
+                if outpoint not in touched:
+                    coins[outpoint] = UTXO(outpoint, amount, address)
+            for outpoint in touched:
+                utxo = self._cache[outpoint]
+                if utxo is not None and utxo.script_pubkey == address:
+                    coins[outpoint] = utxo
+            return coins
+
+    def _track(self, utxo: UTXO, sign: int) -> None:
+        address = utxo.script_pubkey
+        self._balance_delta[address] = self._balance_delta.get(address, 0) + sign * utxo.amount
+        self._touched.setdefault(address, set()).add(utxo.outpoint)
+
+    # Writes
+
+    def __setitem__(self, outpoint: OutPoint, utxo: UTXO) -> None:
+        with self._lock:
+            old = self._lookup(outpoint)
+            if old is None:
+                self._count += 1
+            else:
+                self._track(old, -1)
+            self._cache[outpoint] = utxo
+            self._dirty.add(outpoint)
+            self._track(utxo, 1)
+
+    def __delitem__(self, outpoint: OutPoint) -> None:
+        with self._lock:
+            old = self._lookup(outpoint)
+            if old is None:
+                raise KeyError(outpoint)
+            self._count -= 1
+            self._cache[outpoint] = None
+            self._dirty.add(outpoint)
+            self._track(old, -1)
+
+    # Iteration merges flushed rows with the cache overlay
+
+    def items(self) -> Iterator[Tuple[OutPoint, UTXO]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT outpoint, amount, script_pubkey FROM coins"
+            ).fetchall()
+            overlay = {op: self._cache[op] for op in self._dirty}
+        for raw, amount, script_pubkey in rows:
+            outpoint = OutPoint.from_bytes(raw)
+            if outpoint not in overlay:
+                yield outpoint, UTXO(outpoint, amount, script_pubkey)
+        for outpoint, utxo in overlay.items():
+            if utxo is not None:
+                yield outpoint, utxo
+
+    def values(self) -> Iterator[UTXO]:
+        for _, utxo in self.items():
+            yield utxo
+
+    def __iter__(self) -> Iterator[OutPoint]:
+        for outpoint, _ in self.items():
+            yield outpoint
+
+    # Persistence
+
+    @property
+    def best_block(self) -> Tuple[str, int]:
+        """(hash, height) of the last block committed, or ("", -1)"""
+        return self._best_block
+
+    @property
+    def flushed_block(self) -> Tuple[str, int]:
+        """(hash, height) the on-disk state corresponds to"""
+        return self._flushed_block
+
+    @property
+    def commitment(self) -> Optional[MuHash3072]:
+        """MuHash3072 of the set at the best block, if recorded"""
+        return self._commitment.copy() if self._commitment is not None else None
+
+    def needs_flush(self) -> bool:
+        """True once the next commit_block() will write to disk"""
+        return (self._pending_blocks + 1 >= self.flush_interval
+                or len(self._cache) > self.max_entries)
+
+    def commit_block(self, block_hash: str, height: int,
+                     commitment: Optional[MuHash3072] = None) -> bool:
+        """
+        Mark the cache as reflecting the given block
+
+        Returns True if this triggered a flush.
+        """
+        with self._lock:
+            self._best_block = (block_hash, height)
+            self._commitment = commitment.copy() if commitment is not None else None
+            self._pending_blocks += 1
+            if self._pending_blocks >= self.flush_interval or len(self._cache) > self.max_entries:
+                self.flush()
+                return True
+            return False
+
+    def flush(self) -> None:
+        """Write dirty coins and the best block in one transaction"""
+        with self._lock:
+            removed = []
+            written = []
+            for outpoint in self._dirty:
+                utxo = self._cache[outpoint]
+                if utxo is None:
+                    removed.append((outpoint.to_bytes(),))
+                else:
+                    written.append((outpoint.to_bytes(), utxo.amount, utxo.script_pubkey))
+
+            block_hash, height = self._best_block
+            with self._conn:
+                self._conn.executemany("DELETE FROM coins WHERE outpoint = ?", removed)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO coins (outpoint, amount, script_pubkey) "
+                    "VALUES (?, ?, ?)", written
+                )
+                self._conn.executemany(
+                    "INSERT INTO balances (address, amount) VALUES (?, ?) "
+                    "ON CONFLICT (address) DO UPDATE SET amount = amount + excluded.amount",
+                    [(address, delta) for address, delta in self._balance_delta.items() if delta]
+                )
+                self._conn.execute("DELETE FROM balances WHERE amount = 0")
+                self._write_meta(block_hash, height, self._commitment)
+
+            self._dirty.clear()
+            self._balance_delta.clear()
+            self._touched.clear()
+            self._pending_blocks = 0
+            self._flushed_block = self._best_block
+            if len(self._cache) > self.max_entries:
+                self._cache.clear()
+            else:
+                # Spent markers are only needed until they reach disk
+                for outpoint in [op for op, utxo in self._cache.items() if utxo is None]:
+                    del self._cache[outpoint]
+
+    def clear(self) -> None:
+        """Delete every coin, e.g. before rebuilding from the block store"""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM coins")
+                self._conn.execute("DELETE FROM balances")
+                self._conn.execute("DELETE FROM meta")
+            self._cache.clear()
+            self._dirty.clear()
+            self._balance_delta.clear()
+            self._touched.clear()
+            self._pending_blocks = 0
+            self._count = 0
+            self._best_block = ("", -1)
+            self._commitment = None
+            self._flushed_block = self._best_block
+
+    def _write_meta(self, block_hash: str, height: int,
+                    commitment: Optional[MuHash3072]) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('best_block_hash', block_hash), ('best_height', height),
+             ('utxo_commitment', commitment.to_bytes() if commitment is not None else None)]
+        )
+
+    def compute_commitment(self) -> MuHash3072:
+        """Hash every coin from scratch, e.g. for a chainstate that predates commitments"""
+        muhash = MuHash3072()
+        muhash.update(serialization.encode_utxo(utxo) for utxo in self.iter_sorted())
+        return muhash
+
+    def iter_sorted(self, batch_size: int = 10_000) -> Iterator[UTXO]:
+        """
+        Stream every coin in outpoint order, flushing the cache first
+
+        Rows are fetched batch_size at a time, so memory stays bounded.
+        The caller must keep writers out until the iterator is exhausted.
+        """
+        self.flush()
+        cursor = self._conn.execute(
+            "SELECT outpoint, amount, script_pubkey FROM coins ORDER BY outpoint"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for raw, amount, script_pubkey in rows:
+                yield UTXO(OutPoint.from_bytes(raw), amount, script_pubkey)
+
+    def load_coins(self, chunks: Iterable[List[UTXO]], block_hash: str, height: int,
+                   expected_commitment: Optional[bytes] = None) -> MuHash3072:
+        """
+        Replace the whole set with streamed coins, as of the given block
+
+        Runs as one transaction: if the chunk iterator raises, e.g. on a
+        corrupt snapshot, or the coins do not hash to expected_commitment
+        (a MuHash digest), the previous contents are kept.
+        """
+        muhash = MuHash3072()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM coins")
+                self._conn.execute("DELETE FROM balances")
+                for chunk in chunks:
+                    muhash.update(serialization.encode_utxo(utxo) for utxo in chunk)
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO coins (outpoint, amount, script_pubkey) "
+                        "VALUES (?, ?, ?)",
+                        [(utxo.outpoint.to_bytes(), utxo.amount, utxo.script_pubkey)
+                         for utxo in chunk]
+                    )
+                self._conn.execute(
+                    "INSERT INTO balances SELECT script_pubkey, SUM(amount) FROM coins "
+                    "GROUP BY script_pubkey"
+                )
+                if expected_commitment is not None and muhash.digest() != expected_commitment:
+                    raise ValueError("UTXO commitment mismatch")
+                self._write_meta(block_hash, height, muhash)
+
+            self._cache.clear()
+            self._dirty.clear()
+            self._balance_delta.clear()
+            self._touched.clear()
+            self._pending_blocks = 0
+            self._count = self._conn.execute("SELECT COUNT(*) FROM coins").fetchone()[0]
+            self._best_block = (block_hash, height)
+            self._commitment = muhash.copy()
+            self._flushed_block = self._best_block
+            return muhash
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._conn.close()
@@ -0,0 +1,116 @@
+"""
+Parallel chainstate reindex from the block store
+"""
+
+import multiprocessing
+import time
+from collections import deque
+from typing import List, NamedTuple, Optional, Tuple
+
+from xorcoin.core.coins_view import CoinsViewCache
+from xorcoin.core.models import Block, OutPoint, UTXO
+from .block_store import BlockStore
+
+PROGRESS_INTERVAL = 5.0  # Seconds between progress lines
+
+# Coins created and outpoints spent by one transaction, in the form
+# batch_update() takes
+TxDiff = Tuple[List[UTXO], List[OutPoint]]
+# A block's hash and the coin changes of each of its transactions
+BlockDiff = Tuple[str, List[TxDiff]]
+
+
+class ReindexResult(NamedTuple):
+    """Outcome of a reindex"""
+    blocks: int
+    seconds: float
+
+    @property
+    def blocks_per_second(self) -> float:
+        return self.blocks / self.seconds if self.seconds > 0 else 0.0
+
+
+def block_diff(block: Block) -> BlockDiff:
+    """
+    Coin changes of each of a block's transactions, in order
+
+    Nothing is netted out here: replayed through a CoinsViewCache, coins
+    created and spent within the block cancel there.
+    """
+    diffs = []
+    for tx in block.transactions:
+        txid = tx.get_txid()
+        created = [
+            UTXO(OutPoint(txid, idx), out.amount, out.script_pubkey)
+            for idx, out in enumerate(tx.outputs)
+        ]
+        diffs.append((created, [inp.get_utxo_id() for inp in tx.inputs]))
+    return block.get_header_hash(), diffs
+
+
+def _decode_batch(raw_blocks: List[bytes]) -> List[BlockDiff]:
+    """Worker: deserialize and hash a run of blocks"""
+    return [block_diff(Block.deserialize(raw)) for raw in raw_blocks]
+
+
+def reindex_chainstate(store: BlockStore, utxo_set, workers: Optional[int] = None,
+                       batch_size: int = 32, start: int = 0) -> ReindexResult:
+    """
+    Rebuild a ThreadSafeUTXOSet from the blocks in a BlockStore
+
+    Blocks are read as raw bytes and handed out in batches to a process
+    pool, which does the deserialization and txid hashing. Their diffs
+    come back and are applied strictly in height order, with a bounded
+    number of batches in flight so memory stays flat however far the
+    pool runs ahead. Each batch is collected in a CoinsViewCache, so coins
+    created and spent within it never reach the set, and committed as
+    one step. The stored blocks were validated when connected, so they
+    are not validated again.
+
+    utxo_set should be empty, or hold the state just below `start`.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    end = len(store)
+    started = time.time()
+    last_report = started
+    applied = 0
+
+    def apply(diffs: List[BlockDiff], height: int) -> int:
+        view = CoinsViewCache(utxo_set)
+        # One locked lookup per shard for every coin the batch touches
+        view.get_utxos(
+            [utxo_id for _, tx_diffs in diffs for _, spent in tx_diffs for utxo_id in spent]
+            + [utxo.outpoint for _, tx_diffs in diffs for created, _ in tx_diffs for utxo in created]
+        )
+        for block_hash, tx_diffs in diffs:
+            if block_hash != store.get_hash(height):
+                raise ValueError(f"Stored block at height {height} does not match its index")
+            for created, spent in tx_diffs:
+                view.batch_update(created, spent)
+            height += 1
+        view.flush()
+        utxo_set.commit_block(block_hash, height - 1)
+        return height
+
+    height = start
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        next_batch = start
+        while height < end:
+            # Keep every worker busy plus one batch queued for each
+            while next_batch < end and len(pending) < 2 * workers:
+                batch_end = min(next_batch + batch_size, end)
+                raw_blocks = [store.read_raw(store.get_hash(h)) for h in range(next_batch, batch_end)]
+                pending.append(pool.apply_async(_decode_batch, (raw_blocks,)))
+                next_batch = batch_end
+
+            height = apply(pending.popleft().get(), height)
+            applied = height - start
+
+            now = time.time()
+            if now - last_report >= PROGRESS_INTERVAL or height == end:
+                print(f"Reindexed {height}/{end} blocks "
+                      f"({applied / (now - started):,.0f} blocks/s)")
+                last_report = now
+
+    return ReindexResult(applied, time.time() - started)
@@ -0,0 +1,235 @@
+"""
+UTXO set snapshots for fast node bootstrap
+
+File layout (integers little-endian):
+
+    header   magic "XUTX", version u32, height u32, block hash (32 bytes),
+             coin count u64, content hash (32 bytes),
+             UTXO commitment (32 bytes)
+    chunks   coin count u32, payload length u32, payload
+
+The payload is a run of encoded coins in outpoint order. The content hash
+is SHA-256 over all payloads in order, so a snapshot can be streamed in
+and checked without holding it in memory. The UTXO commitment is the
+MuHash3072 digest of the coins, the same value nodes report for their
+chainstate, so a snapshot can be checked against a trusted node.
+"""
+
+import hashlib
+import os
+import struct
+import sys
+from typing import Iterable, Iterator, List, NamedTuple
+
+from xorcoin.core import serialization
+from xorcoin.core.models import OutPoint, UTXO
+from .block_store import BlockStore
+from .chainstate import ChainstateDB
+
+SNAPSHOT_MAGIC = b'XUTX'
+SNAPSHOT_VERSION = 2
+DEFAULT_CHUNK_SIZE = 10_000  # Coins per chunk
+
+_HEADER = struct.Struct('<4sII32sQ32s32s')
+_CHUNK = struct.Struct('<II')
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot is malformed or fails verification"""
+
+
+class SnapshotHeader(NamedTuple):
+    """What a snapshot commits to"""
+    height: int
+    block_hash: str
+    coin_count: int
+    content_hash: bytes
+    utxo_commitment: bytes
+
+
+def write_snapshot(path: str, coins: Iterable[UTXO], height: int, block_hash: str,
+                   utxo_commitment: bytes,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> SnapshotHeader:
+    """
+    Stream coins into a snapshot file
+
+    Coins must arrive in outpoint order. The file is written under a
+    temporary name and renamed once complete.
+    """
+    tmp_path = path + '.tmp'
+    content_hash = hashlib.sha256()
+    coin_count = 0
+
+    def write_chunk(f, chunk: List[bytes]) -> None:
+        payload = b''.join(chunk)
+        content_hash.update(payload)
+        f.write(_CHUNK.pack(len(chunk), len(payload)))
+        f.write(payload)
+
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\x00' * _HEADER.size)  # Filled in once the hash is known
+        chunk = []
+        for utxo in coins:
+            chunk.append(serialization.encode_utxo(utxo))
+            if len(chunk) == chunk_size:
+                write_chunk(f, chunk)
+                coin_count += len(chunk)
+                chunk = []
+        if chunk:
+            write_chunk(f, chunk)
+            coin_count += len(chunk)
+
+        header = SnapshotHeader(
+            height, block_hash, coin_count, content_hash.digest(), utxo_commitment
+        )
+        f.seek(0)
+        f.write(_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, height,
+            serialization.hash_to_bytes(block_hash), coin_count, header.content_hash,
+            utxo_commitment
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return header
+
+
+def _read_header(f) -> SnapshotHeader:
+    data = f.read(_HEADER.size)
+    if len(data) != _HEADER.size:
+        raise SnapshotError("Truncated snapshot header")
+    magic, version, height, block_hash, coin_count, content_hash, utxo_commitment = \
+        _HEADER.unpack(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("Not a UTXO snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    return SnapshotHeader(height, block_hash.hex(), coin_count, content_hash, utxo_commitment)
+
+
+def read_snapshot_header(path: str) -> SnapshotHeader:
+    with open(path, 'rb') as f:
+        return _read_header(f)
+
+
+def read_snapshot(path: str) -> Iterator[List[UTXO]]:
+    """
+    Yield the coins of a snapshot one chunk at a time
+
+    The count and content hash are checked after the last chunk, and
+    SnapshotError is raised if they do not match the header. Consumers
+    should therefore treat the data as provisional until iteration ends.
+    """
+    with open(path, 'rb') as f:
+        header = _read_header(f)
+        content_hash = hashlib.sha256()
+        coin_count = 0
+        previous = b''
+
+        while True:
+            prefix = f.read(_CHUNK.size)
+            if not prefix:
+                break
+            if len(prefix) != _CHUNK.size:
+                raise SnapshotError("Truncated chunk header")
+            count, length = _CHUNK.unpack(prefix)
+            payload = f.read(length)
+            if len(payload) != length:
+                raise SnapshotError("Truncated chunk")
+            content_hash.update(payload)
+
+            reader = serialization.ByteReader(payload)
+            chunk = []
+            try:
+                for _ in range(count):
+                    txid, index, amount, script_pubkey = serialization.decode_utxo_fields(reader)
+                    outpoint = OutPoint(txid, index)
+                    key = outpoint.to_bytes()
+                    if key <= previous:
+                        raise SnapshotError("Coins out of order")
+                    previous = key
+                    chunk.append(UTXO(outpoint, amount, script_pubkey))
+            except serialization.DecodeError as e:
+                raise SnapshotError(f"Corrupt chunk: {e}")
+            if not reader.at_end():
+                raise SnapshotError("Trailing bytes in chunk")
+            coin_count += count
+            yield chunk
+
+    if coin_count != header.coin_count:
+        raise SnapshotError(f"Expected {header.coin_count} coins, found {coin_count}")
+    if content_hash.digest() != header.content_hash:
+        raise SnapshotError("Content hash mismatch")
+
+
+def export_chainstate(db: ChainstateDB, path: str,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> SnapshotHeader:
+    """Write the chainstate, as of its best block, to a snapshot file"""
+    block_hash, height = db.best_block
+    if height < 0:
+        raise SnapshotError("Chainstate is empty")
+    commitment = db.commitment
+    if commitment is None:
+        commitment = db.compute_commitment()
+    return write_snapshot(path, db.iter_sorted(), height, block_hash,
+                          commitment.digest(), chunk_size)
+
+
+def import_chainstate(db: ChainstateDB, path: str,
+                      store: BlockStore = None) -> SnapshotHeader:
+    """
+    Replace the chainstate with a verified snapshot
+
+    When a block store is given, the block the snapshot commits to must
+    be on its active chain, so startup can continue from it without
+    replaying earlier blocks. The loaded coins must also hash to the
+    header's UTXO commitment.
+    """
+    header = read_snapshot_header(path)
+    if store is not None:
+        if header.height >= len(store) or store.get_hash(header.height) != header.block_hash:
+            raise SnapshotError(
+                f"Block {header.block_hash[:16]}... at height {header.height} is not in the block store"
+            )
+    try:
+        db.load_coins(read_snapshot(path), header.block_hash, header.height,
+                      header.utxo_commitment)
+    except SnapshotError:
+        raise
+    except ValueError as e:
+        raise SnapshotError(str(e))
+    return header
+
+
+def main():
+    """python -m xorcoin.storage.snapshot export|import <data_dir> <file>"""
+    if len(sys.argv) != 4 or sys.argv[1] not in ('export', 'import'):
+        print("Usage: python -m xorcoin.storage.snapshot export|import <data_dir> <file>")
+        sys.exit(1)
+    command, data_dir, path = sys.argv[1:]
+
+    db = ChainstateDB(os.path.join(data_dir, 'chainstate.sqlite'))
+    try:
+        if command == 'export':
+            header = export_chainstate(db, path)
+            print(f"Exported {header.coin_count:,} coins at height {header.height}")
+        else:
+            store = BlockStore(os.path.join(data_dir, 'blocks'))
+            try:
+                header = import_chainstate(db, path, store)
+            finally:
+                store.close()
+            print(f"Imported {header.coin_count:,} coins at height {header.height}")
+        print(f"Block: {header.block_hash}")
+        print(f"Content hash: {header.content_hash.hex()}")
+        print(f"UTXO commitment: {header.utxo_commitment.hex()}")
+    except SnapshotError as e:
+        print(f"Snapshot {command} failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
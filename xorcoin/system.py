@@ -2,6 +2,8 @@
 Main Xorcoin system implementation
 """
 
+import math
+import os
 from typing import List, Dict, Tuple, Optional
 from cryptography.hazmat.primitives.asymmetric import ec
 import yaml
@@ -9,11 +11,16 @@ import yaml
 from xorcoin.economics import XorcoinEconomics
 # Core imports
 from xorcoin.core import (
-    UTXO, TxInput, TxOutput, Transaction, Block,
-    BlockMiner, Blockchain
+    OutPoint, TxInput, TxOutput, Transaction, Block,
+    BlockMiner, Blockchain, CoinsViewCache
 )
 from xorcoin.core.utxo_threadsafe import ThreadSafeUTXOSet
+from xorcoin.core.utxo_analytics import UTXOAnalytics
 from xorcoin.core.mempool import Mempool
+from xorcoin.core.serialization import TX_VERSION_BINARY
+from xorcoin.storage import (
+    ChainstateDB, ReindexResult, SnapshotHeader, export_chainstate, reindex_chainstate
+)
 
 # Security imports
 from xorcoin.security import DoubleSpendProtector, RateLimiter, BanManager
@@ -25,7 +32,7 @@ from xorcoin.consensus import ConsensusRules, ForkChoice
 from xorcoin.crypto import KeyManager, SignatureManager
 
 # Validation imports
-from xorcoin.validation import TransactionValidator
+from xorcoin.validation import TransactionValidator, get_block_validator
 
 # Network imports
 from xorcoin.network import XorcoinServer
@@ -34,14 +41,25 @@ from xorcoin.network import XorcoinServer
 class XorcoinSystem:
     """Main Xorcoin system coordinating all components"""
     
-    def __init__(self):
-        # Core components
-        self.utxo_set = ThreadSafeUTXOSet()
+    def __init__(self, mining_workers: int = 1, data_dir: Optional[str] = None,
+                 utxo_cache_mb: float = 64, reindex: bool = False):
+        # Core components; blocks and coins are persisted under data_dir if given
+        chainstate = None
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            chainstate = ChainstateDB(
+                os.path.join(data_dir, 'chainstate.sqlite'), cache_mb=utxo_cache_mb
+            )
+        self.utxo_set = ThreadSafeUTXOSet(chainstate)
         self.mempool = Mempool()
         self.confirmed_txs: Dict[str, Transaction] = {}
-        self.blockchain = Blockchain()
+        self.blockchain = Blockchain(
+            mining_workers=mining_workers,
+            data_dir=os.path.join(data_dir, 'blocks') if data_dir else None
+        )
         self.key_manager = KeyManager()
         self.server: Optional[XorcoinServer] = None
+        self.analytics: Optional[UTXOAnalytics] = None  # Built on first use
         
         # Security components
         self.double_spend_protector = DoubleSpendProtector()
@@ -56,14 +74,19 @@ class XorcoinSystem:
             print("Warning: security.yaml not found, using defaults")
             self.security_config = {}
         
-        # Initialize with genesis block
-        self._create_genesis_block()
+        # Initialize with genesis block, or resume a stored chain
+        if self.blockchain.chain and reindex:
+            self.reindex()
+        elif self.blockchain.chain:
+            self._load_chain()
+        else:
+            self._create_genesis_block()
 
     def _create_genesis_block(self) -> None:
         """Create the genesis block with initial coin distribution"""
         # Create genesis transaction (coinbase)
         genesis_tx = Transaction(
-            version=1,
+            version=TX_VERSION_BINARY,
             chain_id=1,
             inputs=[],  # No inputs for coinbase
             outputs=[
@@ -82,31 +105,85 @@ class XorcoinSystem:
         )
         
         # Mine genesis block
-        BlockMiner.mine_block(genesis_block, target_difficulty=4)
-        self.blockchain.chain.append(genesis_block)
+        BlockMiner.mine_block(genesis_block, target_difficulty=4, miner=self.blockchain.miner)
+        self.blockchain.append_block(genesis_block)
         
         # Process genesis block to create initial UTXO
         self._process_block(genesis_block)
         
+    def _load_chain(self) -> None:
+        """Catch the chainstate up with the blocks already on disk"""
+        start = 0
+        db = self.utxo_set.db
+        if db is not None:
+            best_hash, best_height = db.best_block
+            if best_height >= 0 and self.blockchain.get_block_height(best_hash) == best_height:
+                start = best_height + 1
+            else:
+                if best_height >= 0:
+                    print("Chainstate does not match the block store, rebuilding...")
+                self.reindex()
+                return
+                
+        # Blocks the chainstate already covers are not replayed
+        self._index_confirmed_txs(start)
+        print(f"Loading {len(self.blockchain.chain) - start} stored blocks...")
+        for height in range(start, len(self.blockchain.chain)):
+            if not self._process_block(self.blockchain.chain[height]):
+                print(f"Dropping stored blocks from height {height}")
+                self.blockchain.rewind(height)
+                break
+            
+    def close(self) -> None:
+        """Flush storage and release mining workers"""
+        self.blockchain.close()
+        self.utxo_set.close()
+        
+    def reindex(self, workers: Optional[int] = None) -> ReindexResult:
+        """Rebuild the UTXO set from the block store, decoding blocks in parallel"""
+        if self.blockchain.store is None:
+            raise ValueError("Reindexing needs a block store (data_dir)")
+        self.utxo_set.clear()
+        print(f"Reindexing {len(self.blockchain.chain)} stored blocks...")
+        result = reindex_chainstate(self.blockchain.store, self.utxo_set, workers)
+        self.confirmed_txs.clear()
+        self._index_confirmed_txs(len(self.blockchain.chain))
+        return result
+        
+    def _index_confirmed_txs(self, end: int) -> None:
+        """Record the transactions of the stored blocks below height `end` as confirmed"""
+        for block in self.blockchain.chain[:end]:
+            for tx in block.transactions:
+                self.confirmed_txs[tx.get_hash()] = tx
+        
+    def export_utxo_snapshot(self, path: str) -> SnapshotHeader:
+        """Write the UTXO set as of the current tip to a snapshot file"""
+        db = self.utxo_set.db
+        if db is None:
+            raise ValueError("UTXO snapshots need a persistent chainstate (data_dir)")
+        # Keep block processing out while the coins stream to disk
+        with self.utxo_set.shard_locks[0].write():
+            return export_chainstate(db, path)
+            
+    def utxo_analytics(self) -> UTXOAnalytics:
+        """Columnar view of the UTXO set, caught up with the current tip (needs numpy)"""
+        if self.analytics is None:
+            self.analytics = UTXOAnalytics()
+        self.analytics.sync(self.blockchain)
+        return self.analytics
+        
     def generate_wallet(self) -> Tuple[ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey, str]:
         """Generate a new wallet (keypair and address)"""
         return self.key_manager.generate_keypair()
         
     def get_balance(self, address: str) -> int:
         """Get balance for an address"""
-        return self.utxo_set.get_balance(address)
+        return self.utxo_set.snapshot().get_balance(address)
         
     def calculate_min_fee(self, tx: Transaction) -> int:
         """Calculate minimum fee for a transaction based on size"""
-        tx_size = len(str(tx).encode())
         min_fee_rate = self.mempool.min_fee_rate
-        return tx_size * min_fee_rate
-
-    def calculate_min_fee(self, tx: Transaction) -> int:
-        """Calculate minimum fee for a transaction based on size"""
-        tx_size = len(str(tx).encode())
-        min_fee_rate = self.mempool.min_fee_rate
-        return tx_size * min_fee_rate
+        return math.ceil(tx.serialized_size * min_fee_rate)
 
     def create_transaction(
         self,
@@ -128,7 +205,7 @@ class XorcoinSystem:
             Transaction object if successful, None otherwise
         """
         # Get UTXOs for sender
-        sender_utxos = self.utxo_set.get_utxos_for_address(from_address)
+        sender_utxos = self.utxo_set.snapshot().get_utxos_for_address(from_address)
         
         if not sender_utxos:
             print("No UTXOs found for sender")
@@ -149,21 +226,33 @@ class XorcoinSystem:
             return None
             
         # Create transaction
-        tx = Transaction(version=2, chain_id=1)
+        tx = Transaction(version=TX_VERSION_BINARY, chain_id=1)
         
         # Add inputs
         for utxo_id, utxo in selected_utxos:
-            tx_input = TxInput(
-                prev_tx_hash=utxo.tx_hash,
-                prev_output_index=utxo.output_index
-            )
+            tx_input = TxInput(prev_out=utxo.outpoint)
             tx.inputs.append(tx_input)
             
         # Add outputs
         tx.outputs.append(TxOutput(amount=amount, script_pubkey=to_address))
         
-        # Calculate minimum fee
-        min_fee = len(str(tx).encode()) * self.mempool.min_fee_rate
+        public_key = private_key.public_key()
+        pub_key_bytes = self.key_manager.serialize_public_key(public_key)
+        
+        # Calculate minimum fee on the size the signed transaction will have,
+        # change output included
+        draft = Transaction(
+            version=tx.version,
+            chain_id=tx.chain_id,
+            inputs=[
+                tx_input._replace(
+                    signature=b'\x00' * SignatureManager.MAX_SIGNATURE_SIZE,
+                    pubkey=pub_key_bytes
+                ) for tx_input in tx.inputs
+            ],
+            outputs=tx.outputs + [TxOutput(amount=0, script_pubkey=from_address)]
+        )
+        min_fee = self.calculate_min_fee(draft)
         
         # Add change output if necessary (minus fee)
         change = total_input - amount - min_fee
@@ -174,45 +263,42 @@ class XorcoinSystem:
             return None
             
         # Sign inputs
-        public_key = private_key.public_key()
-        pub_key_bytes = self.key_manager.serialize_public_key(public_key)
-        
         for i, tx_input in enumerate(tx.inputs):
             message = tx.serialize_for_signing(i)
             signature = SignatureManager.sign_message(private_key, message)
-            tx_input.signature = signature
-            tx_input.pubkey = pub_key_bytes
+            tx.inputs[i] = tx_input._replace(signature=signature, pubkey=pub_key_bytes)
             
         return tx
         
     def add_transaction(self, tx: Transaction) -> bool:
         """Validate and add transaction to mempool with security checks"""
-        # First check double-spend protection
+        # First check double-spend protection: no other admission of these coins in flight
         if not self.double_spend_protector.check_and_lock_utxos(tx):
             print("Transaction rejected: double-spend attempt")
             return False
             
-        # Validate transaction
-        validator = TransactionValidator(self.utxo_set, list(self.mempool.transactions.values()))
-        
-        if validator.validate_transaction(tx):
+        try:
+            # Validate against a published snapshot, so block processing never blocks it
+            validator = TransactionValidator(self.utxo_set.snapshot(), self.mempool)
+            
+            if not validator.validate_transaction(tx):
+                print("Transaction validation failed")
+                return False
+                
             # Calculate fee
             fee = validator.calculate_transaction_fee(tx)
             
             # Try to add to enhanced mempool
-            if self.mempool.add_transaction(tx, fee):
-                print(f"Transaction {tx.get_hash()} added to mempool")
-                return True
-            else:
-                print("Transaction rejected: mempool full or fee too low")
-                # Rollback UTXO locks
-                self.double_spend_protector.rollback_transaction(tx)
+            if not self.mempool.add_transaction(tx, fee):
+                print("Transaction rejected: mempool full, fee too low or unconfirmed chain too long")
                 return False
-        else:
-            print("Transaction validation failed")
-            # Rollback UTXO locks
+            print(f"Transaction {tx.get_hash()} added to mempool")
+            return True
+        finally:
+            # The locks only cover admission. Once in, the mempool's spent
+            # outpoints reject conflicts and are released on eviction,
+            # conflict removal and confirmation
             self.double_spend_protector.rollback_transaction(tx)
-            return False
             
     def mine_block(self, miner_address: str, reward: int = 50) -> Optional[Block]:
         """
@@ -229,60 +315,207 @@ class XorcoinSystem:
         current_height = len(self.blockchain.chain)
         actual_reward = XorcoinEconomics.get_block_reward(current_height)
         
-        # Create coinbase transaction
+        # Best-paying pending transactions that fit in a block
+        template = self.mempool.get_block_template()
+        
+        # Create coinbase transaction, claiming the fees
         coinbase_tx = Transaction(
-            version=1,
+            version=TX_VERSION_BINARY,
             chain_id=1,
             inputs=[],  # No inputs for coinbase
             outputs=[
-                TxOutput(amount=actual_reward, script_pubkey=miner_address)
+                TxOutput(amount=actual_reward + template.fees, script_pubkey=miner_address)
             ]
         )
         
         # Create new block with pending transactions
         block = Block(
-            transactions=[coinbase_tx] + list(self.mempool.transactions.values())[:10]  # Limit block size
+            transactions=[coinbase_tx] + template.transactions
         )
         
-        # Add block to blockchain
-        if self.blockchain.add_block(block):
+        # Add block to blockchain, reusing the template's merkle tree
+        if self.blockchain.add_block(block, merkle_root=template.merkle_root(coinbase_tx)):
             # Process block
-            self._process_block(block)
-            
-            # Clear processed transactions from mempool
-            for tx in block.transactions[1:]:  # Skip coinbase
-                if tx.get_hash() in self.mempool.transactions:
-                    del self.mempool.transactions[tx.get_hash()]
-                    
+            if not self._process_block(block):
+                self.blockchain.rewind(block.height)
+                return None
+                
             return block
             
         return None
         
-    def _process_block(self, block: Block) -> None:
-        """Process all transactions in a block"""
+    def _process_block(self, block: Block) -> bool:
+        """
+        Process all transactions in a block
+        
+        Returns False, leaving the UTXO set untouched, if the block spends
+        missing coins or creates value.
+        """
+        # Validate and apply the whole block in a scratch view first
+        undo = self.utxo_set.apply_block(block)
+        if undo is None:
+            print(f"Block {block.height} rejected")
+            return False
+            
+        # Store confirmed transactions
+        for tx in block.transactions:
+            self.confirmed_txs[tx.get_hash()] = tx
+            
+        # Clear them, and anything now double-spending them, from the mempool
+        self.mempool.remove_for_block(block)
+            
+        block_hash = block.get_header_hash()
+        if not self.blockchain.has_undo(block_hash):
+            self.blockchain.put_undo(block_hash, undo)
+            
+        # Blocks must reach disk before a chainstate that refers to them
+        if self.utxo_set.needs_flush():
+            self.blockchain.flush()
+        self.utxo_set.commit_block(block_hash, block.height)
+            
+        print(f"Block {block.height} processed with {len(block.transactions)} transactions")
+        return True
+        
+    def disconnect_block(self) -> Optional[Block]:
+        """
+        Roll back the tip block using its undo record
+        
+        Costs O(block size). Returns the disconnected block, or None if
+        the tip cannot be disconnected.
+        """
+        if len(self.blockchain.chain) <= 1:
+            print("Cannot disconnect the genesis block")
+            return None
+            
+        block = self.blockchain.get_latest_block()
+        undo = self.blockchain.get_undo(block.get_header_hash())
+        if undo is None or len(undo.spent) != len(block.transactions):
+            print(f"No undo data for block {block.height}")
+            return None
+            
+        self._undo_block(self.utxo_set, block, undo)
         for tx in block.transactions:
-            # Skip validation for coinbase transactions
-            if tx.inputs:
-                # Remove spent UTXOs
-                for inp in tx.inputs:
-                    utxo_id = inp.get_utxo_id()
-                    self.utxo_set.remove_utxo(utxo_id)
-                    
-            # Add new UTXOs
-            tx_hash = tx.get_hash()
-            for idx, out in enumerate(tx.outputs):
-                utxo = UTXO(
-                    tx_hash=tx_hash,
-                    output_index=idx,
-                    amount=out.amount,
-                    script_pubkey=out.script_pubkey
-                )
-                self.utxo_set.add_utxo(utxo)
+            self.confirmed_txs.pop(tx.get_hash(), None)
+            
+        self.blockchain.rewind(block.height)
+        tip = self.blockchain.get_latest_block()
+        if self.utxo_set.needs_flush():
+            self.blockchain.flush()
+        self.utxo_set.commit_block(tip.get_header_hash(), tip.height)
+        
+        print(f"Block {block.height} disconnected")
+        return block
+        
+    @staticmethod
+    def _undo_block(coins, block: Block, undo) -> None:
+        """Reverse a block's coin changes in coins, a UTXO set or view"""
+        # Walk transactions backwards so coins created and spent within the
+        # block end up removed
+        for tx, spent in zip(reversed(block.transactions), reversed(undo.spent)):
+            txid = tx.get_txid()
+            created = [OutPoint(txid, idx) for idx in range(len(tx.outputs))]
+            coins.batch_update(spent, created)
+            
+    def _validate_branch(self, fork_height: int, new_blocks: List[Block]) -> bool:
+        """
+        Fully validate a branch without touching the chain
+        
+        The blocks above the fork are undone and the branch connected in
+        a scratch view of the UTXO set, so each branch block is checked
+        by BlockValidator against exactly the coins it would spend.
+        """
+        view = CoinsViewCache(self.utxo_set)
+        try:
+            for height in range(len(self.blockchain.chain) - 1, fork_height - 1, -1):
+                block = self.blockchain.chain[height]
+                undo = self.blockchain.get_undo(block.get_header_hash())
+                if undo is None or len(undo.spent) != len(block.transactions):
+                    print(f"No undo data for block {block.height}")
+                    return False
+                self._undo_block(view, block, undo)
                 
-            # Store confirmed transaction
-            self.confirmed_txs[tx_hash] = tx
+            previous = self.blockchain.chain[fork_height - 1]
+            for block in new_blocks:
+                if (not get_block_validator()(view).validate_block(block, previous)
+                        or view.connect_block(block) is None):
+                    print(f"Invalid block {block.height} in new branch")
+                    return False
+                previous = block
+            return True
+        finally:
+            view.discard()
             
-        print(f"Block {block.height} processed with {len(block.transactions)} transactions")
+    def reorganize(self, new_blocks: List[Block]) -> bool:
+        """
+        Switch to a competing branch that forks at new_blocks[0].height
+        
+        The branch must carry more work than the blocks it replaces and is
+        validated in full before anything is disconnected. Only the blocks
+        above the fork point are disconnected, so the cost follows the
+        depth of the reorg rather than the chain length. Transactions from
+        disconnected blocks go back to the mempool unless the branch
+        confirms or double-spends them.
+        
+        Returns False if the branch was rejected, leaving the chain as it
+        was, or if the switch happened but some other disconnected
+        transaction could not re-enter the mempool.
+        """
+        if not new_blocks:
+            return False
+        fork_height = new_blocks[0].height
+        if not 0 < fork_height <= len(self.blockchain.chain):
+            print(f"Invalid fork height {fork_height}")
+            return False
+            
+        # Check the branch links up and is mined before touching the chain
+        prev_hash = self.blockchain.chain[fork_height - 1].get_header_hash()
+        for offset, block in enumerate(new_blocks):
+            if (block.height != fork_height + offset
+                    or block.prev_block_hash != prev_hash
+                    or not block.get_header_hash().startswith("0" * block.difficulty)):
+                print(f"Invalid block {block.height} in new branch")
+                return False
+            prev_hash = block.get_header_hash()
+            
+        old_work = ForkChoice.chain_work(self.blockchain.chain[fork_height:])
+        if ForkChoice.chain_work(new_blocks) <= old_work:
+            print("New branch does not have more work than the current chain")
+            return False
+        if not self._validate_branch(fork_height, new_blocks):
+            return False
+            
+        removed_blocks = []
+        while len(self.blockchain.chain) > fork_height:
+            block = self.disconnect_block()
+            if block is None:
+                return False
+            removed_blocks.insert(0, block)
+        removed_txs = [tx for block in removed_blocks for tx in block.transactions[1:]]
+            
+        for block in new_blocks:
+            self.blockchain.append_block(block)
+            if not self._process_block(block):
+                # Back out the new branch and reconnect the old one
+                self.blockchain.rewind(block.height)
+                while len(self.blockchain.chain) > fork_height:
+                    self.disconnect_block()
+                for old_block in removed_blocks:
+                    self.blockchain.append_block(old_block)
+                    self._process_block(old_block)
+                return False
+                
+        restored = True
+        for tx in removed_txs:
+            if tx.get_hash() in self.confirmed_txs or self.add_transaction(tx):
+                continue
+            # Dropping it is only right if the new branch spent one of its coins
+            coins = self.utxo_set.snapshot()
+            if all(coins.get_utxo(inp.get_utxo_id()) is not None
+                   or self.mempool.get_utxo(inp.get_utxo_id()) is not None
+                   for inp in tx.inputs):
+                print(f"Could not return transaction {tx.get_hash()} to the mempool")
+                restored = False
+        return restored
         
     def start_server(self, host: str = '0.0.0.0', port: int = 8443,
                     certfile: str = 'cert.pem', keyfile: str = 'key.pem') -> None:
@@ -328,6 +561,7 @@ class XorcoinSystem:
             "difficulty": latest_block.difficulty,
             "mempool_size": len(self.mempool.transactions),
             "utxo_count": len(self.utxo_set),
+            "utxo_commitment": self.utxo_set.snapshot().commitment().hex(),
             "current_reward": current_reward,
             "total_supply": total_supply,
             "blocks_until_halving": blocks_until_halving,
@@ -2,13 +2,16 @@
 Enhanced block validation with security checks
 """
 from typing import List, Set, Optional
-from xorcoin.core.models import Block, Transaction
+from xorcoin.core.coins_view import CoinsViewCache
+from xorcoin.core.models import Block, OutPoint, Transaction, UTXO
 from xorcoin.consensus.rules import ConsensusRules
+from .transaction import TransactionValidator
 
 class BlockValidator:
     """Comprehensive block validation"""
     
     def __init__(self, utxo_set):
+        # The coins as of previous_block, e.g. a CoinsViewCache
         self.utxo_set = utxo_set
         
     def validate_block(self, block: Block, previous_block: Block) -> bool:
@@ -31,6 +34,7 @@ class BlockValidator:
             
         # 5. Validate merkle root
         if not self._validate_merkle_root(block):
+            print(f"Block {block.height}: merkle root does not match its transactions")
             return False
             
         # 6. Validate all transactions
@@ -66,8 +70,8 @@ class BlockValidator:
         return calculated == block.merkle_root
         
     def _validate_transactions(self, block: Block) -> bool:
-        """Validate all transactions in block"""
-        used_utxos: Set[str] = set()
+        """Validate all transactions in block, signatures included"""
+        used_utxos: Set[OutPoint] = set()
         
         # Skip coinbase (first transaction)
         for tx in block.transactions[1:]:
@@ -79,6 +83,21 @@ class BlockValidator:
                     return False
                 used_utxos.add(utxo_id)
                 
+        # Check each transaction against the coins before it, in a scratch
+        # view so outputs of earlier transactions in the block are spendable
+        view = CoinsViewCache(self.utxo_set)
+        validator = TransactionValidator(view)
+        for index, tx in enumerate(block.transactions):
+            if index > 0 and not validator.validate_transaction(tx):
+                print(f"Block {block.height}: invalid transaction {tx.get_hash()}")
+                return False
+            txid = tx.get_txid()
+            view.batch_update(
+                [UTXO(OutPoint(txid, idx), out.amount, out.script_pubkey)
+                 for idx, out in enumerate(tx.outputs)],
+                [inp.get_utxo_id() for inp in tx.inputs]
+            )
+        view.discard()
         return True
         
     def _validate_coinbase(self, block: Block) -> bool:
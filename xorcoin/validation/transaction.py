@@ -3,8 +3,9 @@ Transaction validation for Xorcoin
 """
 
 import time
-from typing import List
-from xorcoin.core.models import Transaction
+from typing import Optional
+from xorcoin.core.mempool import Mempool
+from xorcoin.core.models import OutPoint, Transaction, UTXO
 from xorcoin.core.utxo import UTXOSet
 from xorcoin.crypto.keys import KeyManager
 from cryptography.hazmat.backends import default_backend
@@ -15,7 +16,7 @@ from cryptography.hazmat.primitives import serialization
 class TransactionValidator:
     """Validates Xorcoin transactions"""
     
-    def __init__(self, utxo_set: UTXOSet, mempool: List[Transaction]):
+    def __init__(self, utxo_set: UTXOSet, mempool: Optional[Mempool] = None):
         self.utxo_set = utxo_set
         self.mempool = mempool
         
@@ -44,6 +45,11 @@ class TransactionValidator:
             print("Transaction locktime not reached")
             return False
             
+        # Check output amounts are not negative
+        if any(out.amount < 0 for out in tx.outputs):
+            print("Output amounts must not be negative")
+            return False
+            
         total_input_amount = 0
         used_utxos = set()
         
@@ -51,8 +57,8 @@ class TransactionValidator:
         for idx, tx_input in enumerate(tx.inputs):
             utxo_id = tx_input.get_utxo_id()
             
-            # Check if UTXO exists
-            utxo = self.utxo_set.get_utxo(utxo_id)
+            # Check if UTXO exists, confirmed or from a mempool transaction
+            utxo = self._get_coin(utxo_id)
             if utxo is None:
                 print(f"Invalid UTXO: {utxo_id}")
                 return False
@@ -82,7 +88,6 @@ class TransactionValidator:
             return False
             
         # Additional validation rules can be added here
-        # - Check output amounts are positive
         # - Check script validity
         # - Check transaction size limits
         
@@ -120,19 +125,22 @@ class TransactionValidator:
             print(f"Signature verification error: {e}")
             return False
             
-    def _is_double_spend_in_mempool(self, utxo_id: str) -> bool:
+    def _get_coin(self, utxo_id: OutPoint) -> Optional[UTXO]:
+        """A confirmed coin, or an output of an unconfirmed mempool transaction"""
+        utxo = self.utxo_set.get_utxo(utxo_id)
+        if utxo is None and self.mempool is not None:
+            utxo = self.mempool.get_utxo(utxo_id)
+        return utxo
+        
+    def _is_double_spend_in_mempool(self, utxo_id: OutPoint) -> bool:
         """Check if UTXO is already being spent in mempool"""
-        for pending_tx in self.mempool:
-            for pending_input in pending_tx.inputs:
-                if pending_input.get_utxo_id() == utxo_id:
-                    return True
-        return False
+        return self.mempool is not None and self.mempool.get_spender(utxo_id) is not None
         
     def calculate_transaction_fee(self, tx: Transaction) -> int:
         """Calculate the fee for a transaction"""
         total_input = 0
         for tx_input in tx.inputs:
-            utxo = self.utxo_set.get_utxo(tx_input.get_utxo_id())
+            utxo = self._get_coin(tx_input.get_utxo_id())
             if utxo:
                 total_input += utxo.amount
                 